@@ -0,0 +1,100 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+from contextlib import contextmanager
+import math
+import re
+import time
+
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment)
+
+
+# The SQLite backend wraps the statements as QUERY = u'...' - PARAMS = ...
+STATEMENT = re.compile(r"^(?:QUERY = u?['\"])?\s*(\w+)", re.IGNORECASE)
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+TRANSACTION_STATEMENTS = (
+    "BEGIN", "SAVEPOINT", "RELEASE", "ROLLBACK", "COMMIT")
+
+
+def get_statement_type(sql):
+    """
+    Returns the upper-cased leading keyword of the SQL statement.
+    """
+    match = STATEMENT.match(sql)
+    return match.group(1).upper() if match else ""
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Runs the block against a freshly created test database, so benchmarks
+    never touch real data.
+    """
+    from south.management.commands import patch_for_test_db_setup
+    patch_for_test_db_setup()
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of the values.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+class Measurement(object):
+    """
+    Records the time taken and the queries issued by a block of code.
+
+    e.g. measurement = Measurement()
+         with measurement:
+             do_something()
+         measurement.report()
+    """
+
+    def __init__(self):
+        self.timings = []
+        self.queries = []
+        self.writes = []
+
+    def __enter__(self):
+        self._queries = CaptureQueriesContext(connection)
+        self._queries.__enter__()
+        self._start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timings.append((time.time() - self._start) * 1000)
+        self._queries.__exit__(exc_type, exc_value, traceback)
+        statements = [
+            get_statement_type(x["sql"])
+            for x in self._queries.captured_queries]
+        statements = [
+            x for x in statements if x not in TRANSACTION_STATEMENTS]
+        self.queries.append(len(statements))
+        self.writes.append(len([
+            x for x in statements if x in WRITE_STATEMENTS]))
+
+    def report(self):
+        """
+        Returns a dictionary summarising the measurements.
+        """
+        count = len(self.timings)
+        return {
+            "count": count,
+            "p50": percentile(self.timings, 50),
+            "p99": percentile(self.timings, 99),
+            "queries": sum(self.queries) / float(count or 1),
+            "writes": sum(self.writes) / float(count or 1),
+        }
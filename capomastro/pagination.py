@@ -0,0 +1,85 @@
+"""
+Keyset pagination for the listing pages.
+
+Rather than counting through an OFFSET, each page starts after the last item
+of the previous page, so page N costs the same to fetch as page 1.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404, HttpResponse
+
+
+PAGE_SIZE = 50
+
+
+def get_keyset_page(queryset, keys, after=None, page_size=PAGE_SIZE):
+    """
+    Returns a page of up to page_size items from the queryset in descending
+    order of the keys, starting after the item with the values in after.
+
+    The keys must uniquely identify an item, e.g. ("requested_at", "pk").
+
+    Returns a tuple of (items, more) where more is True if there are further
+    pages.
+    """
+    if after is not None:
+        query = Q()
+        for index, key in enumerate(keys):
+            condition = Q(**{"%s__lt" % key: after[index]})
+            for previous, value in zip(keys[:index], after[:index]):
+                condition &= Q(**{previous: value})
+            query |= condition
+        queryset = queryset.filter(query)
+    ordering = ["-%s" % key for key in keys]
+    items = list(queryset.order_by(*ordering)[:page_size + 1])
+    return items[:page_size], len(items) > page_size
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates the queryset from get_page_queryset by page_keys, newest first.
+
+    The "after" query parameter is the pk of the last item on the previous
+    page, and with "format=json" the page is returned as JSON with the
+    page_fields of each item.
+    """
+    page_size = PAGE_SIZE
+    page_keys = ("pk",)
+    page_fields = ()
+
+    def get_page_queryset(self):
+        raise NotImplementedError
+
+    def get_page(self):
+        """
+        Returns a tuple of (items, next) where next is the value for the
+        "after" parameter for the next page, or None on the last page.
+        """
+        queryset = self.get_page_queryset()
+        after = self.request.GET.get("after")
+        if after is not None:
+            try:
+                after = queryset.filter(pk=int(after)).values_list(
+                    *self.page_keys).get()
+            except (ValueError, queryset.model.DoesNotExist):
+                raise Http404("Invalid page")
+        items, more = get_keyset_page(
+            queryset, self.page_keys, after=after, page_size=self.page_size)
+        return items, items[-1].pk if more else None
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("format") == "json":
+            items, next_page = self.get_page()
+            data = {
+                "results": [
+                    dict((x, getattr(item, x)) for x in self.page_fields)
+                    for item in items],
+                "next": next_page,
+            }
+            return HttpResponse(
+                json.dumps(data, cls=DjangoJSONEncoder),
+                content_type="application/json")
+        return super(KeysetPaginationMixin, self).get(
+            request, *args, **kwargs)
@@ -72,6 +72,17 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/1.6/topics/cache/
+# The project pages are only cached with a cache shared between the web,
+# worker and notification receiver processes, see local_settings.py.example.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
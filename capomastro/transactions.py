@@ -0,0 +1,52 @@
+"""
+Running code once the current transaction has committed, like
+transaction.on_commit in later versions of Django.
+
+Django 1.6 has no hook for the end of a transaction, so this only knows
+about blocks wrapped in atomic() from here. Outside of them, on_commit runs
+the function straight away.
+"""
+from contextlib import contextmanager
+import threading
+
+from django.db import transaction
+
+
+_state = threading.local()
+
+
+@contextmanager
+def atomic(using=None):
+    """
+    Like transaction.atomic, but runs the functions passed to on_commit in
+    the block once the outermost atomic() from here exits without an
+    exception.
+
+    Functions passed to on_commit in a nested block that's rolled back still
+    run if the outer block commits.
+    """
+    outermost = getattr(_state, "callbacks", None) is None
+    if outermost:
+        _state.callbacks = []
+    try:
+        with transaction.atomic(using=using):
+            yield
+        callbacks = _state.callbacks if outermost else []
+    finally:
+        if outermost:
+            _state.callbacks = None
+    for func in callbacks:
+        func()
+
+
+def on_commit(func):
+    """
+    Runs func once the current atomic() commits, or now if we're not in one.
+
+    A function that's already waiting for the commit isn't added again.
+    """
+    callbacks = getattr(_state, "callbacks", None)
+    if callbacks is None:
+        func()
+    elif func not in callbacks:
+        callbacks.append(func)
@@ -0,0 +1,107 @@
+"""
+Replays generated Jenkins notifications against NotificationHandlerView, or
+writes them in batches as drain_notifications does.
+
+These use the test factories, so need the dev-requirements installed.
+"""
+import json
+import time
+
+from django.test.client import RequestFactory
+
+import mock
+
+from capomastro.benchmarks import Measurement
+from jenkins.models import Build
+from jenkins.notifications import (
+    apply_notifications, coalesce_notifications)
+from jenkins.tests.factories import JenkinsServerFactory, JobFactory
+from jenkins.views import NotificationHandlerView
+
+
+def create_jobs(servers, jobs_per_server):
+    """
+    Creates the servers, each with their own remote_addr, and jobs.
+    """
+    jobs = []
+    for index in range(servers):
+        server = JenkinsServerFactory.create(
+            remote_addr="10.%d.%d.1" % (index // 256, index % 256))
+        jobs.extend(JobFactory.create_batch(jobs_per_server, server=server))
+    return jobs
+
+
+def generate_notifications(jobs, builds_per_job):
+    """
+    Returns a list of (remote_addr, notification) for the jobs, with a
+    STARTED and FINISHED for each build, interleaved across the jobs as they
+    would be with concurrent builds.
+    """
+    notifications = []
+    for number in range(1, builds_per_job + 1):
+        for phase in ["STARTED", "FINISHED"]:
+            for job in jobs:
+                build = {
+                    "number": number,
+                    "phase": phase,
+                    "parameters": {"BUILD_ID": "%s.%d" % (job.name, number)},
+                    "url": "job/%s/%d/" % (job.name, number)}
+                if phase == "FINISHED":
+                    build["status"] = "SUCCESS"
+                notifications.append((job.server.remote_addr, {
+                    "build": build, "name": job.name,
+                    "url": "job/%s/" % job.name}))
+    return notifications
+
+
+def replay_notifications(notifications, rate=None):
+    """
+    Posts each notification to NotificationHandlerView, at rate notifications
+    per second if provided, and returns a report of the latency, queries and
+    writes per notification and the number of builds written.
+    """
+    factory = RequestFactory()
+    view = NotificationHandlerView.as_view()
+    measurement = Measurement()
+    builds_before = Build.objects.count()
+    started = time.time()
+    with mock.patch("jenkins.views.import_build"), \
+            mock.patch("jenkins.views.tail_console_log"):
+        for index, (remote_addr, notification) in enumerate(notifications):
+            if rate:
+                delay = started + index / float(rate) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            request = factory.post(
+                "/jenkins/notifications/", content_type="application/json",
+                data=json.dumps(notification), REMOTE_ADDR=remote_addr)
+            with measurement:
+                view(request)
+    report = measurement.report()
+    report["elapsed"] = time.time() - started
+    report["builds"] = Build.objects.count() - builds_before
+    return report
+
+
+def apply_buffered_notifications(notifications, batch_size=100):
+    """
+    Coalesces and writes the notifications in batches of batch_size, as
+    drain_notifications does with the spooled notifications, and returns a
+    report of the latency, queries and writes per batch with the queries
+    and writes per notification and the number of builds written.
+    """
+    measurement = Measurement()
+    builds_before = Build.objects.count()
+    started = time.time()
+    for start in range(0, len(notifications), batch_size):
+        batch = notifications[start:start + batch_size]
+        with measurement:
+            apply_notifications(coalesce_notifications(batch))
+    report = measurement.report()
+    report["elapsed"] = time.time() - started
+    report["builds"] = Build.objects.count() - builds_before
+    report["notifications"] = len(notifications)
+    count = float(len(notifications) or 1)
+    report["queries_per_notification"] = sum(measurement.queries) / count
+    report["writes_per_notification"] = sum(measurement.writes) / count
+    return report
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from jenkins.models import JenkinsServer, Job
+from jenkins.utils import DefaultSettings
+
+
+class ServerCache(object):
+    """
+    Per-process cache of the JenkinsServers by remote address, and the ids of
+    their jobs by name.
+
+    The cache is cleared by the model signals when a server or job is changed
+    in this process, and expires after NOTIFICATION_CACHE_TTL seconds so that
+    changes made in other processes are eventually picked up. Jobs created
+    in other processes are picked up by get_job_id once the name is no
+    longer remembered as unknown, after NOTIFICATION_UNKNOWN_JOB_TTL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._servers = None
+        self._jobs = {}
+        self._unknown_jobs = {}
+        self._loaded_at = None
+
+    def clear_jobs(self, server_id):
+        self._jobs.pop(server_id, None)
+        self._unknown_jobs.pop(server_id, None)
+
+    def _get_ttl(self):
+        defaults = DefaultSettings({"NOTIFICATION_CACHE_TTL": 300})
+        return defaults.NOTIFICATION_CACHE_TTL
+
+    def _get_unknown_job_ttl(self):
+        defaults = DefaultSettings({"NOTIFICATION_UNKNOWN_JOB_TTL": 30})
+        return defaults.NOTIFICATION_UNKNOWN_JOB_TTL
+
+    def _get_servers(self):
+        """
+        Returns the mapping of remote_addr to server, loading all the servers
+        if we don't have a current copy.
+        """
+        servers = self._servers
+        if servers is not None and (
+                time.time() - self._loaded_at < self._get_ttl()):
+            return servers
+        with self._lock:
+            servers = {}
+            # Where servers share a remote_addr, the oldest one wins.
+            for server in JenkinsServer.objects.order_by("-pk"):
+                servers[server.remote_addr] = server
+            self._jobs = {}
+            self._unknown_jobs = {}
+            self._servers = servers
+            self._loaded_at = time.time()
+        return servers
+
+    def get_server(self, remote_addr):
+        """
+        Returns the JenkinsServer with the remote_addr or None.
+        """
+        return self._get_servers().get(remote_addr)
+
+    def get_job_id(self, server, name):
+        """
+        Returns the id of the server's job with name, or None if the server
+        has no job with that name.
+
+        Names that aren't in the cache are looked up in the database, as the
+        job may have been created by another process since we loaded them,
+        and names that aren't found are remembered for a short time so that
+        repeated notifications for an unknown job don't query the database.
+        """
+        self._get_servers()
+        jobs = self._jobs.get(server.pk)
+        unknown = self._unknown_jobs.setdefault(server.pk, {})
+        if jobs is None:
+            jobs = dict(server.job_set.values_list("name", "pk"))
+            self._jobs[server.pk] = jobs
+        elif name not in jobs:
+            checked_at = unknown.get(name)
+            if checked_at is not None and (
+                    time.time() - checked_at < self._get_unknown_job_ttl()):
+                return None
+            job_id = server.job_set.filter(name=name).values_list(
+                "pk", flat=True).first()
+            if job_id is not None:
+                jobs[name] = job_id
+        if name not in jobs:
+            unknown[name] = time.time()
+        else:
+            unknown.pop(name, None)
+        return jobs.get(name)
+
+
+server_cache = ServerCache()
+
+
+@receiver(post_save, sender=JenkinsServer, dispatch_uid="server_cache_save")
+@receiver(
+    post_delete, sender=JenkinsServer, dispatch_uid="server_cache_delete")
+def invalidate_servers(sender, instance, **kwargs):
+    server_cache.clear()
+
+
+@receiver(post_save, sender=Job, dispatch_uid="server_cache_job_save")
+@receiver(post_delete, sender=Job, dispatch_uid="server_cache_job_delete")
+def invalidate_jobs(sender, instance, **kwargs):
+    server_cache.clear_jobs(instance.server_id)
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from jenkinsapi.utils.requester import Requester
+import requests
+
+from jenkins.models import JenkinsServer
+from jenkins.utils import DefaultSettings
+
+
+class SessionRequester(Requester):
+    """
+    A jenkinsapi Requester that keeps its HTTP connections alive between
+    requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SessionRequester, self).__init__(*args, **kwargs)
+        self.session = requests.Session()
+
+    def get_url(self, url, params=None, headers=None):
+        kwargs = self.get_request_dict(params=params, headers=headers)
+        return self.session.get(self._update_url_scheme(url), **kwargs)
+
+    def post_url(self, url, params=None, data=None, files=None, headers=None):
+        kwargs = self.get_request_dict(
+            params=params, data=data, files=files, headers=headers)
+        return self.session.post(self._update_url_scheme(url), **kwargs)
+
+
+class ClientRegistry(object):
+    """
+    Per-process registry of Jenkins clients, keyed by the server and its
+    credentials.
+
+    Clients are dropped by the model signals when a server is changed in
+    this process, and expire after JENKINS_CLIENT_TTL seconds so that they
+    pick up jobs added to Jenkins since.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._clients = {}
+
+    def clear_server(self, server_id):
+        with self._lock:
+            for key in self._clients.keys():
+                if key[0] == server_id:
+                    del self._clients[key]
+
+    def _get_ttl(self):
+        defaults = DefaultSettings({"JENKINS_CLIENT_TTL": 300})
+        return defaults.JENKINS_CLIENT_TTL
+
+    def get_client(self, server):
+        """
+        Returns a client for the server, creating one if we don't have a
+        current client.
+
+        Creating a client polls the server, so it's done without holding the
+        lock, if another thread stores a client for the server first, that
+        client is returned instead.
+        """
+        key = (server.pk, server.url, server.username, server.password)
+        with self._lock:
+            client = self._get_current_client(key)
+        if client is not None:
+            return client
+        new_client = server.create_client()
+        with self._lock:
+            client = self._get_current_client(key)
+            if client is None:
+                client = new_client
+                self._clients[key] = (client, time.time())
+        return client
+
+    def _get_current_client(self, key):
+        """
+        Returns the client stored for key if it hasn't expired, or None,
+        called with the lock held.
+        """
+        client, created_at = self._clients.get(key, (None, None))
+        if client is not None and (
+                time.time() - created_at < self._get_ttl()):
+            return client
+
+
+client_registry = ClientRegistry()
+
+
+@receiver(post_save, sender=JenkinsServer, dispatch_uid="clients_save")
+@receiver(post_delete, sender=JenkinsServer, dispatch_uid="clients_delete")
+def invalidate_clients(sender, instance, **kwargs):
+    client_registry.clear_server(instance.pk)
@@ -0,0 +1,140 @@
+import errno
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+import requests
+
+from jenkins.utils import DefaultSettings
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_console_log_settings():
+    """
+    Returns the settings for storing console logs.
+
+    CONSOLE_LOG_ROOT is the directory logs are stored under, and
+    CONSOLE_LOG_TAIL_INTERVAL the number of seconds between fetches of the
+    log for a running build.
+    """
+    return DefaultSettings({
+        "CONSOLE_LOG_ROOT": os.path.join(settings.BASE_DIR, "consolelogs"),
+        "CONSOLE_LOG_TAIL_INTERVAL": 10,
+    })
+
+
+def get_console_log_root():
+    """
+    Returns the directory that compressed console logs are stored under.
+    """
+    return get_console_log_settings().CONSOLE_LOG_ROOT
+
+
+def get_console_log_name(job_pk, build_number):
+    """
+    Returns the name of the log for a build, relative to the root.
+    """
+    return os.path.join(str(job_pk), "%d.log.gz" % build_number)
+
+
+def get_console_log_path(name):
+    """
+    Returns the full path to a stored log.
+    """
+    return os.path.join(get_console_log_root(), name)
+
+
+def compress_console_log(job_pk, chunks):
+    """
+    Compresses the chunks of a console log into a complete gzip member in a
+    temporary file, so that the output can be downloaded before anything is
+    appended to the log, and a failed fetch never leaves a truncated member
+    in the log.
+
+    Returns a tuple of (member, size, lines) with the uncompressed size and
+    the number of lines, the caller should close the member.
+    """
+    directory = get_console_log_path(str(job_pk))
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    size = lines = 0
+    member = tempfile.TemporaryFile(dir=directory)
+    try:
+        with gzip.GzipFile(fileobj=member, mode="wb") as log:
+            for chunk in chunks:
+                log.write(chunk)
+                size += len(chunk)
+                lines += chunk.count("\n")
+    except Exception:
+        member.close()
+        raise
+    member.seek(0)
+    return member, size, lines
+
+
+def append_console_log_member(job_pk, build_number, member):
+    """
+    Appends a member from compress_console_log to the log file for the
+    build, creating it if necessary.
+
+    Returns the name of the log.
+    """
+    name = get_console_log_name(job_pk, build_number)
+    with open(get_console_log_path(name), "ab") as log:
+        shutil.copyfileobj(member, log)
+    return name
+
+
+def append_console_log(job_pk, build_number, chunks):
+    """
+    Compresses the chunks of a console log and appends them to the log file
+    for the build, creating it if necessary.
+
+    Each call appends a complete gzip member.
+
+    Returns a tuple of (name, size, lines) with the uncompressed size and
+    the number of lines appended.
+    """
+    member, size, lines = compress_console_log(job_pk, chunks)
+    try:
+        if size:
+            append_console_log_member(job_pk, build_number, member)
+    finally:
+        member.close()
+    return get_console_log_name(job_pk, build_number), size, lines
+
+
+def open_console_log(name):
+    """
+    Returns a file-like object for reading the stored log.
+    """
+    return gzip.open(get_console_log_path(name), "rb")
+
+
+def fetch_console_log(build_url, start=0, **kwargs):
+    """
+    Fetches the console log for the build at build_url from the start offset,
+    using the Jenkins progressive text API, without loading it all into
+    memory.
+
+    The kwargs are passed through to requests, e.g. for authentication.
+
+    Returns a tuple of (chunks, offset, more) where offset is where the next
+    fetch should start, and more is True while the build is still running.
+    """
+    url = "%s/logText/progressiveText" % build_url.rstrip("/")
+    response = requests.get(
+        url, params={"start": start}, stream=True, **kwargs)
+    response.raise_for_status()
+    offset = int(response.headers.get("X-Text-Size", start))
+    more = response.headers.get("X-More-Data", "").lower() == "true"
+    return response.iter_content(CHUNK_SIZE), offset, more
@@ -1,43 +1,131 @@
+import errno
 import logging
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+import threading
+from urlparse import urljoin
 
-from jenkins.models import Job, Build, Artifact
+from django.db import connection
+
+from capomastro.transactions import atomic
+from jenkins.consolelogs import (
+    append_console_log_member, compress_console_log, fetch_console_log)
+from jenkins.models import (
+    CONSOLE_LOG_FIELDS, Job, Build, Artifact, builds_updated)
+from jenkins.rest import (
+    get_build_details, get_build_numbers, iter_build_pages)
 from jenkins.utils import generate_job_name
 
 
+def get_job_url(job):
+    """
+    Returns the URL for the job in its Jenkins server.
+    """
+    return urljoin(job.server.url, "job/%s/" % job.name)
+
+
+def get_build_url(job, build_number):
+    """
+    Returns the URL for a build of the job in its Jenkins server.
+    """
+    return urljoin(get_job_url(job), "%d/" % build_number)
+
+
+def tail_console_log_for_build(job_pk, build_number):
+    """
+    Append the console output of a build since the last fetch to the stored
+    log.
+
+    Returns True if the build is still running and the log should be
+    fetched again.
+    """
+    job = Job.objects.select_related("server").get(pk=job_pk)
+    return update_console_log(job, build_number)
+
+
+def update_console_log(job, build_number):
+    """
+    Append the console output of a build of the job since the last fetch.
+
+    The output is downloaded before the build is locked, so that
+    notifications and imports don't wait on Jenkins. It's only appended if
+    nothing else has moved the offset on since we read it, so that the
+    tailing task and the import never append the same output twice.
+
+    Returns True if the build is still running.
+    """
+    server = job.server
+    kwargs = {}
+    if server.username:
+        kwargs["auth"] = (server.username, server.password)
+
+    builds = Build.objects.filter(job=job, number=build_number)
+    start, phase = builds.values_list("console_log_offset", "phase").get()
+    chunks, offset, more = fetch_console_log(
+        get_build_url(job, build_number), start, **kwargs)
+    if offset > start:
+        member, size, lines = compress_console_log(job.pk, chunks)
+        try:
+            with atomic():
+                build = builds.select_for_update().get()
+                if build.console_log_offset == start:
+                    if size:
+                        build.console_log_file = append_console_log_member(
+                            job.pk, build_number, member)
+                    build.console_log_size += size
+                    build.console_log_lines += lines
+                    build.console_log_offset = offset
+                    build.save(update_fields=CONSOLE_LOG_FIELDS)
+        finally:
+            member.close()
+    return more and phase != "FINISHED"
+
+
 def import_build_for_job(job_pk, build_number):
     """
     Import a build for a job.
     """
-    job = Job.objects.get(pk=job_pk)
+    job = Job.objects.select_related("server").get(pk=job_pk)
     logging.info("Located job %s\n" % job)
 
     client = job.server.get_client()
     logging.info("Using server at %s\n" % job.server.url)
 
-    jenkins_job = client.get_job(job.name)
-    build_result = jenkins_job.get_build(build_number)
-
-    # TODO: Shouldn't access _data here.
-    build_details = {
-        "status": build_result.get_status(),
-        # TODO: What should we do with this ID we get from Jenkins?
-        # Discard? or only set it if we don't have one?
-        # "build_id": build_result._data["id"],
-        "duration": build_result._data["duration"],
-        "url": build_result.get_result_url(),
-        "console_log": build_result.get_console(),
-    }
+    import_build_with_client(job, client, build_number)
+
+
+def import_build_with_client(job, client, build_number):
+    """
+    Import a build using an existing client, so that the client can be
+    shared when importing many builds.
+
+    Builds that are still running are left to be imported once they've
+    finished.
+
+    Returns True if the build was imported.
+    """
+    build_details = get_build_details(
+        client, get_build_url(job, build_number))
+    if build_details["building"]:
+        logging.info("Skipping running build %s #%d" % (job, build_number))
+        return False
+    artifacts = build_details["artifacts"]
     logging.info("Processing build details for %s #%d" % (job, build_number))
-    Build.objects.filter(job=job, number=build_number).update(**build_details)
-    build = Build.objects.get(job=job, number=build_number)
-    for artifact in build_result.get_artifacts():
-        artifact_details = {
-            "filename": artifact.filename,
-            "url": artifact.url,
-            "build": build
-        }
-        logging.info("%s" % artifact_details)
-        Artifact.objects.create(**artifact_details)
+    # The BUILD_ID from a notification is kept if we already have the build.
+    build, _ = Build.objects.upsert(
+        job.pk, build_number, defaults={"build_id": build_details["build_id"]},
+        phase="FINISHED", status=build_details["status"],
+        duration=build_details["duration"], url=build_details["url"])
+    # Only fetches the output since the log was last tailed.
+    update_console_log(job, build_number)
+    created, deleted = Artifact.objects.replace_for_build(build, artifacts)
+    # Only now that everything is stored is the build complete.
+    Build.objects.filter(pk=build.pk).update(imported=True)
+    logging.info(
+        "Imported %d artifacts for %s #%d, %d new and %d removed" % (
+            len(artifacts), job, build_number, created, deleted))
+    return True
 
 
 def create_job(jobtype, server):
@@ -49,13 +137,51 @@ def create_job(jobtype, server):
     return job
 
 
-def import_builds_for_job(job_pk):
+class ImportCheckpoint(object):
+    """
+    Records the builds imported by import_builds_for_job in a file, one
+    build number per line, so that an interrupted import can be resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns the set of build numbers already imported.
+        """
+        try:
+            with open(self.path) as checkpoint:
+                return set(int(x) for x in checkpoint if x.strip())
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return set()
+
+    def add(self, build_number):
+        """
+        Records that the build has been imported.
+        """
+        with self.lock:
+            with open(self.path, "a") as checkpoint:
+                checkpoint.write("%d\n" % build_number)
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+
+def import_builds_for_job(job_pk, workers=4, checkpoint=None):
     """
     Import all Builds for a job using the job_pk.
 
-    TODO: Add testing - only used by command-line tool just now.
+    The builds are imported by a pool of worker threads sharing a single
+    client, taking the builds from a queue. Builds that have already been
+    imported, either according to the database or to the optional
+    ImportCheckpoint, are skipped, as are builds that are still running.
+
+    Returns a tuple of the number of builds (imported, skipped, failed).
     """
-    job = Job.objects.get(pk=job_pk)
+    job = Job.objects.select_related("server").get(pk=job_pk)
 
     logging.info("Located job %s\n" % job)
 
@@ -63,10 +189,122 @@ def import_builds_for_job(job_pk):
 
     logging.info("Using server at %s\n" % job.server.url)
 
-    jenkins_job = client.get_job(job.name)
-
-    good_build_numbers = list(jenkins_job.get_build_ids())
+    good_build_numbers = get_build_numbers(client, get_job_url(job))
     logging.info("%s\n" % good_build_numbers)
 
-    for build_number in good_build_numbers:
-        import_build_for_job(job.pk, build_number)
+    complete = set(Build.objects.filter(
+        job=job, imported=True).values_list("number", flat=True))
+    if checkpoint is not None:
+        complete.update(checkpoint.load())
+    build_numbers = [x for x in good_build_numbers if x not in complete]
+
+    def import_build(build_number):
+        try:
+            if not import_build_with_client(job, client, build_number):
+                return None
+        except Exception:
+            logging.exception(
+                "Failed to import %s #%d" % (job, build_number))
+            return False
+        if checkpoint is not None:
+            checkpoint.add(build_number)
+        return True
+
+    queue = Queue.Queue()
+    for build_number in build_numbers:
+        queue.put(build_number)
+
+    def import_queued_builds(worker):
+        results = []
+        try:
+            while True:
+                try:
+                    build_number = queue.get_nowait()
+                except Queue.Empty:
+                    return results
+                results.append(import_build(build_number))
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            results = sum(
+                pool.map(import_queued_builds, range(workers), chunksize=1),
+                [])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(import_build, build_numbers)
+
+    imported = results.count(True)
+    failed = results.count(False)
+    return (
+        imported, len(good_build_numbers) - imported - failed, failed)
+
+
+SYNCED_FIELDS = ("status", "duration", "url", "phase")
+
+
+def sync_builds_for_job(job_pk, page_size=500):
+    """
+    Sync the history of a job from Jenkins, fetching the builds a page at a
+    time and writing each page in a few queries.
+
+    Builds that are still running are left to the notifications, and the
+    console logs aren't fetched.
+
+    Returns a tuple of the number of builds (created, updated, unchanged).
+    """
+    job = Job.objects.select_related("server").get(pk=job_pk)
+    logging.info("Located job %s\n" % job)
+
+    client = job.server.get_client()
+    logging.info("Using server at %s\n" % job.server.url)
+
+    created = updated = unchanged = 0
+    pages = iter_build_pages(client, get_job_url(job), page_size=page_size)
+    for page in pages:
+        builds = dict(
+            (details["number"], dict(details, phase="FINISHED"))
+            for details in page if not details["building"])
+        with atomic():
+            new, changed = sync_builds(job, builds)
+        created += new
+        updated += changed
+        unchanged += len(builds) - new - changed
+        logging.info(
+            "Synced %d builds for %s, %d new and %d updated" % (
+                len(builds), job, new, changed))
+    return created, updated, unchanged
+
+
+def sync_builds(job, builds):
+    """
+    Create or update the builds for the job, and their artifacts, where
+    builds maps the build numbers to the details from Jenkins.
+
+    The builds are written in bulk, and the builds that were created or
+    changed are sent with builds_updated so that the projects are updated
+    as they would be by saving them.
+
+    Returns a tuple of the number of builds (created, updated).
+    """
+    written = Build.objects.upsert_many(dict(
+        ((job.pk, number), (
+            {"build_id": details["build_id"]},
+            dict((x, details[x]) for x in SYNCED_FIELDS)))
+        for number, details in builds.items()))
+
+    build_ids = dict(Build.objects.filter(
+        job=job, number__in=builds.keys()).values_list("number", "pk"))
+    Artifact.objects.replace_for_builds(dict(
+        (build_ids[number], details["artifacts"])
+        for number, details in builds.items()))
+    if written:
+        builds_updated.send(
+            sender=Build, job_ids=[job.pk], builds=[x[0] for x in written])
+    created = len([x for x in written if x[1]])
+    return created, len(written) - created
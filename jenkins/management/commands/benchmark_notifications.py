@@ -0,0 +1,62 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from capomastro.benchmarks import benchmark_database
+
+
+class Command(BaseCommand):
+    help = "Benchmark the notification handler in a temporary database"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--servers", dest="servers", type="int", default=2,
+            help="Number of Jenkins servers."),
+        make_option(
+            "--jobs", dest="jobs", type="int", default=10,
+            help="Number of jobs per server."),
+        make_option(
+            "--builds", dest="builds", type="int", default=10,
+            help="Number of builds per job."),
+        make_option(
+            "--rate", dest="rate", type="float", default=None,
+            help="Target notifications per second, unlimited by default."),
+        make_option(
+            "--buffered", dest="buffered", action="store_true",
+            default=False,
+            help="Write the notifications in batches, as drained from the "
+            "spool with NOTIFICATION_BUFFERED."),
+        make_option(
+            "--batch", dest="batch", type="int", default=100,
+            help="Number of notifications in each buffered batch."),
+    )
+
+    def handle(self, *args, **options):
+        from jenkins.benchmarks import (
+            apply_buffered_notifications, create_jobs,
+            generate_notifications, replay_notifications)
+
+        with benchmark_database():
+            jobs = create_jobs(options["servers"], options["jobs"])
+            notifications = generate_notifications(jobs, options["builds"])
+            if options["buffered"]:
+                report = apply_buffered_notifications(
+                    notifications, batch_size=options["batch"])
+            else:
+                report = replay_notifications(
+                    notifications, rate=options["rate"])
+
+        if options["buffered"]:
+            self.stdout.write(
+                "%(notifications)d notifications in %(count)d batches in "
+                "%(elapsed).2fs\n"
+                "latency p50 %(p50).2fms, p99 %(p99).2fms per batch\n"
+                "%(queries_per_notification).2f queries, "
+                "%(writes_per_notification).2f writes per notification\n"
+                "%(builds)d builds written\n" % report)
+        else:
+            self.stdout.write(
+                "%(count)d notifications in %(elapsed).2fs\n"
+                "latency p50 %(p50).2fms, p99 %(p99).2fms\n"
+                "%(queries).2f queries, %(writes).2f writes per notification\n"
+                "%(builds)d builds written\n" % report)
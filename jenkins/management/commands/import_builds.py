@@ -3,7 +3,8 @@ from optparse import make_option
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from jenkins.helpers import import_builds_for_job
+from jenkins.helpers import (
+    import_builds_for_job, sync_builds_for_job, ImportCheckpoint)
 
 
 class Command(BaseCommand):
@@ -12,8 +13,36 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option(
             "-j", dest="job_id",
-            help="Job Id to process"),)
+            help="Job Id to process"),
+        make_option(
+            "--workers", dest="workers", type="int", default=4,
+            help="Number of builds to import concurrently"),
+        make_option(
+            "--checkpoint", dest="checkpoint",
+            help="File to record imported builds in, to resume from"),
+        make_option(
+            "--sync", dest="sync", action="store_true", default=False,
+            help="Sync the build history in pages, without console logs"),
+        make_option(
+            "--page-size", dest="page_size", type="int", default=500,
+            help="Number of builds to fetch per request with --sync"),
+    )
 
     def handle(self, *args, **options):
-        import_builds_for_job(int(options['job_id']))
+        if options["sync"]:
+            created, updated, unchanged = sync_builds_for_job(
+                int(options["job_id"]), page_size=options["page_size"])
+            self.stdout.write(
+                "Created %d builds, updated %d, %d unchanged" % (
+                    created, updated, unchanged))
+        else:
+            checkpoint = None
+            if options["checkpoint"]:
+                checkpoint = ImportCheckpoint(options["checkpoint"])
+            imported, skipped, failed = import_builds_for_job(
+                int(options['job_id']), workers=options["workers"],
+                checkpoint=checkpoint)
+            self.stdout.write(
+                "Imported %d builds, skipped %d, %d failed" % (
+                    imported, skipped, failed))
         transaction.commit_unless_managed()
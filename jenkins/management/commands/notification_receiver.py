@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from jenkins.receiver import NotificationReceiver
+
+
+class Command(BaseCommand):
+    help = "Receive Jenkins notifications outside of the web server"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--host", dest="host", default="0.0.0.0",
+            help="Address to listen on."),
+        make_option(
+            "--port", dest="port", type="int", default=8001,
+            help="Port to listen on."),
+        make_option(
+            "--timeout", dest="timeout", type="int", default=60,
+            help="Seconds before idle connections are closed."),
+    )
+
+    def handle(self, *args, **options):
+        receiver = NotificationReceiver(
+            options["host"], options["port"], timeout=options["timeout"])
+        self.stdout.write(
+            "Receiving notifications on %s:%d\n" % (
+                options["host"], options["port"]))
+        receiver.serve_forever()
@@ -24,7 +24,8 @@ class VerifyServerTest(TestCase):
             messages = verify_jenkinsserver(server)
 
         mock_jenkins.assert_called_with(
-            server.url, username=u"root", password=u"testing")
+            server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.get_plugins.assert_called_once()
 
         self.assertEqual(
@@ -44,6 +45,7 @@ class VerifyServerTest(TestCase):
             messages = verify_jenkinsserver(server)
 
         mock_jenkins.assert_called_with(
-            server.url, username=u"root", password=u"testing")
+            server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         self.assertEqual(
             ["ERROR: [Errno 401] No authentication"], messages)
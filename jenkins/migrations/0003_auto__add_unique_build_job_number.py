@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding unique constraint on 'Build', fields ['job', 'number']
+        db.create_unique(u'jenkins_build', ['job_id', 'number'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'Build', fields ['job', 'number']
+        db.delete_unique(u'jenkins_build', ['job_id', 'number'])
+
+
+    models = {
+        u'jenkins.artifact': {
+            'Meta': {'object_name': 'Artifact'},
+            'build': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['jenkins.Build']"}),
+            'filename': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'jenkins.build': {
+            'Meta': {'ordering': "['-number']", 'unique_together': "(('job', 'number'),)", 'object_name': 'Build'},
+            'build_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'console_log': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['jenkins.Job']"}),
+            'number': ('django.db.models.fields.IntegerField', [], {}),
+            'phase': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'status': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'jenkins.jenkinsserver': {
+            'Meta': {'object_name': 'JenkinsServer'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'remote_addr': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'url': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'jenkins.job': {
+            'Meta': {'unique_together': "(('server', 'name'),)", 'object_name': 'Job'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'jobtype': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['jenkins.JobType']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'server': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['jenkins.JenkinsServer']"})
+        },
+        u'jenkins.jobtype': {
+            'Meta': {'object_name': 'JobType'},
+            'config_xml': ('django.db.models.fields.TextField', [], {}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['jenkins']
\ No newline at end of file
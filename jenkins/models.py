@@ -1,8 +1,31 @@
-from django.db import models
+from collections import defaultdict, OrderedDict
+import operator
+
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver, Signal
 from django.utils.encoding import python_2_unicode_compatible
 
 from jenkinsapi.jenkins import Jenkins
 
+from capomastro.transactions import atomic
+from jenkins.consolelogs import open_console_log
+
+
+# Signals
+# Sent for changes to builds and their artifacts that bypass post_save, with
+# the builds that were created or changed.
+builds_updated = Signal(providing_args=["job_ids", "builds"])
+
+# The number of builds written by each UPDATE in Build.objects.update_many.
+UPDATE_BATCH_SIZE = 100
+
+# The fields of a Build written as its console log is fetched.
+CONSOLE_LOG_FIELDS = (
+    "console_log_file", "console_log_size", "console_log_lines",
+    "console_log_offset")
+
 
 @python_2_unicode_compatible
 class JenkinsServer(models.Model):
@@ -21,10 +44,26 @@ class JenkinsServer(models.Model):
 
     def get_client(self):
         """
-        Returns a configured jenkinsapi Jenkins client.
+        Returns a configured jenkinsapi Jenkins client, shared by everything
+        in this process using the server.
+        """
+        # Imported here as the registry invalidates clients on model signals.
+        from jenkins.clients import client_registry
+        return client_registry.get_client(self)
+
+    def create_client(self):
         """
+        Returns a new jenkinsapi Jenkins client, with a requester that keeps
+        its connections alive.
+        """
+        from jenkins.clients import SessionRequester
+        # The client polls Jenkins as it's created, so the requester is
+        # passed in rather than replaced afterwards.
+        requester = SessionRequester(
+            self.username or None, self.password or None, baseurl=self.url)
         return Jenkins(
-            self.url, username=self.username, password=self.password)
+            self.url, username=self.username, password=self.password,
+            requester=requester)
 
 
 @python_2_unicode_compatible
@@ -41,12 +80,43 @@ class JobType(models.Model):
         return self.name
 
 
+class JobManager(models.Manager):
+
+    def update_latest_finished_build(self, build):
+        """
+        Points the job of a FINISHED build at it, unless the job already has
+        a later finished build.
+        """
+        return self.filter(pk=build.job_id).filter(
+            Q(latest_finished_build__isnull=True) |
+            Q(latest_finished_build__number__lt=build.number)).update(
+                latest_finished_build=build)
+
+    def reset_latest_finished_build(self, job_id):
+        """
+        Points the job at its FINISHED build with the highest number, if it
+        has no latest finished build, e.g. because that build was deleted.
+        """
+        build = Build.objects.filter(
+            job=job_id, phase="FINISHED").order_by("-number").first()
+        if build is not None:
+            self.filter(
+                pk=job_id, latest_finished_build__isnull=True).update(
+                    latest_finished_build=build)
+
+
 @python_2_unicode_compatible
 class Job(models.Model):
 
     server = models.ForeignKey(JenkinsServer)
     jobtype = models.ForeignKey(JobType)
     name = models.CharField(max_length=255)
+    # Maintained as builds finish, see update_latest_finished_build.
+    latest_finished_build = models.ForeignKey(
+        "Build", null=True, editable=False, related_name="+",
+        on_delete=models.SET_NULL)
+
+    objects = JobManager()
 
     class Meta:
         unique_together = "server", "name"
@@ -55,24 +125,276 @@ class Job(models.Model):
         return self.name
 
 
+class BuildManager(models.Manager):
+
+    def upsert(self, job_id, number, defaults=None, **fields):
+        """
+        Creates or updates the Build for the job and number, safe against
+        retried notifications and concurrent imports.
+
+        The fields are written whether or not the build exists, the defaults
+        are only used when the build is created.
+
+        Returns a tuple of (build, created).
+        """
+        params = dict(defaults or {}, job_id=job_id, number=number, **fields)
+        with atomic(using=self.db):
+            builds = self.select_for_update()
+            try:
+                build = builds.get(job_id=job_id, number=number)
+            except self.model.DoesNotExist:
+                try:
+                    with transaction.atomic(using=self.db):
+                        return self.create(**params), True
+                except IntegrityError:
+                    build = builds.get(job_id=job_id, number=number)
+            if fields:
+                for key, value in fields.items():
+                    setattr(build, key, value)
+                build.save(update_fields=fields.keys())
+            return build, False
+
+    def upsert_many(self, builds):
+        """
+        Creates or updates many builds in a few queries, where builds maps
+        (job_id, number) to a tuple of (defaults, fields) as for upsert.
+
+        The new builds are written with bulk_create and the changed builds
+        with update_many, so this doesn't send post_save, the caller should
+        send builds_updated with the builds.
+
+        Returns a list of (build, created) for the builds that were created
+        or changed.
+        """
+        if not builds:
+            return []
+        with atomic(using=self.db):
+            existing = dict(
+                ((build.job_id, build.number), build)
+                for build in self.select_for_update().filter(
+                    self._lookup(builds.keys())))
+            new = [
+                self.model(
+                    job_id=job_id, number=number,
+                    **dict(defaults or {}, **fields))
+                for (job_id, number), (defaults, fields) in builds.items()
+                if (job_id, number) not in existing]
+            try:
+                with transaction.atomic(using=self.db):
+                    self.bulk_create(new)
+            except IntegrityError:
+                # Another process created some of these builds since we
+                # looked.
+                return [
+                    self.upsert(job_id, number, defaults=defaults, **fields)
+                    for (job_id, number), (defaults, fields)
+                    in builds.items()]
+
+            changed = defaultdict(list)
+            for key, build in existing.items():
+                fields = builds[key][1]
+                if any(getattr(build, x) != y for x, y in fields.items()):
+                    for name, value in fields.items():
+                        setattr(build, name, value)
+                    changed[tuple(sorted(fields))].append(build)
+            for fields, changed_builds in changed.items():
+                self.update_many(changed_builds, fields)
+
+        written = []
+        if new:
+            written.extend(
+                (build, True) for build in self.filter(self._lookup(
+                    (x.job_id, x.number) for x in new)))
+        for changed_builds in changed.values():
+            written.extend((build, False) for build in changed_builds)
+        return written
+
+    def update_many(self, builds, fields):
+        """
+        Writes the fields of each of the builds, with a single UPDATE for
+        each batch of UPDATE_BATCH_SIZE builds.
+
+        Like update(), this doesn't send post_save.
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        opts = self.model._meta
+        for start in range(0, len(builds), UPDATE_BATCH_SIZE):
+            batch = builds[start:start + UPDATE_BATCH_SIZE]
+            assignments = []
+            params = []
+            for name in fields:
+                field = opts.get_field(name)
+                assignments.append("%s = CASE %s %s END" % (
+                    quote_name(field.column), quote_name(opts.pk.column),
+                    " ".join(["WHEN %s THEN %s"] * len(batch))))
+                for build in batch:
+                    params.extend([build.pk, field.get_db_prep_save(
+                        getattr(build, name), connection=connection)])
+            params.extend(build.pk for build in batch)
+            sql = "UPDATE %s SET %s WHERE %s IN (%s)" % (
+                quote_name(opts.db_table), ", ".join(assignments),
+                quote_name(opts.pk.column), ", ".join(["%s"] * len(batch)))
+            connection.cursor().execute(sql, params)
+
+    def _lookup(self, keys):
+        """
+        Returns a Q matching the builds for the (job_id, number) keys.
+        """
+        numbers = defaultdict(list)
+        for job_id, number in keys:
+            numbers[job_id].append(number)
+        return reduce(operator.or_, [
+            Q(job_id=job_id, number__in=job_numbers)
+            for job_id, job_numbers in numbers.items()])
+
+
 @python_2_unicode_compatible
 class Build(models.Model):
 
     job = models.ForeignKey(Job)
-    build_id = models.CharField(max_length=255)
+    build_id = models.CharField(max_length=255, db_index=True)
     number = models.IntegerField()
     duration = models.IntegerField(null=True)
     url = models.CharField(max_length=255)
     phase = models.CharField(max_length=25)  # FINISHED, STARTED, COMPLETED
     status = models.CharField(max_length=255)
-    console_log = models.TextField(blank=True, null=True)
+    console_log_file = models.CharField(max_length=255, blank=True)
+    console_log_size = models.BigIntegerField(default=0)
+    console_log_lines = models.IntegerField(default=0)
+    # Where the next fetch of the log from Jenkins starts, this is not the
+    # same as the size as Jenkins strips console annotations.
+    console_log_offset = models.BigIntegerField(default=0)
+    # Set once the console log and artifacts have been imported, so that an
+    # interrupted import of the job's builds picks this build up again.
+    imported = models.BooleanField(default=False)
+
+    objects = BuildManager()
 
     class Meta:
         ordering = ["-number"]
+        unique_together = "job", "number"
+        # For the latest build of a job in a phase.
+        index_together = [["job", "phase", "number"]]
+
+    def __init__(self, *args, **kwargs):
+        super(Build, self).__init__(*args, **kwargs)
+        # Without triggering a query if the phase is deferred.
+        self._loaded_phase = self.__dict__.get("phase")
 
     def __str__(self):
         return self.build_id
 
+    def save(self, *args, **kwargs):
+        self._finishing = self.phase == "FINISHED" and (
+            self._state.adding or self._loaded_phase != "FINISHED")
+        try:
+            super(Build, self).save(*args, **kwargs)
+        finally:
+            self._finishing = False
+        self._loaded_phase = self.phase
+
+    @staticmethod
+    def is_console_log_update(update_fields):
+        """
+        Returns True if the update_fields of a save are only the console log
+        fields, which post_save handlers interested in the state of the
+        build can ignore.
+        """
+        return bool(update_fields) and set(update_fields).issubset(
+            CONSOLE_LOG_FIELDS)
+
+    @property
+    def has_just_finished(self):
+        """
+        Returns True while the build is being saved as FINISHED, if it's new
+        or wasn't FINISHED when it was loaded.
+
+        This is for post_save handlers that should only run once per build.
+        """
+        return getattr(self, "_finishing", False)
+
+    def get_console_log(self):
+        """
+        Returns the text of the console log for this build.
+        """
+        if self.console_log_file:
+            log = open_console_log(self.console_log_file)
+            try:
+                return log.read()
+            finally:
+                log.close()
+        try:
+            return self.legacy_console_log.text
+        except BuildConsoleLog.DoesNotExist:
+            return None
+
+
+class BuildConsoleLog(models.Model):
+    """
+    The console log of a build imported before logs were stored in files,
+    kept apart so that queries on Build don't load it.
+    """
+
+    build = models.OneToOneField(
+        Build, primary_key=True, related_name="legacy_console_log")
+    text = models.TextField()
+
+
+class ArtifactManager(models.Manager):
+
+    def replace_for_build(self, build, artifacts):
+        """
+        Replaces the artifacts for the build with artifacts, a list of
+        (filename, url) tuples, so that importing a build again doesn't
+        duplicate them.
+
+        Returns a tuple of the number of artifacts (created, deleted).
+        """
+        return self.replace_for_builds({build.pk: artifacts})
+
+    def replace_for_builds(self, artifacts):
+        """
+        Replaces the artifacts for many builds, where artifacts is a
+        dictionary mapping build ids to lists of (filename, url) tuples.
+
+        Unchanged artifacts are kept, the rest are deleted and the new ones
+        are inserted in a single query, all while the builds are locked.
+
+        Returns a tuple of the number of artifacts (created, deleted).
+        """
+        wanted = dict(
+            (build_id, list(OrderedDict.fromkeys(build_artifacts)))
+            for build_id, build_artifacts in artifacts.items())
+        wanted_keys = set(
+            (build_id, filename, url)
+            for build_id, build_artifacts in wanted.items()
+            for filename, url in build_artifacts)
+        with atomic(using=self.db):
+            job_ids = set(Build.objects.select_for_update().filter(
+                pk__in=wanted.keys()).values_list("job", flat=True))
+            existing = set()
+            stale = []
+            current = self.filter(build__in=wanted.keys()).values_list(
+                "pk", "build", "filename", "url")
+            for pk, build_id, filename, url in current:
+                key = (build_id, filename, url)
+                if key in existing or key not in wanted_keys:
+                    stale.append(pk)
+                else:
+                    existing.add(key)
+            if stale:
+                self.filter(pk__in=stale).delete()
+            new = [
+                self.model(build_id=build_id, filename=filename, url=url)
+                for build_id, build_artifacts in wanted.items()
+                for filename, url in build_artifacts
+                if (build_id, filename, url) not in existing]
+            self.bulk_create(new)
+        if new or stale:
+            builds_updated.send(sender=Build, job_ids=job_ids)
+        return len(new), len(stale)
+
 
 @python_2_unicode_compatible
 class Artifact(models.Model):
@@ -81,5 +403,42 @@ class Artifact(models.Model):
     filename = models.CharField(max_length=255)
     url = models.CharField(max_length=255)
 
+    objects = ArtifactManager()
+
     def __str__(self):
         return "%s for %s" % (self.filename, self.build)
+
+
+def get_latest_finished_builds(builds):
+    """
+    Returns a list of the FINISHED build with the highest number for each of
+    the jobs of the builds.
+    """
+    latest = {}
+    for build in builds:
+        if build.phase == "FINISHED" and (
+                build.job_id not in latest or
+                build.number > latest[build.job_id].number):
+            latest[build.job_id] = build
+    return latest.values()
+
+
+@receiver(post_save, sender=Build, dispatch_uid="latest_finished_build")
+def handle_finished_build(sender, instance, **kwargs):
+    if instance.has_just_finished:
+        Job.objects.update_latest_finished_build(instance)
+
+
+@receiver(
+    post_delete, sender=Build, dispatch_uid="latest_finished_build_delete")
+def handle_deleted_build(sender, instance, **kwargs):
+    # Deleting the latest finished build cleared the job's pointer to it.
+    if instance.phase == "FINISHED":
+        Job.objects.reset_latest_finished_build(instance.job_id)
+
+
+@receiver(
+    builds_updated, sender=Build, dispatch_uid="latest_finished_builds")
+def handle_finished_builds(sender, builds=(), **kwargs):
+    for build in get_latest_finished_builds(builds):
+        Job.objects.update_latest_finished_build(build)
@@ -0,0 +1,327 @@
+from collections import OrderedDict
+import errno
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+
+from capomastro.transactions import atomic
+from jenkins.models import Build, Job, builds_updated
+from jenkins.utils import DefaultSettings
+
+
+# Later phases win when notifications for the same build are merged.
+PHASE_ORDER = {"STARTED": 0, "FINISHED": 1}
+
+
+def get_notification_settings():
+    """
+    Returns the settings controlling how notifications are ingested.
+    """
+    return DefaultSettings({
+        "NOTIFICATION_BUFFERED": False,
+        "NOTIFICATION_SPOOL": os.path.join(
+            settings.BASE_DIR, "notifications.spool"),
+    })
+
+
+def parse_notification(notification):
+    """
+    Returns a dictionary with the build details from a Jenkins notification.
+    """
+    build = notification["build"]
+    details = {
+        "name": notification["name"],
+        "number": build["number"],
+        "phase": build["phase"],
+        "build_id": "",
+    }
+    if "parameters" in build:
+        details["build_id"] = build["parameters"].get("BUILD_ID", "")
+    if details["phase"] == "FINISHED":
+        details["status"] = build["status"]
+        details["url"] = build["url"]
+    return details
+
+
+def parse_notification_or_none(notification):
+    """
+    Returns the details from parse_notification, or None if the notification
+    is missing any of the details we need.
+    """
+    try:
+        return parse_notification(notification)
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def get_build_fields(details):
+    """
+    Returns a tuple of (defaults, fields) for the Build from the parsed
+    notification details, as used by Build.objects.upsert.
+
+    The defaults are only used when the build is created, so that retried
+    notifications update the existing build, and a late STARTED won't
+    change a build that has already FINISHED.
+    """
+    defaults = {"build_id": details["build_id"], "phase": details["phase"]}
+    if details["phase"] == "FINISHED":
+        return defaults, {
+            "phase": details["phase"], "status": details["status"],
+            "url": details["url"]}
+    return defaults, {}
+
+
+def record_build(job_id, details):
+    """
+    Create or update the Build for the job from the parsed notification
+    details.
+
+    Returns a tuple of (build, created), or None for other phases.
+    """
+    if details["phase"] in PHASE_ORDER:
+        defaults, fields = get_build_fields(details)
+        return Build.objects.upsert(
+            job_id, details["number"], defaults=defaults, **fields)
+
+
+def coalesce_notifications(entries):
+    """
+    Merges queued notifications so that there's a single set of details for
+    each build, a STARTED followed by a FINISHED becomes a FINISHED.
+
+    Returns a list of (remote_addr, details) in the order that the builds
+    were first seen, notifications that can't be parsed are logged and
+    dropped.
+    """
+    merged = {}
+    order = []
+    for remote_addr, notification in entries:
+        details = parse_notification_or_none(notification)
+        if details is None:
+            logging.warn("Dropping invalid notification: %r" % notification)
+            continue
+        if details["phase"] not in PHASE_ORDER:
+            continue
+        build_key = (remote_addr, details["name"], details["number"])
+        if build_key not in merged:
+            merged[build_key] = details
+            order.append(build_key)
+            continue
+        current = merged[build_key]
+        if PHASE_ORDER[details["phase"]] >= PHASE_ORDER[current["phase"]]:
+            build_id = current["build_id"]
+            current.update(details)
+            current["build_id"] = details["build_id"] or build_id
+        elif not current["build_id"]:
+            current["build_id"] = details["build_id"]
+    return [(key[0], merged[key]) for key in order]
+
+
+def apply_notifications(notifications):
+    """
+    Writes the coalesced notifications to the database in a single
+    transaction, looking up the jobs and writing the builds in bulk.
+
+    Returns a tuple of lists of (job_pk, build_number) for the builds that
+    were created STARTED, and for the FINISHED builds.
+    """
+    if not notifications:
+        return [], []
+    remote_addrs = set(x[0] for x in notifications)
+    names = set(x[1]["name"] for x in notifications)
+    jobs = {}
+    for job in Job.objects.filter(
+            server__remote_addr__in=remote_addrs,
+            name__in=names).select_related("server"):
+        jobs[(job.server.remote_addr, job.name)] = job
+
+    builds = OrderedDict()
+    finished = []
+    for remote_addr, details in notifications:
+        job = jobs.get((remote_addr, details["name"]))
+        if job is None:
+            logging.warn(
+                "Notification for unknown job '%s'" % details["name"])
+            continue
+        builds[(job.pk, details["number"])] = get_build_fields(details)
+        if details["phase"] == "FINISHED":
+            finished.append((job.pk, details["number"]))
+
+    with atomic():
+        results = Build.objects.upsert_many(builds)
+        written = [x[0] for x in results]
+        if written:
+            builds_updated.send(
+                sender=Build, job_ids=set(x.job_id for x in written),
+                builds=written)
+    # Retried STARTED notifications shouldn't start tailing again.
+    started = [
+        (build.job_id, build.number) for build, created in results
+        if created and build.phase == "STARTED"]
+    return started, finished
+
+
+class NotificationSpool(object):
+    """
+    An append-only file of notifications waiting to be written to the
+    database.
+
+    Each line is a JSON encoded [remote_addr, notification] pair, appends are
+    serialised with an exclusive lock and synced to disk before returning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _open_locked(self):
+        """
+        Opens the spool for appending with an exclusive lock, making sure
+        that the file hasn't been claimed for draining while we waited.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        while True:
+            spool = open(self.path, "a")
+            fcntl.flock(spool, fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path)
+            except OSError:
+                current = None
+            if current and current.st_ino == os.fstat(spool.fileno()).st_ino:
+                return spool
+            spool.close()
+
+    def append(self, remote_addr, notification):
+        """
+        Durably append a notification to the spool.
+        """
+        spool = self._open_locked()
+        try:
+            spool.write(json.dumps([remote_addr, notification]) + "\n")
+            spool.flush()
+            os.fsync(spool.fileno())
+        finally:
+            spool.close()
+
+    def _claim(self, path, block=True):
+        """
+        Returns the claimed spool file opened with an exclusive lock, or None
+        if another drainer holds or has already processed it.
+        """
+        try:
+            claimed = open(path, "r")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        flags = fcntl.LOCK_EX
+        if not block:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(claimed, flags)
+        except IOError as e:
+            claimed.close()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return
+            raise
+        if not os.path.exists(path):
+            # Another drainer processed this file while we waited.
+            claimed.close()
+            return
+        return claimed
+
+    def drain(self, process):
+        """
+        Claims the queued notifications and passes them to process, the
+        claimed files are only removed once process returns, so anything
+        left over from an interrupted or failed drain is picked up on the
+        next call.
+
+        Returns a list of the values returned by process for each of the
+        files that were processed, a file that fails is logged and left for
+        the next call without stopping the others.
+        """
+        claimed = []
+        if os.path.exists(self.path):
+            claimed_path = "%s.%f.draining" % (self.path, time.time())
+            try:
+                os.rename(self.path, claimed_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                claimed.append(claimed_path)
+
+        leftovers = sorted(set(glob.glob(self.path + ".*.draining")) -
+                           set(claimed))
+        results = []
+        for path in leftovers + claimed:
+            spool = self._claim(path, block=path in claimed)
+            if spool is None:
+                continue
+            try:
+                entries = self._read_entries(spool)
+                try:
+                    results.append(process(entries))
+                except Exception:
+                    logging.exception("Failed to process %s" % path)
+                    continue
+                os.unlink(path)
+            finally:
+                spool.close()
+        return results
+
+    def _read_entries(self, spool):
+        """
+        Returns the entries in the spool file, lines that can't be decoded
+        are logged and dropped.
+        """
+        entries = []
+        for line in spool:
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logging.warn("Dropping invalid spool entry: %r" % line)
+        return entries
+
+
+def get_notification_spool():
+    """
+    Returns the configured NotificationSpool.
+    """
+    return NotificationSpool(get_notification_settings().NOTIFICATION_SPOOL)
+
+
+def enqueue_notification(remote_addr, notification):
+    """
+    Queues a notification for the next drain_notifications.
+    """
+    get_notification_spool().append(remote_addr, notification)
+
+
+def drain_notifications():
+    """
+    Coalesces and writes all queued notifications.
+
+    Returns a tuple of lists of (job_pk, build_number) for the builds that
+    were created STARTED, and for the FINISHED builds.
+    """
+    def process(entries):
+        return apply_notifications(coalesce_notifications(entries))
+    started, finished = [], []
+    for file_started, file_finished in get_notification_spool().drain(process):
+        started.extend(file_started)
+        finished.extend(file_finished)
+    return started, finished
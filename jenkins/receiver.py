@@ -0,0 +1,175 @@
+"""
+A standalone receiver for Jenkins notifications.
+
+This speaks the same JSON contract as NotificationHandlerView, but runs in a
+single asyncore event loop so that it can hold thousands of slow connections
+without tying up the web workers. The notifications are handed over to the
+record_notification Celery task.
+"""
+import asynchat
+import asyncore
+import json
+import logging
+import socket
+import time
+
+from django.core.urlresolvers import reverse
+from django.db import close_old_connections
+
+from jenkins.cache import server_cache
+from jenkins.tasks import record_notification
+
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+RESPONSES = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    412: "Precondition Failed",
+    413: "Request Entity Too Large",
+}
+
+
+def handle_notification(remote_addr, body):
+    """
+    Validate a notification and queue it for recording.
+
+    Returns the HTTP status code for the response.
+    """
+    server = server_cache.get_server(remote_addr)
+    if server is None:
+        logging.warn(
+            "Could not find server with REMOTE_ADDR: %s" % remote_addr)
+        return 412
+    try:
+        notification = json.loads(body)
+        name = notification["name"]
+    except (ValueError, KeyError, TypeError):
+        return 400
+
+    job_id = server_cache.get_job_id(server, name)
+    if job_id is None:
+        logging.warn("Notification for unknown job '%s'" % name)
+        return 412
+    record_notification.delay(job_id, notification)
+    return 200
+
+
+class NotificationChannel(asynchat.async_chat):
+    """
+    Reads a single HTTP request from a connection and responds to it.
+    """
+
+    def __init__(self, sock, remote_addr, path, map=None):
+        asynchat.async_chat.__init__(self, sock, map=map)
+        self.remote_addr = remote_addr
+        self.path = path
+        self.buffer = []
+        self.received = 0
+        self.request = None
+        self.responded = False
+        self.last_activity = time.time()
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        self.last_activity = time.time()
+        if self.responded:
+            return
+        self.received += len(data)
+        if self.request is None and self.received > MAX_HEADER_SIZE:
+            self.respond(413)
+            return
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        data = "".join(self.buffer)
+        self.buffer = []
+        if self.request is None:
+            self.handle_headers(data)
+        else:
+            self.respond(handle_notification(self.remote_addr, data))
+
+    def handle_headers(self, data):
+        lines = data.split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            self.respond(400)
+            return
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        self.request = (method, path)
+
+        if method != "POST":
+            self.respond(405)
+        elif path.split("?")[0] != self.path:
+            self.respond(404)
+        else:
+            try:
+                length = int(headers.get("content-length", ""))
+            except ValueError:
+                self.respond(400)
+                return
+            if length > MAX_BODY_SIZE:
+                self.respond(413)
+            elif length == 0:
+                self.respond(handle_notification(self.remote_addr, ""))
+            else:
+                self.received = 0
+                self.set_terminator(length)
+
+    def respond(self, status):
+        if self.responded:
+            return
+        self.responded = True
+        self.set_terminator(None)
+        self.push(
+            "HTTP/1.0 %d %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+            % (status, RESPONSES[status]))
+        self.close_when_done()
+
+    def handle_error(self):
+        logging.exception("Error handling notification")
+        self.close()
+
+
+class NotificationReceiver(asyncore.dispatcher):
+    """
+    Listens for Jenkins notifications.
+    """
+
+    def __init__(self, host, port, timeout=60, map=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.timeout = timeout
+        self.path = reverse("jenkins_notifications")
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(1024)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            sock, addr = pair
+            NotificationChannel(sock, addr[0], self.path, map=self._map)
+
+    def close_idle_channels(self):
+        """
+        Drop connections that haven't sent anything within the timeout.
+        """
+        cutoff = time.time() - self.timeout
+        for channel in self._map.values():
+            if (isinstance(channel, NotificationChannel) and
+                    channel.last_activity < cutoff):
+                channel.close()
+
+    def serve_forever(self):
+        while True:
+            asyncore.loop(timeout=1, use_poll=True, map=self._map, count=1)
+            self.close_idle_channels()
+            close_old_connections()
@@ -0,0 +1,95 @@
+"""
+Fetches just the fields we store from the Jenkins JSON API.
+
+jenkinsapi polls the complete job and build documents, which for jobs with
+long histories include a reference to every build. The tree parameter lets
+Jenkins filter the response down to the fields we ask for.
+"""
+BUILD_TREE = (
+    "number,building,result,duration,url,artifacts[fileName,relativePath],"
+    "actions[parameters[name,value]]")
+BUILD_NUMBERS_TREE = "allBuilds[number]"
+# Jenkins applies the {start,end} range to allBuilds, newest first.
+ALL_BUILDS_TREE = "allBuilds[" + BUILD_TREE + "]{%d,%d}"
+
+
+def fetch_json(client, url, tree):
+    """
+    Fetches the fields in tree from the JSON API for the object at url with
+    the client's requester.
+    """
+    response = client.requester.get_url(
+        "%s/api/json" % url.rstrip("/"), params={"tree": tree})
+    response.raise_for_status()
+    return response.json()
+
+
+def get_build_details(client, build_url):
+    """
+    Returns a dictionary with the details from parse_build for the build at
+    build_url.
+    """
+    return parse_build(fetch_json(client, build_url, BUILD_TREE))
+
+
+def parse_build(data):
+    """
+    Returns the details we store from the JSON for a build, with whether
+    it's still building and the BUILD_ID parameter, where the artifacts are a
+    list of (filename, url) tuples.
+    """
+    artifact_url = "%s/artifact/" % data["url"].rstrip("/")
+    return {
+        # Jenkins has no result until the build is complete.
+        "status": data["result"] or "",
+        "duration": data["duration"],
+        # This is the same URL we stored when using jenkinsapi.
+        "url": "%stestReport/api/python" % data["url"],
+        "artifacts": [
+            (artifact["fileName"], artifact_url + artifact["relativePath"])
+            for artifact in data["artifacts"]],
+        "building": data.get("building", False),
+        "build_id": get_build_parameters(data).get("BUILD_ID") or "",
+    }
+
+
+def get_build_parameters(data):
+    """
+    Returns a dictionary of the parameters the build was started with.
+    """
+    parameters = {}
+    for action in data.get("actions") or []:
+        for parameter in (action or {}).get("parameters", []):
+            parameters[parameter["name"]] = parameter.get("value")
+    return parameters
+
+
+def iter_build_pages(client, job_url, page_size=500):
+    """
+    Yields the builds of the job at job_url in pages of up to page_size,
+    newest first, each as a list of dictionaries with the number as well as
+    the details from parse_build.
+    """
+    start = 0
+    while True:
+        data = fetch_json(
+            client, job_url, ALL_BUILDS_TREE % (start, start + page_size))
+        page = []
+        for build in data["allBuilds"]:
+            details = parse_build(build)
+            details["number"] = build["number"]
+            page.append(details)
+        if page:
+            yield page
+        if len(data["allBuilds"]) < page_size:
+            return
+        start += page_size
+
+
+def get_build_numbers(client, job_url):
+    """
+    Returns the numbers of all the builds of the job at job_url, newest
+    first.
+    """
+    data = fetch_json(client, job_url, BUILD_NUMBERS_TREE)
+    return sorted((x["number"] for x in data["allBuilds"]), reverse=True)
@@ -1,8 +1,12 @@
 from celery.utils.log import get_task_logger
 from celery import shared_task
+from jenkinsapi.custom_exceptions import UnknownJob
 
-from jenkins.helpers import import_build_for_job
+from jenkins.consolelogs import get_console_log_settings
+from jenkins.helpers import import_build_for_job, tail_console_log_for_build
 from jenkins.models import Job
+from jenkins.notifications import (
+    drain_notifications as drain, parse_notification, record_build)
 from jenkins.utils import get_job_xml_for_upload
 
 logger = get_task_logger(__name__)
@@ -13,6 +17,51 @@ def import_build(job_id, build_number):
     import_build_for_job(job_id, build_number)
 
 
+@shared_task
+def tail_console_log(job_pk, build_number):
+    """
+    Fetch the new console output of a running build, and reschedule until
+    the build finishes, when import_build fetches whatever is left.
+    """
+    if tail_console_log_for_build(job_pk, build_number):
+        tail_console_log.apply_async(
+            (job_pk, build_number),
+            countdown=get_console_log_settings().CONSOLE_LOG_TAIL_INTERVAL)
+
+
+@shared_task
+def record_notification(job_pk, notification):
+    """
+    Record a notification accepted by the notification receiver.
+    """
+    details = parse_notification(notification)
+    result = record_build(job_pk, details)
+    # Retried STARTED notifications shouldn't start tailing again.
+    if details["phase"] == "STARTED" and result[1]:
+        tail_console_log.delay(job_pk, details["number"])
+    elif details["phase"] == "FINISHED":
+        import_build.delay(job_pk, details["number"])
+
+
+@shared_task
+def drain_notifications():
+    """
+    Write the queued notifications to the database, tail the console logs
+    of the builds that have STARTED and import the builds that have
+    FINISHED.
+
+    This should be scheduled periodically when NOTIFICATION_BUFFERED is set.
+    """
+    started, finished = drain()
+    for job_pk, build_number in started:
+        tail_console_log.delay(job_pk, build_number)
+    for job_pk, build_number in finished:
+        import_build.delay(job_pk, build_number)
+    logger.info(
+        "Drained notifications for %d started and %d finished builds" % (
+            len(started), len(finished)))
+
+
 @shared_task
 def build_job(job_pk, build_id=None, params=None):
     """
@@ -26,7 +75,12 @@ def build_job(job_pk, build_id=None, params=None):
         params = {}
     if build_id is not None:
         params["BUILD_ID"] = build_id
-    client.build_job(job.name, params=params)
+    try:
+        client.build_job(job.name, params=params)
+    except UnknownJob:
+        # The shared client may not know about a recently created job yet.
+        client.poll()
+        client.build_job(job.name, params=params)
 
 
 @shared_task
@@ -37,6 +91,8 @@ def push_job_to_jenkins(job_pk):
     job = Job.objects.get(pk=job_pk)
     xml = get_job_xml_for_upload(job)
     client = job.server.get_client()
+    # Make sure the shared client has an up to date list of jobs.
+    client.poll()
 
     if client.has_job(job.name):
         job = client.get_job(job.name)
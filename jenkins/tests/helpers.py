@@ -1,6 +1,9 @@
 from os import path
 import inspect
+from unittest import skipUnless
 
+from django.db import connection
+from django.test import TestCase
 from httmock import urlmatch
 
 
@@ -33,3 +36,39 @@ def mock_url(url, fixture, mock_requests=None):
             mock_requests.append(request)
         return data
     return mock_url
+
+
+def explain(queryset):
+    """
+    Returns the lines of SQLite's query plan for the queryset.
+    """
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def is_table_scan(line):
+    """
+    Returns True if the line of the query plan reads a whole table.
+    """
+    return line.startswith("SCAN ") and "INDEX" not in line
+
+
+@skipUnless(connection.vendor == "sqlite", "The query plans are SQLite's.")
+class QueryPlanTestCase(TestCase):
+    """
+    Checks the query plans of querysets against the test database.
+    """
+
+    def analyze(self):
+        """
+        Updates the statistics the query planner uses once the test data
+        has been created.
+        """
+        connection.cursor().execute("ANALYZE")
+
+    def assertNoTableScans(self, queryset):
+        plan = explain(queryset)
+        scans = [line for line in plan if is_table_scan(line)]
+        self.assertEqual([], scans, "\n".join(plan))
@@ -0,0 +1,79 @@
+from django.test import TestCase, SimpleTestCase
+
+from capomastro.benchmarks import percentile, get_statement_type
+from jenkins.benchmarks import (
+    apply_buffered_notifications, create_jobs, generate_notifications,
+    replay_notifications)
+from jenkins.models import Build
+
+
+class PercentileTest(SimpleTestCase):
+
+    def test_percentile(self):
+        """
+        percentile should return the nearest-rank percentile.
+        """
+        values = range(1, 101)
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(1, percentile([1], 99))
+        self.assertEqual(0, percentile([], 50))
+
+    def test_get_statement_type(self):
+        """
+        get_statement_type should return the SQL keyword, including from the
+        SQLite backend's formatting.
+        """
+        self.assertEqual(
+            "INSERT", get_statement_type("INSERT INTO jenkins_build"))
+        self.assertEqual(
+            "UPDATE", get_statement_type(
+                "QUERY = u'UPDATE \"jenkins_build\"' - PARAMS = ()"))
+
+
+class ReplayNotificationsTest(TestCase):
+
+    def test_generate_notifications(self):
+        """
+        We should get a STARTED and FINISHED notification for each build of
+        each job.
+        """
+        jobs = create_jobs(2, 3)
+        notifications = generate_notifications(jobs, 2)
+
+        self.assertEqual(24, len(notifications))
+        self.assertEqual(
+            set([job.server.remote_addr for job in jobs]),
+            set([x[0] for x in notifications]))
+
+    def test_replay_notifications(self):
+        """
+        replay_notifications should record the builds and report on the
+        requests.
+        """
+        jobs = create_jobs(1, 2)
+        report = replay_notifications(generate_notifications(jobs, 2))
+
+        self.assertEqual(8, report["count"])
+        self.assertEqual(4, report["builds"])
+        self.assertEqual(4, Build.objects.filter(phase="FINISHED").count())
+        self.assertTrue(report["queries"] > 0)
+        self.assertTrue(report["writes"] > 0)
+        self.assertTrue(report["p99"] >= report["p50"])
+
+    def test_apply_buffered_notifications(self):
+        """
+        apply_buffered_notifications should write the builds in batches,
+        taking fewer queries per notification than the notifications view.
+        """
+        jobs = create_jobs(1, 2)
+        notifications = generate_notifications(jobs, 5)
+        report = apply_buffered_notifications(
+            notifications[:8], batch_size=8)
+        replayed = replay_notifications(notifications[8:])
+
+        self.assertEqual(1, report["count"])
+        self.assertEqual(8, report["notifications"])
+        self.assertEqual(4, report["builds"])
+        self.assertTrue(
+            report["queries_per_notification"] < replayed["queries"])
@@ -0,0 +1,117 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+import mock
+
+from jenkins.cache import ServerCache, server_cache
+from .factories import JenkinsServerFactory, JobFactory
+
+
+class ServerCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = ServerCache()
+
+    def test_get_server(self):
+        """
+        get_server should return the server with the remote_addr, and only
+        query the database the first time.
+        """
+        server = JenkinsServerFactory.create(remote_addr="10.0.0.1")
+        self.assertEqual(server, self.cache.get_server("10.0.0.1"))
+        with self.assertNumQueries(0):
+            self.assertEqual(server, self.cache.get_server("10.0.0.1"))
+            self.assertIsNone(self.cache.get_server("10.0.0.2"))
+
+    def test_get_job_id(self):
+        """
+        get_job_id should return the id for the server's job with the name,
+        or None if there's no such job.
+        """
+        server = JenkinsServerFactory.create()
+        job = JobFactory.create(server=server, name="testing")
+        JobFactory.create(name="testing")
+        self.assertEqual(job.pk, self.cache.get_job_id(server, "testing"))
+        with self.assertNumQueries(0):
+            self.assertEqual(job.pk, self.cache.get_job_id(server, "testing"))
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.get_job_id(server, "unknown"))
+
+    @override_settings(NOTIFICATION_UNKNOWN_JOB_TTL=30)
+    def test_get_job_id_for_unknown_job(self):
+        """
+        A name that wasn't found isn't looked up again until
+        NOTIFICATION_UNKNOWN_JOB_TTL seconds have passed.
+        """
+        server = JenkinsServerFactory.create()
+        with mock.patch("jenkins.cache.time") as mock_time:
+            mock_time.time.return_value = 1000
+            self.assertIsNone(self.cache.get_job_id(server, "unknown"))
+            mock_time.time.return_value = 1029
+            with self.assertNumQueries(0):
+                self.assertIsNone(self.cache.get_job_id(server, "unknown"))
+            mock_time.time.return_value = 1031
+            with self.assertNumQueries(1):
+                self.assertIsNone(self.cache.get_job_id(server, "unknown"))
+
+    @override_settings(NOTIFICATION_UNKNOWN_JOB_TTL=30)
+    def test_get_job_id_for_new_job(self):
+        """
+        A job created since the jobs were cached, e.g. by another process
+        where the signals don't clear this cache, is looked up and added to
+        the cache once its name is no longer remembered as unknown.
+        """
+        server = JenkinsServerFactory.create()
+        with mock.patch("jenkins.cache.time") as mock_time:
+            mock_time.time.return_value = 1000
+            self.assertIsNone(self.cache.get_job_id(server, "testing"))
+            job = JobFactory.create(server=server, name="testing")
+            self.assertIsNone(self.cache.get_job_id(server, "testing"))
+
+            mock_time.time.return_value = 1031
+            self.assertEqual(
+                job.pk, self.cache.get_job_id(server, "testing"))
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    job.pk, self.cache.get_job_id(server, "testing"))
+
+    @override_settings(NOTIFICATION_CACHE_TTL=60)
+    def test_cache_expires(self):
+        """
+        After NOTIFICATION_CACHE_TTL seconds, the servers are reloaded.
+        """
+        JenkinsServerFactory.create(remote_addr="10.0.0.1")
+        with mock.patch("jenkins.cache.time") as mock_time:
+            mock_time.time.return_value = 1000
+            self.cache.get_server("10.0.0.1")
+            mock_time.time.return_value = 1061
+            with self.assertNumQueries(1):
+                self.cache.get_server("10.0.0.1")
+
+
+class ServerCacheInvalidationTest(TestCase):
+
+    def test_server_changes_invalidate_cache(self):
+        """
+        Saving or deleting a server clears the cached servers.
+        """
+        server = JenkinsServerFactory.create(remote_addr="10.0.0.1")
+        self.assertEqual(server, server_cache.get_server("10.0.0.1"))
+
+        server.remote_addr = "10.0.0.2"
+        server.save()
+        self.assertIsNone(server_cache.get_server("10.0.0.1"))
+        self.assertEqual(server, server_cache.get_server("10.0.0.2"))
+
+        server.delete()
+        self.assertIsNone(server_cache.get_server("10.0.0.2"))
+
+    def test_job_changes_invalidate_cache(self):
+        """
+        Creating a job clears the cached jobs for the server.
+        """
+        server = JenkinsServerFactory.create()
+        self.assertIsNone(server_cache.get_job_id(server, "testing"))
+
+        job = JobFactory.create(server=server, name="testing")
+        self.assertEqual(job.pk, server_cache.get_job_id(server, "testing"))
@@ -0,0 +1,130 @@
+import threading
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from httmock import HTTMock
+import mock
+
+from jenkins.clients import (
+    ClientRegistry, SessionRequester, client_registry)
+from .helpers import mock_url
+from .factories import JenkinsServerFactory
+
+
+class ClientRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = ClientRegistry()
+        self.server = JenkinsServerFactory.create()
+
+    def test_get_client(self):
+        """
+        get_client should create a client for the server the first time, and
+        return the same client after that.
+        """
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins:
+            client = self.registry.get_client(self.server)
+            self.assertEqual(client, self.registry.get_client(self.server))
+
+        mock_jenkins.assert_called_once_with(
+            self.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
+        self.assertEqual(mock_jenkins.return_value, client)
+        # The requester is used from the first poll as the client's created.
+        self.assertIsInstance(
+            mock_jenkins.call_args[1]["requester"], SessionRequester)
+
+    def test_get_client_doesnt_block_while_creating(self):
+        """
+        Creating a client shouldn't stop other threads getting clients, and
+        if another thread stores a client for the server first, that client
+        is used.
+        """
+        creating = threading.Event()
+        created = threading.Event()
+        clients = [mock.Mock(name="first"), mock.Mock(name="second")]
+
+        def create_client(*args, **kwargs):
+            client = clients.pop(0)
+            if client._mock_name == "first":
+                creating.set()
+                created.wait(5)
+            return client
+
+        results = []
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins:
+            mock_jenkins.side_effect = create_client
+            thread = threading.Thread(
+                target=lambda: results.append(
+                    self.registry.get_client(self.server)))
+            thread.start()
+            self.assertTrue(creating.wait(5))
+            client = self.registry.get_client(self.server)
+            created.set()
+            thread.join(5)
+
+        self.assertEqual("second", client._mock_name)
+        self.assertEqual([client], results)
+        self.assertEqual(client, self.registry.get_client(self.server))
+
+    def test_get_client_with_changed_credentials(self):
+        """
+        If the server's credentials change, we get a new client.
+        """
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins:
+            self.registry.get_client(self.server)
+            self.server.password = "changed"
+            self.registry.get_client(self.server)
+
+        self.assertEqual(2, mock_jenkins.call_count)
+        mock_jenkins.assert_called_with(
+            self.server.url, username=u"root", password=u"changed",
+            requester=mock.ANY)
+
+    @override_settings(JENKINS_CLIENT_TTL=60)
+    def test_clients_expire(self):
+        """
+        After JENKINS_CLIENT_TTL seconds, a new client is created.
+        """
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins, \
+                mock.patch("jenkins.clients.time") as mock_time:
+            mock_time.time.return_value = 1000
+            self.registry.get_client(self.server)
+            mock_time.time.return_value = 1059
+            self.registry.get_client(self.server)
+            self.assertEqual(1, mock_jenkins.call_count)
+            mock_time.time.return_value = 1061
+            self.registry.get_client(self.server)
+            self.assertEqual(2, mock_jenkins.call_count)
+
+    def test_server_changes_invalidate_clients(self):
+        """
+        Saving or deleting a server drops its clients.
+        """
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins:
+            self.server.get_client()
+            self.server.save()
+            self.server.get_client()
+            self.assertEqual(2, mock_jenkins.call_count)
+            self.server.delete()
+        self.assertEqual({}, client_registry._clients)
+
+
+class SessionRequesterTest(TestCase):
+
+    def test_requests_use_session(self):
+        """
+        Requests should be made through the requester's session, with the
+        credentials.
+        """
+        requests = []
+        requester = SessionRequester(
+            "root", "testing", baseurl="http://example.com/")
+        requester.session = mock.Mock(wraps=requester.session)
+        with HTTMock(mock_url(r"\/api\/python$", "fixture1", requests)):
+            response = requester.get_url("http://example.com/api/python")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, requester.session.get.call_count)
+        self.assertIn("Authorization", requests[0].headers)
@@ -0,0 +1,110 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from httmock import HTTMock, urlmatch
+
+from jenkins.consolelogs import (
+    append_console_log, open_console_log, fetch_console_log,
+    get_console_log_path)
+from jenkins.models import BuildConsoleLog
+from .factories import BuildFactory
+
+
+class ConsoleLogTest(TestCase):
+
+    def setUp(self):
+        self.log_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_root)
+
+    def test_append_console_log(self):
+        """
+        append_console_log should compress the chunks into the log for the
+        build, and return the name, size and number of lines appended.
+        """
+        with self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            name, size, lines = append_console_log(
+                10, 5, iter(["Started\n", "Building\nFinished", "\n"]))
+            path = get_console_log_path(name)
+
+            self.assertEqual(os.path.join("10", "5.log.gz"), name)
+            self.assertEqual(
+                os.path.join(self.log_root, "10", "5.log.gz"), path)
+            self.assertEqual(26, size)
+            self.assertEqual(3, lines)
+            self.assertEqual(
+                "Started\nBuilding\nFinished\n", gzip.open(path).read())
+
+    def test_append_console_log_to_existing_log(self):
+        """
+        Appending to an existing log adds to the end of it.
+        """
+        with self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            append_console_log(10, 5, iter(["First\n"]))
+            name, size, lines = append_console_log(10, 5, iter(["Second\n"]))
+            self.assertEqual((7, 1), (size, lines))
+            self.assertEqual(
+                "First\nSecond\n", open_console_log(name).read())
+            self.assertEqual(
+                ["5.log.gz"], os.listdir(os.path.join(self.log_root, "10")))
+
+    def test_get_console_log(self):
+        """
+        Build.get_console_log should return the stored log, or the log in
+        the database for older builds, or None if we don't have one.
+        """
+        with self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            name, _, _ = append_console_log(10, 5, iter(["Stored log\n"]))
+            build = BuildFactory.create(console_log_file=name)
+            self.assertEqual("Stored log\n", build.get_console_log())
+
+        build = BuildFactory.create()
+        BuildConsoleLog.objects.create(build=build, text="Old log")
+        self.assertEqual("Old log", build.get_console_log())
+
+        self.assertIsNone(BuildFactory.create().get_console_log())
+
+    def test_fetch_console_log(self):
+        """
+        fetch_console_log should fetch the log from the offset, and return
+        where the next fetch should start and whether there's more to come.
+        """
+        requests = []
+
+        @urlmatch(path=r"^/job/testing/5/logText/progressiveText$")
+        def progressive_text(url, request):
+            requests.append(request)
+            return {
+                "status_code": 200, "content": "This is the log\n",
+                "headers": {"X-Text-Size": "120", "X-More-Data": "true"}}
+
+        with HTTMock(progressive_text):
+            chunks, offset, more = fetch_console_log(
+                "http://example.com/job/testing/5/", 100,
+                auth=("root", "testing"))
+            self.assertEqual("This is the log\n", "".join(chunks))
+        self.assertEqual(120, offset)
+        self.assertTrue(more)
+        self.assertTrue(requests[0].url.endswith("?start=100"))
+        self.assertIn("Authorization", requests[0].headers)
+
+    def test_fetch_console_log_for_finished_build(self):
+        """
+        Jenkins doesn't send X-More-Data once the build has finished.
+        """
+        @urlmatch(path=r"^/job/testing/5/logText/progressiveText$")
+        def progressive_text(url, request):
+            return {
+                "status_code": 200, "content": "",
+                "headers": {"X-Text-Size": "120"}}
+
+        with HTTMock(progressive_text):
+            _, offset, more = fetch_console_log(
+                "http://example.com/job/testing/5/", 120)
+        self.assertEqual(120, offset)
+        self.assertFalse(more)
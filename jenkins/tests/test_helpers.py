@@ -1,11 +1,19 @@
+import os
+import shutil
+import tempfile
+
+from django.db import transaction
 from django.test import TestCase
 from django.test.utils import override_settings
 
 import mock
-import jenkinsapi.job
 
-from jenkins.helpers import import_build_for_job, create_job
-from jenkins.models import Build, Job
+from jenkins.helpers import (
+    import_build_for_job, import_build_with_client, import_builds_for_job,
+    create_job,
+    tail_console_log_for_build, sync_builds_for_job, sync_builds,
+    ImportCheckpoint)
+from jenkins.models import Artifact, Build, Job
 from .factories import (
     JobFactory, BuildFactory, JobTypeFactory, JenkinsServerFactory)
 
@@ -14,6 +22,18 @@ class ImportBuildForJobTest(TestCase):
 
     # TODO: Improve testing of artifacts.
 
+    def setUp(self):
+        self.log_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_root)
+
+    def get_build_details(self, artifacts=None):
+        return {
+            "status": "SUCCESS", "duration": 1000,
+            "url": "http://localhost/123", "artifacts": artifacts or [],
+            "building": False, "build_id": ""}
+
     @override_settings(NOTIFICATION_HOST="http://example.com")
     def test_import_build_for_job(self):
         """
@@ -23,33 +43,421 @@ class ImportBuildForJobTest(TestCase):
         job = JobFactory.create()
         build = BuildFactory.create(job=job, number=5)
 
-        mock_job = mock.Mock(spec=jenkinsapi.job.Job)
-        mock_build = mock.Mock(_data={"duration": 1000})
-
-        mock_job.get_build.return_value = mock_build
-
-        mock_build.get_status.return_value = "SUCCESS"
-        mock_build.get_result_url.return_value = "http://localhost/123"
-        mock_build.get_console.return_value = "This is the log"
-        mock_build.get_artifacts.return_value = []
-
-        with mock.patch("jenkins.helpers.logging") as mock_logging:
-            with mock.patch("jenkins.models.Jenkins") as mock_jenkins:
-                mock_jenkins.return_value.get_job.return_value = mock_job
-                import_build_for_job(job.pk, 5)
+        with mock.patch("jenkins.helpers.logging") as mock_logging, \
+                mock.patch("jenkins.models.Jenkins") as mock_jenkins, \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch(
+                    "jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_details.return_value = self.get_build_details()
+            mock_fetch.return_value = (
+                iter(["This is ", "the log\n"]), 16, False)
+            import_build_for_job(job.pk, 5)
+            build = Build.objects.get(pk=build.pk)
+            self.assertEqual("This is the log\n", build.get_console_log())
 
         mock_jenkins.assert_called_with(
-            job.server.url, username=u"root", password=u"testing")
+            job.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
 
         mock_logging.assert_has_calls(
             [mock.call.info("Located job %s\n" % job),
              mock.call.info("Using server at %s\n" % job.server.url),
              mock.call.info("Processing build details for %s #5" % job)])
 
-        build = Build.objects.get(pk=build.pk)
+        mock_details.assert_called_once_with(
+            mock_jenkins.return_value,
+            "%sjob/%s/5/" % (job.server.url, job.name))
         self.assertEqual(1000, build.duration)
+        self.assertTrue(build.imported)
         self.assertEqual("SUCCESS", build.status)
-        self.assertEqual("This is the log", build.console_log)
+        self.assertEqual("http://localhost/123", build.url)
+        self.assertEqual(16, build.console_log_size)
+        self.assertEqual(1, build.console_log_lines)
+        mock_fetch.assert_called_once_with(
+            "%sjob/%s/5/" % (job.server.url, job.name), 0,
+            auth=(u"root", u"testing"))
+
+    def test_interrupted_import_is_not_imported(self):
+        """
+        If fetching the log fails, the build isn't marked as imported, so
+        that import_builds_for_job imports it again.
+        """
+        job = JobFactory.create()
+
+        with mock.patch("jenkins.models.Jenkins"), \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch(
+                    "jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_details.return_value = self.get_build_details()
+            mock_fetch.side_effect = ValueError("Connection reset")
+            with self.assertRaises(ValueError):
+                import_build_for_job(job.pk, 5)
+
+        build = Build.objects.get(job=job, number=5)
+        self.assertEqual(1000, build.duration)
+        self.assertFalse(build.imported)
+
+    def test_import_build_for_job_fetches_the_tail_of_the_log(self):
+        """
+        If the log has been tailed while the build was running, the import
+        only fetches the rest of the log.
+        """
+        job = JobFactory.create()
+        BuildFactory.create(job=job, number=5)
+
+        with mock.patch("jenkins.models.Jenkins"), \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch(
+                    "jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_details.return_value = self.get_build_details()
+            mock_fetch.return_value = (iter(["Started\n"]), 20, True)
+            self.assertTrue(tail_console_log_for_build(job.pk, 5))
+
+            mock_fetch.return_value = (iter(["Finished\n"]), 35, False)
+            import_build_for_job(job.pk, 5)
+
+            build = Build.objects.get(job=job, number=5)
+            self.assertEqual("Started\nFinished\n", build.get_console_log())
+
+        self.assertEqual(20, mock_fetch.call_args[0][1])
+        self.assertEqual(17, build.console_log_size)
+        self.assertEqual(2, build.console_log_lines)
+        self.assertEqual(35, build.console_log_offset)
+
+    def test_import_build_for_job_creates_finished_build(self):
+        """
+        Importing a build we don't have yet should create it FINISHED, with
+        the BUILD_ID from Jenkins, so that it's the job's latest finished
+        build.
+        """
+        job = JobFactory.create()
+
+        with mock.patch("jenkins.models.Jenkins"), \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch(
+                    "jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_details.return_value = dict(
+                self.get_build_details(), build_id="1.5")
+            mock_fetch.return_value = (iter([]), 0, False)
+            import_build_for_job(job.pk, 5)
+
+        build = Build.objects.get(job=job, number=5)
+        self.assertEqual(
+            ("FINISHED", "SUCCESS", "1.5", True),
+            (build.phase, build.status, build.build_id, build.imported))
+        self.assertEqual(
+            build, Job.objects.get(pk=job.pk).latest_finished_build)
+
+    def test_import_build_for_running_build(self):
+        """
+        Builds that are still running aren't written, or marked as
+        imported.
+        """
+        job = JobFactory.create()
+        BuildFactory.create(job=job, number=5, phase="STARTED")
+
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins, \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch("jenkins.helpers.fetch_console_log") as mock_fetch:
+            mock_details.return_value = dict(
+                self.get_build_details(), building=True, status="")
+            self.assertFalse(import_build_with_client(
+                job, mock_jenkins.return_value, 5))
+
+        build = Build.objects.get(job=job, number=5)
+        self.assertEqual("STARTED", build.phase)
+        self.assertFalse(build.imported)
+        self.assertFalse(mock_fetch.called)
+
+    def test_import_build_for_job_twice(self):
+        """
+        Importing a build again shouldn't duplicate the artifacts.
+        """
+        job = JobFactory.create()
+
+        with mock.patch("jenkins.models.Jenkins"), \
+                mock.patch(
+                    "jenkins.helpers.get_build_details") as mock_details, \
+                mock.patch(
+                    "jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_fetch.return_value = (iter([]), 0, False)
+            for _ in range(2):
+                mock_details.return_value = self.get_build_details(
+                    artifacts=[("a.deb", "http://localhost/a.deb")])
+                import_build_for_job(job.pk, 5)
+
+        build = Build.objects.get(job=job, number=5)
+        self.assertEqual(
+            [("a.deb", "http://localhost/a.deb")],
+            list(build.artifact_set.values_list("filename", "url")))
+
+
+class TailConsoleLogForBuildTest(TestCase):
+
+    def setUp(self):
+        self.log_root = tempfile.mkdtemp()
+        self.job = JobFactory.create()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_root)
+
+    def test_tail_console_log_for_build_without_new_output(self):
+        """
+        If Jenkins has no new output, the build is left alone.
+        """
+        BuildFactory.create(job=self.job, number=5, console_log_offset=20)
+        with mock.patch("jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_fetch.return_value = (iter([]), 20, True)
+            self.assertTrue(tail_console_log_for_build(self.job.pk, 5))
+
+        build = Build.objects.get(job=self.job, number=5)
+        self.assertEqual("", build.console_log_file)
+        self.assertEqual([], os.listdir(self.log_root))
+
+    def test_tail_console_log_for_build_after_concurrent_fetch(self):
+        """
+        If something else appended the output while we were downloading it,
+        ours is discarded rather than appended twice.
+        """
+        build = BuildFactory.create(job=self.job, number=5)
+
+        def fetch(url, start, **kwargs):
+            Build.objects.filter(pk=build.pk).update(console_log_offset=7)
+            return iter(["Output\n"]), 7, True
+
+        with mock.patch("jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_fetch.side_effect = fetch
+            self.assertTrue(tail_console_log_for_build(self.job.pk, 5))
+
+        build = Build.objects.get(pk=build.pk)
+        self.assertEqual("", build.console_log_file)
+        self.assertEqual(0, build.console_log_size)
+        self.assertEqual([], os.listdir(
+            os.path.join(self.log_root, str(self.job.pk))))
+
+    def test_tail_console_log_for_finished_build(self):
+        """
+        Once the build has FINISHED we stop tailing, the import fetches the
+        rest of the log.
+        """
+        BuildFactory.create(job=self.job, number=5, phase="FINISHED")
+        with mock.patch("jenkins.helpers.fetch_console_log") as mock_fetch, \
+                self.settings(CONSOLE_LOG_ROOT=self.log_root):
+            mock_fetch.return_value = (iter(["Output\n"]), 7, True)
+            self.assertFalse(tail_console_log_for_build(self.job.pk, 5))
+
+
+class ImportBuildsForJobTest(TestCase):
+
+    def setUp(self):
+        self.job = JobFactory.create()
+        self.tempdir = tempfile.mkdtemp()
+        self.checkpoint = ImportCheckpoint(
+            os.path.join(self.tempdir, "checkpoint"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def import_builds(self, build_numbers, side_effect=None, **kwargs):
+        """
+        Imports the builds for the job with import_build_with_client
+        mocked out, and returns the result and the mock.
+        """
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins, \
+                mock.patch(
+                    "jenkins.helpers.get_build_numbers") as mock_numbers, \
+                mock.patch(
+                    "jenkins.helpers.import_build_with_client",
+                    return_value=True,
+                    side_effect=side_effect) as mock_import, \
+                mock.patch("jenkins.helpers.logging"):
+            mock_numbers.return_value = build_numbers
+            result = import_builds_for_job(self.job.pk, **kwargs)
+        mock_jenkins.assert_called_once_with(
+            self.job.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
+        mock_numbers.assert_called_once_with(
+            mock_jenkins.return_value,
+            "%sjob/%s/" % (self.job.server.url, self.job.name))
+        return result, mock_import
+
+    def test_import_builds_for_job(self):
+        """
+        import_builds_for_job should import each build with the same
+        client.
+        """
+        result, mock_import = self.import_builds([3, 2, 1], workers=1)
+
+        self.assertEqual((3, 0, 0), result)
+        client = mock_import.call_args[0][1]
+        mock_import.assert_has_calls([
+            mock.call(self.job, client, 3),
+            mock.call(self.job, client, 2),
+            mock.call(self.job, client, 1)])
+
+    def test_import_builds_for_job_skips_imported_builds(self):
+        """
+        Builds that have already been imported, or that are in the
+        checkpoint, are skipped, but not builds that were only partly
+        imported.
+        """
+        BuildFactory.create(job=self.job, number=1, imported=True)
+        BuildFactory.create(job=self.job, number=2, duration=100)
+        self.checkpoint.add(3)
+        result, mock_import = self.import_builds(
+            [4, 3, 2, 1], workers=1, checkpoint=self.checkpoint)
+
+        self.assertEqual((2, 2, 0), result)
+        self.assertEqual(
+            [4, 2], [x[0][2] for x in mock_import.call_args_list])
+        self.assertEqual(set([2, 3, 4]), self.checkpoint.load())
+
+    def test_import_builds_for_job_with_workers(self):
+        """
+        With several workers, failures are counted and don't stop the other
+        builds being imported or checkpointed.
+        """
+        # Mock's call counts aren't thread-safe, so record the calls.
+        imported = []
+        closed = []
+
+        def import_build(job, client, build_number):
+            imported.append(build_number)
+            if build_number == 3:
+                raise ValueError("Failed")
+            return True
+
+        with mock.patch("jenkins.helpers.connection") as mock_connection:
+            mock_connection.close.side_effect = lambda: closed.append(True)
+            result, _ = self.import_builds(
+                range(1, 11), side_effect=import_build, workers=4,
+                checkpoint=self.checkpoint)
+
+        self.assertEqual((9, 0, 1), result)
+        self.assertEqual(range(1, 11), sorted(imported))
+        self.assertEqual(
+            set(range(1, 11)) - set([3]), self.checkpoint.load())
+        # Once for each worker thread.
+        self.assertEqual(4, len(closed))
+
+    def test_import_builds_for_job_skips_running_builds(self):
+        """
+        Builds that are still running are counted as skipped and aren't
+        checkpointed, so that they're imported once they've finished.
+        """
+        result, mock_import = self.import_builds(
+            [2, 1], side_effect=lambda job, client, number: number == 1,
+            workers=1, checkpoint=self.checkpoint)
+
+        self.assertEqual((1, 1, 0), result)
+        self.assertEqual(set([1]), self.checkpoint.load())
+
+    def test_checkpoint(self):
+        """
+        A checkpoint that hasn't been written yet is empty.
+        """
+        self.assertEqual(set(), self.checkpoint.load())
+        self.checkpoint.add(10)
+        self.checkpoint.add(11)
+        self.assertEqual(set([10, 11]), self.checkpoint.load())
+
+
+class SyncBuildsForJobTest(TestCase):
+
+    def setUp(self):
+        self.job = JobFactory.create()
+
+    def get_details(self, number, building=False, **kwargs):
+        details = {
+            "number": number, "building": building, "build_id": "",
+            "status": "SUCCESS", "duration": 100,
+            "url": "http://localhost/%d" % number, "artifacts": []}
+        details.update(kwargs)
+        return details
+
+    def sync_builds(self, pages):
+        with mock.patch("jenkins.models.Jenkins") as mock_jenkins, \
+                mock.patch(
+                    "jenkins.helpers.iter_build_pages") as mock_pages, \
+                mock.patch("jenkins.helpers.logging"):
+            mock_pages.return_value = iter(pages)
+            result = sync_builds_for_job(self.job.pk, page_size=2)
+        mock_pages.assert_called_once_with(
+            mock_jenkins.return_value,
+            "%sjob/%s/" % (self.job.server.url, self.job.name), page_size=2)
+        return result
+
+    def test_sync_builds_for_job(self):
+        """
+        sync_builds_for_job should create the builds and artifacts from each
+        page, skipping builds that are still running.
+        """
+        result = self.sync_builds([
+            [self.get_details(4, building=True),
+             self.get_details(
+                 3, build_id="1.3",
+                 artifacts=[("a.deb", "http://localhost/a.deb")])],
+            [self.get_details(2, status="FAILURE"), self.get_details(1)]])
+
+        self.assertEqual((3, 0, 0), result)
+        self.assertEqual(
+            [(3, "1.3", "SUCCESS", "FINISHED"),
+             (2, "", "FAILURE", "FINISHED"),
+             (1, "", "SUCCESS", "FINISHED")],
+            list(self.job.build_set.values_list(
+                "number", "build_id", "status", "phase")))
+        self.assertEqual(
+            [(3, "a.deb")],
+            list(Artifact.objects.values_list("build__number", "filename")))
+        job = Job.objects.get(pk=self.job.pk)
+        self.assertEqual(3, job.latest_finished_build.number)
+
+    def test_sync_builds_for_job_updates_existing_builds(self):
+        """
+        Builds we already have are updated if they've changed, keeping the
+        BUILD_ID from the notifications.
+        """
+        BuildFactory.create(
+            job=self.job, number=2, build_id="1.2", phase="STARTED",
+            status="", duration=None, url="")
+        BuildFactory.create(
+            job=self.job, number=1, phase="FINISHED", status="SUCCESS",
+            duration=100, url="http://localhost/1")
+
+        result = self.sync_builds([
+            [self.get_details(2, build_id="other"), self.get_details(1)]])
+
+        self.assertEqual((0, 1, 1), result)
+        build = self.job.build_set.get(number=2)
+        self.assertEqual("1.2", build.build_id)
+        self.assertEqual("FINISHED", build.phase)
+        self.assertEqual(100, build.duration)
+
+    def test_sync_builds_writes_in_batches(self):
+        """
+        Each page of new builds is written with a fixed number of queries.
+        """
+        builds = dict(
+            (number, dict(self.get_details(
+                number, artifacts=[("a.deb", "http://localhost/a.deb")]),
+                phase="FINISHED"))
+            for number in range(1, 51))
+        with self.assertNumQueries(17):
+            with transaction.atomic():
+                self.assertEqual((50, 0), sync_builds(self.job, builds))
+        self.assertEqual(50, Artifact.objects.count())
 
 
 class CreateJobTest(TestCase):
@@ -0,0 +1,43 @@
+from jenkins.models import Artifact, Build
+from .factories import BuildFactory, JobFactory
+from .helpers import QueryPlanTestCase
+
+
+class QueryPlanTest(QueryPlanTestCase):
+    """
+    The queries on the hot paths, for notifications and imports, should be
+    answered from an index, not by scanning the table.
+    """
+
+    def setUp(self):
+        self.job = JobFactory.create()
+        for job in [self.job] + JobFactory.create_batch(4):
+            for number in range(1, 21):
+                BuildFactory.create(
+                    job=job, number=number,
+                    build_id="%s.%d" % (job.name, number))
+        self.analyze()
+
+    def test_build_by_job_and_number(self):
+        """
+        Notifications and imports look up builds by job and number.
+        """
+        self.assertNoTableScans(
+            Build.objects.filter(job=self.job, number=5))
+
+    def test_latest_build_in_phase(self):
+        """
+        The current build of a dependency is the latest finished build of
+        its job.
+        """
+        builds = self.job.build_set.filter(phase="FINISHED")
+        self.assertNoTableScans(builds.order_by("-number")[:1])
+
+    def test_build_by_build_id(self):
+        """
+        The artifacts of a projectbuild are found by the build_id.
+        """
+        self.assertNoTableScans(
+            Build.objects.filter(build_id="testing.5"))
+        self.assertNoTableScans(
+            Artifact.objects.filter(build__build_id="testing.5"))
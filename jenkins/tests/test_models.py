@@ -1,11 +1,13 @@
+from django.db import IntegrityError
 from django.test import TestCase
 
 from httmock import HTTMock
 from jenkinsapi.jenkins import Jenkins
 
-from jenkins.models import Build, JobType
+from jenkins.models import Artifact, Build, Job, JobType
 from .helpers import mock_url
-from .factories import BuildFactory, JenkinsServerFactory
+from .factories import (
+    ArtifactFactory, BuildFactory, JenkinsServerFactory, JobFactory)
 
 
 class JenkinsServerTest(TestCase):
@@ -36,6 +38,220 @@ class BuildTest(TestCase):
             list(Build.objects.all().values_list("number", flat=True)))
 
 
+class BuildManagerTest(TestCase):
+
+    def test_upsert_creates_build(self):
+        """
+        Build.objects.upsert should create the build if it doesn't exist,
+        using the defaults and the fields.
+        """
+        job = JobFactory.create()
+        build, created = Build.objects.upsert(
+            job.pk, 5, defaults={"build_id": "20140312.1"}, phase="STARTED")
+
+        self.assertTrue(created)
+        build = Build.objects.get(pk=build.pk)
+        self.assertEqual(5, build.number)
+        self.assertEqual("20140312.1", build.build_id)
+        self.assertEqual("STARTED", build.phase)
+
+    def test_upsert_updates_existing_build(self):
+        """
+        If the build exists, only the fields should be updated.
+        """
+        build = BuildFactory.create(number=5, build_id="20140312.1")
+        upserted, created = Build.objects.upsert(
+            build.job.pk, 5, defaults={"build_id": "other"},
+            phase="FINISHED", status="FAILURE")
+
+        self.assertFalse(created)
+        self.assertEqual(build.pk, upserted.pk)
+        build = Build.objects.get(pk=build.pk)
+        self.assertEqual("20140312.1", build.build_id)
+        self.assertEqual("FINISHED", build.phase)
+        self.assertEqual("FAILURE", build.status)
+        self.assertEqual(1, Build.objects.count())
+
+    def test_upsert_without_fields_leaves_build_unchanged(self):
+        """
+        With only defaults, an existing build isn't written.
+        """
+        build = BuildFactory.create(number=5, phase="FINISHED")
+        upserted, created = Build.objects.upsert(
+            build.job.pk, 5, defaults={"phase": "STARTED"})
+        self.assertFalse(created)
+        self.assertEqual("FINISHED", upserted.phase)
+        self.assertEqual("FINISHED", Build.objects.get(pk=build.pk).phase)
+
+    def test_upsert_many(self):
+        """
+        Build.objects.upsert_many should create the new builds and update
+        the changed ones in a fixed number of queries, returning the builds
+        written.
+        """
+        job = JobFactory.create()
+        started = BuildFactory.create(job=job, number=1, phase="STARTED")
+        finished = BuildFactory.create(
+            job=job, number=2, phase="FINISHED", status="SUCCESS")
+        fields = {"phase": "FINISHED", "status": "FAILURE", "url": "url"}
+        builds = {
+            (job.pk, 1): ({}, fields),
+            (job.pk, 2): ({}, dict(
+                fields, status="SUCCESS", url=finished.url)),
+            (job.pk, 3): ({"build_id": "20140312.3"}, {"phase": "STARTED"}),
+            (job.pk, 4): ({"build_id": "20140312.4"}, fields),
+        }
+        # The SELECT, INSERT, UPDATE and SELECT for the new builds, and the
+        # savepoints around them.
+        with self.assertNumQueries(8):
+            written = Build.objects.upsert_many(builds)
+
+        self.assertEqual(
+            [(1, False), (3, True), (4, True)],
+            sorted((x.number, y) for x, y in written))
+        started = Build.objects.get(pk=started.pk)
+        self.assertEqual(
+            ("FINISHED", "FAILURE", "url"),
+            (started.phase, started.status, started.url))
+        self.assertEqual(
+            "20140312.3", Build.objects.get(job=job, number=3).build_id)
+        self.assertEqual(
+            "FINISHED", Build.objects.get(job=job, number=4).phase)
+
+    def test_job_and_number_are_unique(self):
+        """
+        We can't have two builds with the same number for a job.
+        """
+        build = BuildFactory.create(number=5)
+        with self.assertRaises(IntegrityError):
+            BuildFactory.create(job=build.job, number=5)
+
+
+class ArtifactManagerTest(TestCase):
+
+    def get_artifacts(self, build):
+        return list(
+            Artifact.objects.filter(build=build).order_by(
+                "filename").values_list("filename", "url"))
+
+    def test_replace_for_build_creates_artifacts(self):
+        """
+        Artifact.objects.replace_for_build should create the artifacts for
+        the build in a single insert.
+        """
+        build = BuildFactory.create()
+        artifacts = [
+            ("a.deb", "http://example.com/a.deb"),
+            ("b.deb", "http://example.com/b.deb")]
+        with self.assertNumQueries(5):
+            result = Artifact.objects.replace_for_build(build, artifacts)
+
+        self.assertEqual((2, 0), result)
+        self.assertEqual(artifacts, self.get_artifacts(build))
+
+    def test_replace_for_build_merges_artifacts(self):
+        """
+        Unchanged artifacts are kept, and ones that are no longer in the
+        build are deleted.
+        """
+        build = BuildFactory.create()
+        kept = ArtifactFactory.create(
+            build=build, filename="a.deb", url="http://example.com/a.deb")
+        ArtifactFactory.create(
+            build=build, filename="old.deb", url="http://example.com/old.deb")
+        other = ArtifactFactory.create()
+        result = Artifact.objects.replace_for_build(build, [
+            ("a.deb", "http://example.com/a.deb"),
+            ("b.deb", "http://example.com/b.deb")])
+
+        self.assertEqual((1, 1), result)
+        self.assertEqual(
+            [("a.deb", "http://example.com/a.deb"),
+             ("b.deb", "http://example.com/b.deb")],
+            self.get_artifacts(build))
+        self.assertTrue(Artifact.objects.filter(pk=kept.pk).exists())
+        self.assertTrue(Artifact.objects.filter(pk=other.pk).exists())
+
+    def test_replace_for_build_removes_duplicates(self):
+        """
+        Artifacts duplicated by earlier imports are removed.
+        """
+        build = BuildFactory.create()
+        ArtifactFactory.create_batch(
+            3, build=build, filename="a.deb", url="http://example.com/a.deb")
+        result = Artifact.objects.replace_for_build(build, [
+            ("a.deb", "http://example.com/a.deb"),
+            ("a.deb", "http://example.com/a.deb")])
+
+        self.assertEqual((0, 2), result)
+        self.assertEqual(
+            [("a.deb", "http://example.com/a.deb")], self.get_artifacts(build))
+
+
+class JobTest(TestCase):
+
+    def get_latest_finished_build(self, job):
+        return Job.objects.get(pk=job.pk).latest_finished_build
+
+    def test_latest_finished_build(self):
+        """
+        The job should point at its most recent build once it has FINISHED.
+        """
+        job = JobFactory.create()
+        self.assertIsNone(self.get_latest_finished_build(job))
+
+        build1 = BuildFactory.create(job=job, number=1, phase="FINISHED")
+        self.assertEqual(build1, self.get_latest_finished_build(job))
+
+        build2 = BuildFactory.create(job=job, number=2, phase="STARTED")
+        self.assertEqual(build1, self.get_latest_finished_build(job))
+
+        Build.objects.upsert(job.pk, 2, phase="FINISHED")
+        self.assertEqual(build2, self.get_latest_finished_build(job))
+
+    def test_latest_finished_build_ignores_older_builds(self):
+        """
+        Older builds finishing later, e.g. imports, don't replace the latest
+        finished build.
+        """
+        job = JobFactory.create()
+        build2 = BuildFactory.create(job=job, number=2, phase="FINISHED")
+        BuildFactory.create(job=job, number=1, phase="FINISHED")
+        self.assertEqual(build2, self.get_latest_finished_build(job))
+
+    def test_latest_finished_build_is_cleared_on_delete(self):
+        """
+        Deleting the latest finished build doesn't delete the job.
+        """
+        build = BuildFactory.create(phase="FINISHED")
+        build.delete()
+        self.assertIsNone(self.get_latest_finished_build(build.job))
+
+    def test_latest_finished_build_falls_back_on_delete(self):
+        """
+        Deleting the latest finished build moves the job back to its
+        previous finished build.
+        """
+        job = JobFactory.create()
+        build1 = BuildFactory.create(job=job, number=1, phase="FINISHED")
+        BuildFactory.create(job=job, number=2, phase="STARTED")
+        build3 = BuildFactory.create(job=job, number=3, phase="FINISHED")
+        self.assertEqual(build3, self.get_latest_finished_build(job))
+
+        build3.delete()
+        self.assertEqual(build1, self.get_latest_finished_build(job))
+
+    def test_job_with_builds_can_be_deleted(self):
+        """
+        Deleting a job deletes its builds without trying to point it at
+        another build.
+        """
+        job = JobFactory.create()
+        BuildFactory.create_batch(2, job=job, phase="FINISHED")
+        job.delete()
+        self.assertEqual(0, Build.objects.count())
+
+
 class JobTypeTest(TestCase):
 
     def test_instantiation(self):
@@ -0,0 +1,283 @@
+import os
+import shutil
+import tempfile
+
+from django.dispatch import receiver
+from django.test import TestCase, SimpleTestCase
+
+import mock
+
+from jenkins.models import Build, Job, builds_updated
+from jenkins.notifications import (
+    NotificationSpool, coalesce_notifications, apply_notifications,
+    drain_notifications, enqueue_notification, parse_notification)
+from .factories import JenkinsServerFactory, JobFactory, BuildFactory
+
+
+def make_notification(name, number, phase, build_id=None):
+    """
+    Returns a notification in the format sent by the Jenkins plugin.
+    """
+    build = {
+        "number": number,
+        "phase": phase,
+        "url": "job/%s/%d/" % (name, number)}
+    if phase == "FINISHED":
+        build["status"] = "SUCCESS"
+    if build_id:
+        build["parameters"] = {"BUILD_ID": build_id}
+    return {"build": build, "name": name, "url": "job/%s/" % name}
+
+
+class ParseNotificationTest(SimpleTestCase):
+
+    def test_parse_started_notification(self):
+        """
+        parse_notification should extract the build details we store.
+        """
+        notification = make_notification("testing", 5, "STARTED", "20140312.1")
+        self.assertEqual(
+            {"name": "testing", "number": 5, "phase": "STARTED",
+             "build_id": "20140312.1"},
+            parse_notification(notification))
+
+    def test_parse_finished_notification(self):
+        """
+        FINISHED notifications should carry the status and url.
+        """
+        notification = make_notification("testing", 5, "FINISHED")
+        self.assertEqual(
+            {"name": "testing", "number": 5, "phase": "FINISHED",
+             "build_id": "", "status": "SUCCESS", "url": "job/testing/5/"},
+            parse_notification(notification))
+
+
+class CoalesceNotificationsTest(SimpleTestCase):
+
+    def test_started_and_finished_are_merged(self):
+        """
+        A STARTED and FINISHED for the same build should become a single
+        FINISHED, keeping the BUILD_ID from the STARTED notification.
+        """
+        entries = [
+            ["127.0.0.1", make_notification("job1", 1, "STARTED", "2014.1")],
+            ["127.0.0.1", make_notification("job2", 1, "STARTED")],
+            ["127.0.0.1", make_notification("job1", 1, "COMPLETED")],
+            ["127.0.0.1", make_notification("job1", 1, "FINISHED")],
+        ]
+        coalesced = coalesce_notifications(entries)
+
+        self.assertEqual(
+            [("127.0.0.1", "job1", 1, "FINISHED", "2014.1"),
+             ("127.0.0.1", "job2", 1, "STARTED", "")],
+            [(addr, x["name"], x["number"], x["phase"], x["build_id"])
+             for addr, x in coalesced])
+
+    def test_late_started_does_not_override_finished(self):
+        """
+        If the STARTED arrives after the FINISHED, the build is still
+        FINISHED.
+        """
+        entries = [
+            ["127.0.0.1", make_notification("job1", 1, "FINISHED")],
+            ["127.0.0.1", make_notification("job1", 1, "STARTED", "2014.1")],
+        ]
+        [(_, details)] = coalesce_notifications(entries)
+        self.assertEqual("FINISHED", details["phase"])
+        self.assertEqual("2014.1", details["build_id"])
+
+    def test_invalid_notifications_are_dropped(self):
+        """
+        Notifications that can't be parsed are logged and dropped, rather
+        than stopping the others from being written.
+        """
+        invalid = make_notification("job1", 1, "FINISHED")
+        del invalid["build"]["status"]
+        entries = [
+            ["127.0.0.1", invalid],
+            ["127.0.0.1", make_notification("job2", 1, "STARTED")],
+        ]
+        with mock.patch("jenkins.notifications.logging") as mock_logging:
+            [(_, details)] = coalesce_notifications(entries)
+
+        self.assertEqual("job2", details["name"])
+        mock_logging.warn.assert_called_once_with(
+            "Dropping invalid notification: %r" % invalid)
+
+
+class ApplyNotificationsTest(TestCase):
+
+    def setUp(self):
+        self.server = JenkinsServerFactory.create()
+        self.job = JobFactory.create(server=self.server, name="testing")
+
+    def test_apply_notifications(self):
+        """
+        apply_notifications should create and update the builds and return
+        the builds created STARTED and the FINISHED builds.
+        """
+        BuildFactory.create(job=self.job, number=1, phase="STARTED")
+        entries = [
+            [self.server.remote_addr,
+             make_notification("testing", 1, "FINISHED")],
+            [self.server.remote_addr,
+             make_notification("testing", 2, "STARTED", "2014.2")],
+        ]
+        started, finished = apply_notifications(
+            coalesce_notifications(entries))
+
+        self.assertEqual([(self.job.pk, 2)], started)
+        self.assertEqual([(self.job.pk, 1)], finished)
+        build1 = Build.objects.get(job=self.job, number=1)
+        self.assertEqual("FINISHED", build1.phase)
+        self.assertEqual("SUCCESS", build1.status)
+        build2 = Build.objects.get(job=self.job, number=2)
+        self.assertEqual("STARTED", build2.phase)
+        self.assertEqual("2014.2", build2.build_id)
+
+    def test_apply_notifications_sends_builds_updated(self):
+        """
+        The builds are written in bulk, so the builds written are sent with
+        builds_updated, and the job's latest finished build is updated.
+        """
+        entries = [
+            [self.server.remote_addr,
+             make_notification("testing", x, phase)]
+            for x in range(1, 4) for phase in ["STARTED", "FINISHED"]]
+        updated = []
+
+        @receiver(builds_updated, sender=Build)
+        def handle_signal(sender, job_ids, builds, **kwargs):
+            updated.append((set(job_ids), builds))
+
+        apply_notifications(coalesce_notifications(entries))
+
+        [(job_ids, builds)] = updated
+        self.assertEqual(set([self.job.pk]), job_ids)
+        self.assertEqual([1, 2, 3], sorted(x.number for x in builds))
+        self.assertEqual(
+            Build.objects.get(job=self.job, number=3),
+            Job.objects.get(pk=self.job.pk).latest_finished_build)
+
+    def test_apply_notifications_with_unknown_job(self):
+        """
+        Notifications for unknown jobs are logged and dropped.
+        """
+        entries = [
+            [self.server.remote_addr,
+             make_notification("unknown", 1, "FINISHED")],
+        ]
+        with mock.patch("jenkins.notifications.logging") as mock_logging:
+            result = apply_notifications(coalesce_notifications(entries))
+
+        self.assertEqual(([], []), result)
+        self.assertEqual(0, Build.objects.count())
+        mock_logging.warn.assert_called_once_with(
+            "Notification for unknown job 'unknown'")
+
+
+class NotificationSpoolTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "spool", "notifications")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_append_and_drain(self):
+        """
+        Notifications appended to the spool are passed to the drain
+        processor, and the spool is emptied.
+        """
+        spool = NotificationSpool(self.path)
+        spool.append("127.0.0.1", {"name": "job1"})
+        spool.append("127.0.0.2", {"name": "job2"})
+
+        drained = []
+        spool.drain(lambda entries: drained.extend(entries) or [])
+
+        self.assertEqual(
+            [["127.0.0.1", {"name": "job1"}], ["127.0.0.2", {"name": "job2"}]],
+            drained)
+        self.assertEqual([], os.listdir(os.path.dirname(self.path)))
+
+    def test_failed_drain_is_retried(self):
+        """
+        If processing fails, the failure is logged and the notifications are
+        kept and processed by the next drain.
+        """
+        spool = NotificationSpool(self.path)
+        spool.append("127.0.0.1", {"name": "job1"})
+
+        def fail(entries):
+            raise ValueError("database unavailable")
+
+        with mock.patch("jenkins.notifications.logging") as mock_logging:
+            self.assertEqual([], spool.drain(fail))
+        self.assertEqual(1, mock_logging.exception.call_count)
+        spool.append("127.0.0.1", {"name": "job2"})
+
+        drained = []
+        spool.drain(lambda entries: drained.extend(entries) or [])
+        self.assertEqual(
+            [["127.0.0.1", {"name": "job1"}], ["127.0.0.1", {"name": "job2"}]],
+            drained)
+
+    def test_failed_file_doesnt_stop_drain(self):
+        """
+        The results for the files processed are returned even if a later
+        file fails, and only the failed file is kept.
+        """
+        spool = NotificationSpool(self.path)
+        spool.append("127.0.0.1", {"name": "job1"})
+
+        def process(entries):
+            if entries[0][1]["name"] == "job2":
+                raise ValueError("unavailable")
+            return entries[0][1]["name"]
+
+        with mock.patch("jenkins.notifications.logging"):
+            spool.drain(mock.Mock(side_effect=ValueError("unavailable")))
+            spool.append("127.0.0.1", {"name": "job2"})
+            self.assertEqual(["job1"], spool.drain(process))
+        self.assertEqual(
+            [[["127.0.0.1", {"name": "job2"}]]],
+            spool.drain(lambda entries: entries))
+
+    def test_invalid_lines_are_dropped(self):
+        """
+        Lines in the spool that can't be decoded are logged and dropped.
+        """
+        spool = NotificationSpool(self.path)
+        spool.append("127.0.0.1", {"name": "job1"})
+        with open(self.path, "a") as f:
+            f.write("[\"127.0.0.1\", {\"na\n")
+
+        with mock.patch("jenkins.notifications.logging") as mock_logging:
+            drained = spool.drain(lambda entries: entries)
+
+        self.assertEqual([[["127.0.0.1", {"name": "job1"}]]], drained)
+        self.assertEqual(1, mock_logging.warn.call_count)
+
+    def test_drain_notifications(self):
+        """
+        drain_notifications should write the queued notifications from the
+        configured spool.
+        """
+        server = JenkinsServerFactory.create()
+        job = JobFactory.create(server=server, name="testing")
+        with self.settings(NOTIFICATION_SPOOL=self.path):
+            enqueue_notification(
+                server.remote_addr, make_notification("testing", 3, "STARTED"))
+            enqueue_notification(
+                server.remote_addr,
+                make_notification("testing", 3, "FINISHED"))
+            enqueue_notification(
+                server.remote_addr, make_notification("testing", 4, "STARTED"))
+            started, finished = drain_notifications()
+
+        self.assertEqual([(job.pk, 4)], started)
+        self.assertEqual([(job.pk, 3)], finished)
+        build = Build.objects.get(job=job, number=3)
+        self.assertEqual("FINISHED", build.phase)
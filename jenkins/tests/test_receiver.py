@@ -0,0 +1,139 @@
+import asyncore
+import json
+import socket
+
+from django.test import TestCase
+
+import mock
+
+from jenkins.receiver import handle_notification, NotificationChannel
+from jenkins.tasks import record_notification
+from jenkins.models import Build
+from .factories import JenkinsServerFactory, JobFactory
+
+
+class HandleNotificationTest(TestCase):
+
+    def setUp(self):
+        self.server = JenkinsServerFactory.create()
+        self.job = JobFactory.create(server=self.server, name="mytestjob")
+        self.notification = {
+            "build": {"number": 11, "phase": "STARTED"},
+            "name": "mytestjob"}
+
+    def test_handle_notification(self):
+        """
+        Notifications for known jobs should be passed to the
+        record_notification task.
+        """
+        with mock.patch(
+                "jenkins.receiver.record_notification") as mock_record:
+            status = handle_notification(
+                self.server.remote_addr, json.dumps(self.notification))
+
+        self.assertEqual(200, status)
+        mock_record.delay.assert_called_once_with(
+            self.job.pk, self.notification)
+
+    def test_handle_notification_with_unknown_remote_addr(self):
+        """
+        Unknown servers get a 412 response.
+        """
+        with mock.patch("jenkins.receiver.logging") as mock_logging:
+            status = handle_notification(
+                "127.0.0.1", json.dumps(self.notification))
+        self.assertEqual(412, status)
+        mock_logging.warn.assert_called_once_with(
+            "Could not find server with REMOTE_ADDR: 127.0.0.1")
+
+    def test_handle_notification_with_unknown_job(self):
+        """
+        Unknown jobs get a 412 response.
+        """
+        self.notification["name"] = "unknown job"
+        with mock.patch("jenkins.receiver.logging") as mock_logging:
+            status = handle_notification(
+                self.server.remote_addr, json.dumps(self.notification))
+        self.assertEqual(412, status)
+        mock_logging.warn.assert_called_once_with(
+            "Notification for unknown job 'unknown job'")
+
+    def test_handle_notification_with_invalid_json(self):
+        """
+        If the body isn't a notification, we get a 400 response.
+        """
+        status = handle_notification(self.server.remote_addr, "testing")
+        self.assertEqual(400, status)
+
+
+class NotificationChannelTest(TestCase):
+
+    def _send_request(self, request):
+        """
+        Sends the request through a NotificationChannel and returns the
+        response.
+        """
+        client, server = socket.socketpair()
+        channel_map = {}
+        NotificationChannel(
+            server, "192.168.50.201", "/jenkins/notifications/",
+            map=channel_map)
+        client.sendall(request)
+        while channel_map:
+            asyncore.loop(timeout=0.1, map=channel_map, count=1)
+        response = client.recv(4096)
+        client.close()
+        return response
+
+    def test_post_notification(self):
+        """
+        A POST to the notifications path should be handled.
+        """
+        body = json.dumps({"name": "testing"})
+        request = (
+            "POST /jenkins/notifications/ HTTP/1.1\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        with mock.patch("jenkins.receiver.handle_notification") as mock_handle:
+            mock_handle.return_value = 200
+            response = self._send_request(request)
+
+        self.assertTrue(response.startswith("HTTP/1.0 200 OK\r\n"))
+        mock_handle.assert_called_once_with("192.168.50.201", body)
+
+    def test_get_is_not_allowed(self):
+        """
+        We only accept POST requests.
+        """
+        response = self._send_request(
+            "GET /jenkins/notifications/ HTTP/1.1\r\n\r\n")
+        self.assertTrue(response.startswith("HTTP/1.0 405 "))
+
+    def test_unknown_path(self):
+        """
+        Requests to other paths get a 404.
+        """
+        response = self._send_request(
+            "POST /testing/ HTTP/1.1\r\nContent-Length: 0\r\n\r\n")
+        self.assertTrue(response.startswith("HTTP/1.0 404 "))
+
+
+class RecordNotificationTaskTest(TestCase):
+
+    def test_record_notification(self):
+        """
+        record_notification should store the build and import FINISHED
+        builds.
+        """
+        job = JobFactory.create()
+        notification = {
+            "build": {
+                "number": 5, "phase": "FINISHED", "status": "SUCCESS",
+                "url": "job/testing/5/"},
+            "name": job.name}
+        with mock.patch("jenkins.tasks.import_build") as mock_import:
+            record_notification(job.pk, notification)
+
+        build = Build.objects.get(job=job, number=5)
+        self.assertEqual("SUCCESS", build.status)
+        mock_import.delay.assert_called_once_with(job.pk, 5)
@@ -0,0 +1,132 @@
+import json
+from urlparse import parse_qs, urlparse
+
+from django.test import TestCase
+
+from httmock import HTTMock, urlmatch
+from jenkinsapi.utils.requester import Requester
+import mock
+
+from jenkins.rest import (
+    get_build_details, get_build_numbers, iter_build_pages)
+
+
+class RestTest(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock(
+            requester=Requester(
+                "root", "testing", baseurl="http://example.com/"))
+        self.requests = []
+
+    def mock_api(self, path, data):
+        """
+        Returns a mock for the JSON API at path, recording the requests.
+        """
+        @urlmatch(path=path)
+        def mock_api(url, request):
+            self.requests.append(request)
+            return json.dumps(data)
+        return mock_api
+
+    def get_tree(self, request):
+        return parse_qs(urlparse(request.url).query)["tree"][0]
+
+    def test_get_build_details(self):
+        """
+        get_build_details should fetch only the fields we need for the build.
+        """
+        data = {
+            "number": 5, "result": "SUCCESS", "duration": 1000,
+            "url": "http://example.com/job/testing/5/", "building": False,
+            "artifacts": [
+                {"fileName": "a.deb", "relativePath": "debs/a.deb"}],
+            "actions": [
+                {"parameters": [{"name": "BUILD_ID", "value": "1.5"}]}]}
+        with HTTMock(self.mock_api(r"^/job/testing/5/api/json$", data)):
+            details = get_build_details(
+                self.client, "http://example.com/job/testing/5/")
+
+        self.assertEqual({
+            "status": "SUCCESS", "duration": 1000,
+            "url": "http://example.com/job/testing/5/testReport/api/python",
+            "artifacts": [
+                ("a.deb",
+                 "http://example.com/job/testing/5/artifact/debs/a.deb")],
+            "building": False, "build_id": "1.5"},
+            details)
+        self.assertEqual(
+            "number,building,result,duration,url,"
+            "artifacts[fileName,relativePath],actions[parameters[name,value]]",
+            self.get_tree(self.requests[0]))
+        self.assertIn("Authorization", self.requests[0].headers)
+
+    def test_get_build_details_for_running_build(self):
+        """
+        Builds that are still running have no result.
+        """
+        data = {
+            "number": 5, "building": True, "result": None, "duration": 0,
+            "url": "http://example.com/job/testing/5/", "artifacts": [],
+            "actions": []}
+        with HTTMock(self.mock_api(r"^/job/testing/5/api/json$", data)):
+            details = get_build_details(
+                self.client, "http://example.com/job/testing/5/")
+        self.assertEqual("", details["status"])
+        self.assertTrue(details["building"])
+
+    def test_get_build_numbers(self):
+        """
+        get_build_numbers should return the numbers of all the builds for the
+        job, newest first.
+        """
+        data = {"allBuilds": [{"number": 2}, {"number": 3}, {"number": 1}]}
+        with HTTMock(self.mock_api(r"^/job/testing/api/json$", data)):
+            numbers = get_build_numbers(
+                self.client, "http://example.com/job/testing/")
+        self.assertEqual([3, 2, 1], numbers)
+        self.assertEqual("allBuilds[number]", self.get_tree(self.requests[0]))
+
+    def test_iter_build_pages(self):
+        """
+        iter_build_pages should page through all the builds of the job.
+        """
+        pages = [
+            {"allBuilds": [
+                {"number": 3, "building": True, "result": None,
+                 "duration": 0, "url": "http://example.com/job/testing/3/",
+                 "artifacts": [], "actions": [{}]},
+                {"number": 2, "building": False, "result": "SUCCESS",
+                 "duration": 100, "url": "http://example.com/job/testing/2/",
+                 "artifacts": [
+                     {"fileName": "a.deb", "relativePath": "a.deb"}],
+                 "actions": [
+                     {"parameters": [{"name": "BUILD_ID", "value": "1.2"}]},
+                     {}]}]},
+            {"allBuilds": [
+                {"number": 1, "building": False, "result": "FAILURE",
+                 "duration": 50, "url": "http://example.com/job/testing/1/",
+                 "artifacts": [], "actions": []}]}]
+
+        @urlmatch(path=r"^/job/testing/api/json$")
+        def mock_api(url, request):
+            self.requests.append(request)
+            return json.dumps(pages[len(self.requests) - 1])
+
+        with HTTMock(mock_api):
+            result = list(iter_build_pages(
+                self.client, "http://example.com/job/testing/", page_size=2))
+
+        self.assertEqual(
+            [[3, 2], [1]], [[x["number"] for x in page] for page in result])
+        self.assertEqual(
+            [True, False], [x["building"] for x in result[0]])
+        self.assertEqual(
+            ["", "1.2"], [x["build_id"] for x in result[0]])
+        self.assertEqual(
+            [("a.deb", "http://example.com/job/testing/2/artifact/a.deb")],
+            result[0][1]["artifacts"])
+        self.assertEqual("FAILURE", result[1][0]["status"])
+        self.assertEqual(
+            ["{0,2}", "{2,4}"],
+            [self.get_tree(x)[-5:] for x in self.requests])
@@ -3,8 +3,11 @@ from django.test.utils import override_settings
 
 import mock
 from jenkinsapi import jenkins
+from jenkinsapi.custom_exceptions import UnknownJob
 
-from jenkins.tasks import build_job, push_job_to_jenkins, import_build
+from jenkins.tasks import (
+    build_job, drain_notifications, push_job_to_jenkins, import_build,
+    tail_console_log)
 from .factories import (
     JobFactory, JenkinsServerFactory, JobTypeFactory)
 
@@ -27,7 +30,8 @@ class BuildJobTaskTest(TestCase):
             build_job(job.pk)
 
         mock_jenkins.assert_called_with(
-            self.server.url, username=u"root", password=u"testing")
+            self.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.build_job.assert_called_with(
             job.name, params={})
 
@@ -43,7 +47,8 @@ class BuildJobTaskTest(TestCase):
             build_job(job.pk, "20140312.1")
 
         mock_jenkins.assert_called_with(
-            self.server.url, username=u"root", password=u"testing")
+            self.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.build_job.assert_called_with(
             job.name, params={"BUILD_ID": "20140312.1"})
 
@@ -58,7 +63,8 @@ class BuildJobTaskTest(TestCase):
             build_job(job.pk, params={"MYTEST": "500"})
 
         mock_jenkins.assert_called_with(
-            self.server.url, username=u"root", password=u"testing")
+            self.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.build_job.assert_called_with(
             job.name, params={"MYTEST": "500"})
 
@@ -74,10 +80,28 @@ class BuildJobTaskTest(TestCase):
             build_job(job.pk, "20140312.1", params={"MYTEST": "500"})
 
         mock_jenkins.assert_called_with(
-            self.server.url, username=u"root", password=u"testing")
+            self.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.build_job.assert_called_with(
             job.name, params={"MYTEST": "500", "BUILD_ID": "20140312.1"})
 
+    @override_settings(CELERY_ALWAYS_EAGER=True)
+    def test_build_job_for_new_job(self):
+        """
+        If the shared client doesn't know about the job yet, the jobs are
+        fetched again before building.
+        """
+        job = JobFactory.create(server=self.server)
+        with mock.patch(
+                "jenkins.models.Jenkins",
+                spec=jenkins.Jenkins) as mock_jenkins:
+            mock_jenkins.return_value.build_job.side_effect = [
+                UnknownJob(job.name), None]
+            build_job(job.pk)
+
+        mock_jenkins.return_value.poll.assert_called_once_with()
+        self.assertEqual(2, mock_jenkins.return_value.build_job.call_count)
+
 
 class ImportBuildTaskTest(TestCase):
 
@@ -94,6 +118,56 @@ class ImportBuildTaskTest(TestCase):
         task_mock.assert_called_once_with(job.pk, 5)
 
 
+class TailConsoleLogTaskTest(TestCase):
+
+    def test_tail_console_log_while_running(self):
+        """
+        tail_console_log should reschedule itself while the build is
+        running.
+        """
+        with mock.patch(
+                "jenkins.tasks.tail_console_log_for_build") as mock_tail, \
+                mock.patch.object(
+                    tail_console_log, "apply_async") as mock_async, \
+                self.settings(CONSOLE_LOG_TAIL_INTERVAL=5):
+            mock_tail.return_value = True
+            tail_console_log(1, 5)
+
+        mock_tail.assert_called_once_with(1, 5)
+        mock_async.assert_called_once_with((1, 5), countdown=5)
+
+    def test_tail_console_log_when_finished(self):
+        """
+        Once the build has finished, tail_console_log stops.
+        """
+        with mock.patch(
+                "jenkins.tasks.tail_console_log_for_build") as mock_tail, \
+                mock.patch.object(
+                    tail_console_log, "apply_async") as mock_async:
+            mock_tail.return_value = False
+            tail_console_log(1, 5)
+
+        self.assertFalse(mock_async.called)
+
+
+class DrainNotificationsTaskTest(TestCase):
+
+    def test_drain_notifications(self):
+        """
+        drain_notifications should tail the console logs of the builds that
+        have STARTED, and import the builds that have FINISHED.
+        """
+        with mock.patch("jenkins.tasks.drain") as mock_drain, \
+                mock.patch("jenkins.tasks.tail_console_log") as mock_tail, \
+                mock.patch("jenkins.tasks.import_build") as mock_import:
+            mock_drain.return_value = ([(1, 5)], [(1, 4), (2, 3)])
+            drain_notifications()
+
+        mock_tail.delay.assert_called_once_with(1, 5)
+        mock_import.delay.assert_has_calls(
+            [mock.call(1, 4), mock.call(2, 3)])
+
+
 job_xml = """
 <?xml version='1.0' encoding='UTF-8'?>
 <project>{{ notifications_url }}</project>
@@ -118,7 +192,8 @@ class CreateJobTaskTest(TestCase):
             push_job_to_jenkins(job.pk)
 
         mock_jenkins.assert_called_with(
-            job.server.url, username=u"root", password=u"testing")
+            job.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
         mock_jenkins.return_value.has_job.assert_called_with("testing")
         mock_jenkins.return_value.create_job.assert_called_with(
             "testing",
@@ -145,7 +220,8 @@ class CreateJobTaskTest(TestCase):
             push_job_to_jenkins(job.pk)
 
         mock_jenkins.assert_called_with(
-            job.server.url, username=u"root", password=u"testing")
+            job.server.url, username=u"root", password=u"testing",
+            requester=mock.ANY)
 
         mock_jenkins.return_value.has_job.assert_called_with("testing")
         mock_apijob.update_config.assert_called_with(
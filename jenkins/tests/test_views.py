@@ -8,6 +8,7 @@ from django.contrib.auth.models import User
 from django_webtest import WebTest
 import mock
 
+from jenkins.cache import server_cache
 from jenkins.views import NotificationHandlerView
 from jenkins.models import Build
 from .factories import (
@@ -52,7 +53,8 @@ class NotificationHandlerTest(TestCase):
         """
         notification = {
             "name": "unknown job",
-            "build": {"phase": "FINISHED", "number": 10}
+            "build": {"phase": "FINISHED", "number": 10, "status": "SUCCESS",
+                      "url": "job/unknown job/10/"}
         }
         with mock.patch("jenkins.views.logging") as mock_logging:
             response = self._get_response_with_data(
@@ -61,6 +63,22 @@ class NotificationHandlerTest(TestCase):
             mock_logging.warn.assert_called_once_with(
                 "Notification for unknown job 'unknown job'")
 
+    def test_handle_notification_with_unknown_job_is_cached(self):
+        """
+        Repeated notifications for an unknown job are rejected with no
+        database access.
+        """
+        notification = {
+            "name": "unknown job",
+            "build": {"phase": "FINISHED", "number": 10, "status": "SUCCESS",
+                      "url": "job/unknown job/10/"}
+        }
+        with mock.patch("jenkins.views.logging"):
+            self._get_response_with_data(notification)
+            with self.assertNumQueries(0):
+                response = self._get_response_with_data(notification)
+        self.assertEqual(412, response.status_code)
+
     def test_handle_started_notification(self):
         """
         When a build starts we get a STARTED notification.
@@ -72,12 +90,45 @@ class NotificationHandlerTest(TestCase):
                 "url": "job/mytestjob/11/"},
             "name": "mytestjob",
             "url": "job/mytestjob/"}
-        self._get_response_with_data(started)
+        with mock.patch("jenkins.views.tail_console_log") as mock_tail:
+            self._get_response_with_data(started)
 
         self.assertEqual(1, Build.objects.count())
         build = Build.objects.get(job=self.job, number=11)
         self.assertEqual("", build.status)
         self.assertEqual("STARTED", build.phase)
+        mock_tail.delay.assert_called_once_with(self.job.pk, 11)
+
+    def test_handle_retried_notifications(self):
+        """
+        If Jenkins retries the notifications, we should still have a single
+        FINISHED build.
+        """
+        started = {
+            "build": {
+                "number": 11,
+                "phase": "STARTED",
+                "url": "job/mytestjob/11/"},
+            "name": "mytestjob",
+            "url": "job/mytestjob/"}
+        finished = {
+            "build": {
+                "number": 11,
+                "phase": "FINISHED",
+                "status": "SUCCESS",
+                "url": "job/mytestjob/11/"},
+            "name": "mytestjob",
+            "url": "job/mytestjob/"}
+        with mock.patch("jenkins.views.import_build"), \
+                mock.patch("jenkins.views.tail_console_log") as mock_tail:
+            for notification in [started, started, finished, started]:
+                response = self._get_response_with_data(notification)
+                self.assertEqual(200, response.status_code)
+
+        build = Build.objects.get(job=self.job, number=11)
+        self.assertEqual("FINISHED", build.phase)
+        self.assertEqual("SUCCESS", build.status)
+        mock_tail.delay.assert_called_once_with(self.job.pk, 11)
 
     def test_handle_started_notification_with_build_id(self):
         """
@@ -92,7 +143,8 @@ class NotificationHandlerTest(TestCase):
                 "url": "job/mytestjob/11/"},
             "name": "mytestjob",
             "url": "job/mytestjob/"}
-        self._get_response_with_data(started)
+        with mock.patch("jenkins.views.tail_console_log"):
+            self._get_response_with_data(started)
 
         build = Build.objects.get(job=self.job, number=11)
         self.assertEqual("20140312.2", build.build_id)
@@ -187,6 +239,53 @@ class NotificationHandlerTest(TestCase):
         self.assertEqual("20140312.2", build.build_id)
         mock_import_build.delay.assert_called_once_with(self.job.pk, 20)
 
+    def test_handle_notification_when_buffered(self):
+        """
+        If NOTIFICATION_BUFFERED is set, the notification should be queued
+        without touching the database and we respond with a 202.
+        """
+        server_cache.get_job_id(self.server, "mytestjob")
+        finished = {
+            "build": {
+                "number": 20,
+                "phase": "FINISHED",
+                "status": "SUCCESS",
+                "url": "job/mytestjob/20/"},
+            "name": "mytestjob",
+            "url": "job/mytestjob/"}
+
+        with self.settings(NOTIFICATION_BUFFERED=True):
+            with mock.patch(
+                    "jenkins.views.enqueue_notification") as mock_enqueue:
+                with self.assertNumQueries(0):
+                    response = self._get_response_with_data(finished)
+
+        self.assertEqual(202, response.status_code)
+        mock_enqueue.assert_called_once_with(
+            self.server.remote_addr, finished)
+        self.assertEqual(0, Build.objects.count())
+
+    def test_handle_invalid_notification_when_buffered(self):
+        """
+        Notifications that can't be parsed should be rejected with a 400
+        rather than queued.
+        """
+        finished = {
+            "build": {
+                "number": 20,
+                "phase": "FINISHED",
+                "url": "job/mytestjob/20/"},
+            "name": "mytestjob",
+            "url": "job/mytestjob/"}
+
+        with self.settings(NOTIFICATION_BUFFERED=True):
+            with mock.patch(
+                    "jenkins.views.enqueue_notification") as mock_enqueue:
+                response = self._get_response_with_data(finished)
+
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(mock_enqueue.called)
+
 
 class JenkinsServerIndexTest(WebTest):
 
@@ -260,6 +359,70 @@ class ServerJobBuildIndexTest(WebTest):
         self.assertEqual(job, response.context["job"])
         self.assertEqual(set(builds), set(response.context["builds"]))
 
+    def get_builds_url(self, job):
+        return reverse(
+            "jenkinsserver_job_builds_index",
+            kwargs={"server_pk": job.server.pk, "job_pk": job.pk})
+
+    def test_server_job_build_index_is_paginated(self):
+        """
+        Builds are shown newest first, a page at a time, with each page
+        starting after the last build of the previous page.
+        """
+        job = JobFactory.create()
+        for number in range(1, 8):
+            BuildFactory.create(job=job, number=number)
+        url = self.get_builds_url(job)
+
+        with mock.patch("jenkins.views.JenkinsServerJobBuildsIndexView"
+                        ".page_size", 3):
+            response = self.app.get(url, user="testing")
+            self.assertEqual(
+                [7, 6, 5], [x.number for x in response.context["builds"]])
+            next_page = response.context["next_page"]
+            self.assertContains(response, "?after=%d" % next_page)
+
+            response = self.app.get(
+                url, {"after": next_page}, user="testing")
+            self.assertEqual(
+                [4, 3, 2], [x.number for x in response.context["builds"]])
+
+            response = self.app.get(
+                url, {"after": response.context["next_page"]},
+                user="testing")
+            self.assertEqual(
+                [1], [x.number for x in response.context["builds"]])
+            self.assertIsNone(response.context["next_page"])
+
+    def test_server_job_build_index_with_invalid_page(self):
+        """
+        Pages must start after a build of the job.
+        """
+        job = JobFactory.create()
+        other = BuildFactory.create()
+        url = self.get_builds_url(job)
+        self.app.get(url, {"after": other.pk}, user="testing", status=404)
+        self.app.get(url, {"after": "testing"}, user="testing", status=404)
+
+    def test_server_job_build_index_as_json(self):
+        """
+        With format=json, we get the page of builds as JSON.
+        """
+        job = JobFactory.create()
+        BuildFactory.create(
+            job=job, number=5, build_id="20140312.1", phase="FINISHED",
+            status="SUCCESS", duration=1000, url="http://localhost/5")
+        response = self.app.get(
+            self.get_builds_url(job), {"format": "json"}, user="testing")
+
+        self.assertEqual("application/json", response.content_type)
+        self.assertEqual({
+            "results": [{
+                "number": 5, "build_id": "20140312.1", "phase": "FINISHED",
+                "status": "SUCCESS", "duration": 1000,
+                "url": "http://localhost/5"}],
+            "next": None}, response.json)
+
 
 class JobTypeDetailTest(WebTest):
 
@@ -6,8 +6,13 @@ from django.shortcuts import get_object_or_404
 from django.views.generic import View, ListView, DetailView, TemplateView
 from braces.views import LoginRequiredMixin, CsrfExemptMixin
 
-from jenkins.models import JenkinsServer, Build, Job, JobType
-from jenkins.tasks import import_build
+from capomastro.pagination import KeysetPaginationMixin
+from jenkins.cache import server_cache
+from jenkins.models import Build, JenkinsServer, Job, JobType
+from jenkins.notifications import (
+    get_notification_settings, enqueue_notification,
+    parse_notification_or_none, record_build)
+from jenkins.tasks import import_build, tail_console_log
 
 
 class NotificationHandlerView(CsrfExemptMixin, View):
@@ -19,53 +24,46 @@ class NotificationHandlerView(CsrfExemptMixin, View):
         Attempt to locate the remote server for this request.
         """
         remote_addr = request.META["REMOTE_ADDR"]
-        try:
-            return JenkinsServer.objects.get(remote_addr=remote_addr)
-        except JenkinsServer.DoesNotExist:
+        server = server_cache.get_server(remote_addr)
+        if server is None:
             logging.warn(
                 "Could not find server with REMOTE_ADDR: %s" % remote_addr)
+        return server
 
     def post(self, request, *args, **kwargs):
         """
         Handle incoming Jenkins notifications.
+
+        If NOTIFICATION_BUFFERED is set, the notification is queued for the
+        drain_notifications task and we respond with a 202 immediately.
         """
         server = self.get_server(request)
         if not server:
             return HttpResponse(status=412)
         notification = json.loads(request.body)
-
-        try:
-            job = server.job_set.get(name=notification["name"])
-        except Job.DoesNotExist:
+        # Invalid notifications are rejected here, rather than left in the
+        # spool when they're buffered.
+        details = parse_notification_or_none(notification)
+        if details is None:
+            logging.warn("Invalid notification: %r" % notification)
+            return HttpResponse(status=400)
+
+        job_id = server_cache.get_job_id(server, details["name"])
+        if job_id is None:
             logging.warn(
-                "Notification for unknown job '%s'" % notification["name"])
+                "Notification for unknown job '%s'" % details["name"])
             return HttpResponse(status=412)
 
-        build_id = ""
-        build_number = notification["build"]["number"]
-        build_phase = notification["build"]["phase"]
-        if "parameters" in notification["build"]:
-            build_id = notification["build"]["parameters"].get("BUILD_ID")
-
-        if notification["build"]["phase"] == "STARTED":
-            job.build_set.create(
-                number=build_number, build_id=build_id, phase=build_phase)
-        elif notification["build"]["phase"] == "FINISHED":
-            build_status = notification["build"]["status"]
-            build_url = notification["build"]["url"]
-            try:
-                existing_build = job.build_set.get(number=build_number)
-            except Build.DoesNotExist:
-                job.build_set.create(
-                    number=build_number, build_id=build_id, phase=build_phase,
-                    status=build_status, url=build_url)
-            else:
-                existing_build.status = build_status
-                existing_build.phase = build_phase
-                existing_build.url = build_url
-                existing_build.save()
-
-            import_build.delay(job.pk, build_number)
+        if get_notification_settings().NOTIFICATION_BUFFERED:
+            enqueue_notification(server.remote_addr, notification)
+            return HttpResponse(status=202)
+
+        result = record_build(job_id, details)
+        # Retried STARTED notifications shouldn't start tailing again.
+        if details["phase"] == "STARTED" and result[1]:
+            tail_console_log.delay(job_id, details["number"])
+        elif details["phase"] == "FINISHED":
+            import_build.delay(job_id, details["number"])
         return HttpResponse(status=200)
 
 
@@ -89,18 +87,31 @@ class JenkinsServerDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
-class JenkinsServerJobBuildsIndexView(LoginRequiredMixin, TemplateView):
+class JenkinsServerJobBuildsIndexView(
+        LoginRequiredMixin, KeysetPaginationMixin, TemplateView):
 
     template_name = "jenkins/jenkinsserver_job_builds_index.html"
+    page_keys = ("number",)
+    page_fields = (
+        "number", "build_id", "phase", "status", "duration", "url")
+
+    def get_job(self):
+        if not hasattr(self, "_job"):
+            self._job = get_object_or_404(
+                Job.objects.select_related("server"),
+                server__pk=self.kwargs["server_pk"], pk=self.kwargs["job_pk"])
+        return self._job
+
+    def get_page_queryset(self):
+        return Build.objects.filter(job=self.get_job())
 
     def get_context_data(self, **kwargs):
         context = super(
             JenkinsServerJobBuildsIndexView, self).get_context_data(**kwargs)
-        server = get_object_or_404(JenkinsServer, pk=kwargs["server_pk"])
-        job = get_object_or_404(server.job_set, pk=kwargs["job_pk"])
-        context["builds"] = job.build_set.all()
+        job = self.get_job()
+        context["builds"], context["next_page"] = self.get_page()
         context["job"] = job
-        context["server"] = server
+        context["server"] = job.server
         return context
 
 
@@ -0,0 +1,73 @@
+"""
+Measures the cost of finishing a build of a dependency used by many projects,
+and of the build table for a project with many dependencies.
+
+These use the test factories, so need the dev-requirements installed.
+"""
+from capomastro.benchmarks import Measurement
+from jenkins.models import Build
+from jenkins.tests.factories import BuildFactory
+from projects.models import ProjectDependency
+from projects.tests.factories import DependencyFactory, ProjectFactory
+from projects.utils import get_build_table_for_project
+
+
+def create_dependency(projects):
+    """
+    Creates a dependency auto-tracked by the number of projects.
+    """
+    dependency = DependencyFactory.create()
+    ProjectDependency.objects.bulk_create([
+        ProjectDependency(project=project, dependency=dependency)
+        for project in ProjectFactory.create_batch(projects)])
+    return dependency
+
+
+def finish_builds(dependency, builds):
+    """
+    Starts and then finishes builds of the dependency's job, and returns a
+    report of the latency, queries and writes of saving the finished build.
+    """
+    measurement = Measurement()
+    for number in range(1, builds + 1):
+        build = BuildFactory.create(
+            job=dependency.job, number=number, phase="STARTED", status="")
+        build.phase = "FINISHED"
+        build.status = "SUCCESS"
+        with measurement:
+            build.save()
+    return measurement.report()
+
+
+def create_project(dependencies, builds_per_dependency):
+    """
+    Creates a project with the dependencies, each with the builds, and
+    tracking a build outwith the recent builds.
+    """
+    project = ProjectFactory.create()
+    for dependency in DependencyFactory.create_batch(dependencies):
+        Build.objects.bulk_create([
+            Build(job=dependency.job, number=number, phase="FINISHED",
+                  status="SUCCESS", build_id="%d" % number,
+                  url="job/%s/%d/" % (dependency.job.name, number))
+            for number in range(1, builds_per_dependency + 1)])
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency, auto_track=False,
+            current_build=Build.objects.get(job=dependency.job, number=1))
+    return project
+
+
+def build_tables(project, count):
+    """
+    Builds the table for the project count times, and returns a report of
+    the latency and queries.
+    """
+    measurement = Measurement()
+    for _ in range(count):
+        with measurement:
+            header, table = get_build_table_for_project(project)
+            for row in table:
+                for cell in row:
+                    if cell.build is not None:
+                        cell.build.status
+    return measurement.report()
@@ -0,0 +1,169 @@
+"""
+Versioned caching for the project and dependency pages.
+
+Each project, each job and the list of dependencies have a generation in the
+cache, which the signal handlers in projects.models bump whenever something
+shown on their pages changes. The cached fragments and tables are keyed by
+the generations, so a change replaces them on the next request and the old
+entries just expire.
+
+Builds are mostly written by the workers and the notification receiver, so
+this needs a cache shared between processes, e.g. memcached, and the pages
+aren't cached with the default per-process backend.
+"""
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from capomastro.transactions import on_commit
+from jenkins.utils import DefaultSettings
+
+
+# Backends that each process has its own copy of.
+LOCAL_CACHES = (DummyCache, LocMemCache)
+
+# The keys waiting for the transaction to commit to be bumped.
+_pending = threading.local()
+
+
+def get_cache_settings():
+    """
+    Returns the settings for caching the pages.
+
+    PROJECTS_CACHE_ENABLED defaults to caching only with a backend that's
+    shared between processes, and PROJECTS_CACHE_TIMEOUT is the number of
+    seconds the pages are cached for.
+    """
+    return DefaultSettings({
+        "PROJECTS_CACHE_ENABLED": None,
+        "PROJECTS_CACHE_TIMEOUT": 300,
+    })
+
+
+def is_cache_enabled():
+    """
+    Returns True if the pages should be cached.
+    """
+    enabled = get_cache_settings().PROJECTS_CACHE_ENABLED
+    if enabled is None:
+        return not isinstance(cache, LOCAL_CACHES)
+    return enabled
+
+
+def get_cache_timeout():
+    """
+    Returns the number of seconds the pages are cached for, which is 0 when
+    they aren't cached.
+    """
+    if not is_cache_enabled():
+        return 0
+    return get_cache_settings().PROJECTS_CACHE_TIMEOUT
+
+
+def get_generation_key(name, pk=None):
+    """
+    Returns the cache key holding the generation for name and pk.
+    """
+    return "projects:generation:%s:%s" % (name, pk)
+
+
+def new_generation():
+    """
+    Returns the generation for a key that isn't in the cache.
+
+    This is based on the time rather than starting from 1, so a generation
+    that's been evicted is never reused for different content.
+    """
+    return int(time.time() * 1000)
+
+
+def get_generations(*keys):
+    """
+    Returns the generations for each of the (name, pk) keys, starting new
+    generations for any that aren't in the cache.
+    """
+    keys = [get_generation_key(*x) for x in keys]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, new_generation(), None)
+            generations[key] = cache.get(key)
+    return [generations[x] for x in keys]
+
+
+def bump_generations(*keys):
+    """
+    Moves each of the (name, pk) keys on to a new generation once the
+    current transaction commits, so that a page rendered from the data
+    before the commit can't be cached under the new generation.
+    """
+    if not is_cache_enabled():
+        return
+    if getattr(_pending, "keys", None) is None:
+        _pending.keys = set()
+    _pending.keys.update(keys)
+    on_commit(bump_pending_generations)
+
+
+def bump_pending_generations():
+    """
+    Moves the keys passed to bump_generations on to new generations.
+    """
+    keys, _pending.keys = getattr(_pending, "keys", None) or (), None
+    for key in keys:
+        key = get_generation_key(*key)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), None)
+
+
+def get_version(*keys):
+    """
+    Returns a short string identifying the current generations of the keys,
+    for use in cache keys, or None if the pages aren't cached.
+    """
+    if not is_cache_enabled():
+        return None
+    generations = ":".join(str(x) for x in get_generations(*keys))
+    return hashlib.md5(generations).hexdigest()
+
+
+def get_project_version(project):
+    """
+    Returns the version of everything shown about the project, its
+    dependencies and their builds.
+    """
+    if not is_cache_enabled():
+        return None
+    from projects.models import ProjectDependency
+    job_ids = ProjectDependency.objects.filter(project=project).values_list(
+        "dependency__job", flat=True)
+    return get_version(
+        ("project", project.pk), *[("job", x) for x in sorted(job_ids)])
+
+
+def get_dependency_list_version():
+    """
+    Returns the version of the list of dependencies.
+    """
+    return get_version(("dependencies",))
+
+
+def get_or_set(key, version, compute):
+    """
+    Returns the cached value for the key and version, calling compute to
+    create it if there isn't one.
+    """
+    if not is_cache_enabled():
+        return compute()
+    key = "projects:%s:%s" % (key, version)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, get_cache_timeout())
+    return value
@@ -1,5 +1,9 @@
+from django.core.urlresolvers import reverse
+from django.utils.encoding import force_text
+
+from capomastro.transactions import atomic
 from jenkins.tasks import build_job
-from projects.models import ProjectDependency
+from projects.models import ProjectBuild, ProjectDependency
 
 
 def build_dependency(dependency, build_id=None):
@@ -22,7 +26,8 @@ def build_project(project, user=None, dependencies=None, queue_build=True):
     Given a build, schedule building each of its dependencies.
     """
     dependencies = dependencies and dependencies or []
-    from projects.models import ProjectBuild, ProjectBuildDependency
+    from projects.models import (
+        COUNTERS, ProjectBuildDependency, get_build_state)
     build = ProjectBuild.objects.create(
         project=project, requested_by=user)
 
@@ -34,20 +39,37 @@ def build_project(project, user=None, dependencies=None, queue_build=True):
     dependencies_to_build = ProjectDependency.objects.filter(
         project=project, **filter_args)
     dependencies_not_to_build = ProjectDependency.objects.filter(
-        project=project).exclude(pk__in=dependencies_to_build)
+        project=project).exclude(pk__in=dependencies_to_build).select_related(
+            "current_build")
 
-    for dependency in dependencies_to_build.order_by("dependency__job__pk"):
-        kwargs = {"projectbuild": build,
-                  "dependency": dependency.dependency}
-        ProjectBuildDependency.objects.create(**kwargs)
-        if queue_build:
-            build_dependency(dependency.dependency, build_id=build.build_id)
+    # The dependencies and the counters are written before any of the builds
+    # are queued, so that the updates from builds starting or finishing move
+    # the counters on from these values rather than being overwritten.
+    counts = dict((x, 0) for x in COUNTERS.values())
+    dependencies_to_build = list(
+        dependencies_to_build.order_by("dependency__job__pk"))
+    with atomic():
+        for dependency in dependencies_to_build:
+            kwargs = {"projectbuild": build,
+                      "dependency": dependency.dependency}
+            ProjectBuildDependency.objects.create(**kwargs)
+            counts["pending_count"] += 1
+
+        for dependency in dependencies_not_to_build:
+            state = get_build_state(dependency.current_build)
+            kwargs = {"projectbuild": build,
+                      "dependency": dependency.dependency,
+                      "build": dependency.current_build,
+                      "state": state}
+            ProjectBuildDependency.objects.create(**kwargs)
+            counts[COUNTERS[state]] += 1
 
-    for dependency in dependencies_not_to_build:
-        kwargs = {"projectbuild": build,
-                  "dependency": dependency.dependency,
-                  "build": dependency.current_build}
-        ProjectBuildDependency.objects.create(**kwargs)
+        ProjectBuild.objects.filter(pk=build.pk).update(**counts)
+    build.update_phase()
+
+    if queue_build:
+        for dependency in dependencies_to_build:
+            build_dependency(dependency.dependency, build_id=build.build_id)
     return build
 
 
@@ -69,3 +91,22 @@ def archive_projectbuild(projectbuild, archive):
     """
     transport = get_transport_for_projectbuild(projectbuild, archive)
     transport.archive()
+
+
+def get_build_urls(build_ids):
+    """
+    Returns a dictionary mapping each of the build_ids to the url of its
+    ProjectBuild, or to an empty string if it isn't a ProjectBuild, in a
+    single query.
+
+    Where projects share a build_id, the earliest ProjectBuild is used.
+    """
+    build_urls = dict((force_text(x), "") for x in build_ids)
+    projectbuilds = ProjectBuild.objects.filter(
+        build_id__in=build_urls.keys()).order_by("-pk").values_list(
+            "build_id", "project", "pk")
+    for build_id, project_pk, pk in projectbuilds:
+        build_urls[build_id] = reverse(
+            "project_projectbuild_detail",
+            kwargs={"project_pk": project_pk, "build_pk": pk})
+    return build_urls
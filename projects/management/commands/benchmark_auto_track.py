@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from capomastro.benchmarks import benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark finishing builds of auto-tracked dependencies in a "
+        "temporary database")
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--projects", dest="projects", default="1,10,100,200",
+            help="Comma separated numbers of projects using the dependency."),
+        make_option(
+            "--builds", dest="builds", type="int", default=20,
+            help="Number of builds to finish for each number of projects."),
+    )
+
+    def handle(self, *args, **options):
+        from projects.benchmarks import create_dependency, finish_builds
+
+        with benchmark_database():
+            for projects in options["projects"].split(","):
+                dependency = create_dependency(int(projects))
+                report = finish_builds(dependency, options["builds"])
+                report["projects"] = int(projects)
+                self.stdout.write(
+                    "%(projects)d projects: %(count)d builds, "
+                    "p50 %(p50).2fms, p99 %(p99).2fms, "
+                    "%(queries).2f queries, %(writes).2f writes per build\n"
+                    % report)
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from capomastro.benchmarks import benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the dependency build table of a project in a temporary "
+        "database")
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--dependencies", dest="dependencies", type="int", default=100,
+            help="Number of dependencies of the project."),
+        make_option(
+            "--builds", dest="builds", type="int", default=10000,
+            help="Number of builds per dependency."),
+        make_option(
+            "--count", dest="count", type="int", default=20,
+            help="Number of times to build the table."),
+    )
+
+    def handle(self, *args, **options):
+        from projects.benchmarks import build_tables, create_project
+
+        with benchmark_database():
+            project = create_project(
+                options["dependencies"], options["builds"])
+            report = build_tables(project, options["count"])
+
+        self.stdout.write(
+            "%(count)d tables, p50 %(p50).2fms, p99 %(p99).2fms, "
+            "%(queries).2f queries per table\n" % report)
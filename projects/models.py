@@ -1,11 +1,15 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 
-from jenkins.models import Job, Build, Artifact
+from capomastro.transactions import atomic
+from jenkins.models import (
+    Job, Build, Artifact, builds_updated, get_latest_finished_builds)
+from projects.cache import bump_generations
 
 
 # Signals
@@ -30,10 +34,10 @@ class Dependency(models.Model):
         """
         Return the most recent build
         """
-        if self.job is not None:
-            finished_builds = self.job.build_set.filter(phase="FINISHED")
-            if finished_builds.count() > 0:
-                return finished_builds.order_by("-number")[0]
+        if self.job_id is not None:
+            job = Job.objects.select_related("latest_finished_build").get(
+                pk=self.job_id)
+            return job.latest_finished_build
 
     def get_build_parameters(self):
         """
@@ -92,16 +96,32 @@ class Project(models.Model):
         Returns a QuerySet of Artifact objects representing the Artifacts
         associated with the project dependencies at their current dependency
         level.
+
+        This is a single query, use iterator() to stream large sets. The
+        current builds are a subquery rather than a join, so that builds
+        tracked by more than one dependency don't repeat their artifacts.
         """
-        current_builds = []
-        for dependency in ProjectDependency.objects.filter(project=self):
-            current_builds.append(dependency.current_build)
+        current_builds = ProjectDependency.objects.filter(
+            project=self).values("current_build")
         return Artifact.objects.filter(build__in=current_builds)
 
     def __str__(self):
         return self.name
 
 
+def get_build_state(build):
+    """
+    Returns the state of a ProjectBuildDependency with the build.
+    """
+    if build is None:
+        return "PENDING"
+    if build.phase != "FINISHED":
+        return "RUNNING"
+    if build.status == "SUCCESS":
+        return "SUCCEEDED"
+    return "FAILED"
+
+
 @python_2_unicode_compatible
 class ProjectBuildDependency(models.Model):
     """
@@ -110,6 +130,8 @@ class ProjectBuildDependency(models.Model):
     projectbuild = models.ForeignKey("ProjectBuild")
     build = models.ForeignKey(Build, blank=True, null=True)
     dependency = models.ForeignKey(Dependency)
+    # PENDING, RUNNING, SUCCEEDED or FAILED, counted on the ProjectBuild.
+    state = models.CharField(max_length=10, default="PENDING")
 
     class Meta:
         verbose_name_plural = "project build dependencies"
@@ -118,6 +140,28 @@ class ProjectBuildDependency(models.Model):
         return "Build of {0} for {1}".format(
             self.dependency.name, self.projectbuild.build_id)
 
+    def set_build(self, build):
+        """
+        Associates the build with this dependency, moving the counters of the
+        ProjectBuild on if the state of the dependency changes.
+        """
+        state = get_build_state(build)
+        dependencies = ProjectBuildDependency.objects.filter(pk=self.pk)
+        with atomic():
+            # Only one of any concurrent updates can move the dependency on
+            # from the state it read, the others read the state again.
+            while not dependencies.filter(state=self.state).update(
+                    build=build, state=state):
+                self.state = dependencies.values_list(
+                    "state", flat=True).get()
+            previous, self.build, self.state = self.state, build, state
+            if previous != state:
+                ProjectBuild.objects.filter(pk=self.projectbuild_id).update(**{
+                    COUNTERS[previous]: F(COUNTERS[previous]) - 1,
+                    COUNTERS[state]: F(COUNTERS[state]) + 1})
+                self.projectbuild.update_phase()
+                bump_generations(("project", self.projectbuild.project_id))
+
 
 @python_2_unicode_compatible
 class ProjectBuild(models.Model):
@@ -129,11 +173,21 @@ class ProjectBuild(models.Model):
     ended_at = models.DateTimeField(null=True)
     status = models.CharField(max_length=10, default="UNKNOWN")
     phase = models.CharField(max_length=25, default="UNKNOWN")
-    build_id = models.CharField(max_length=20)
+    build_id = models.CharField(max_length=20, db_index=True)
+    # The number of dependencies in each state.
+    pending_count = models.IntegerField(default=0)
+    running_count = models.IntegerField(default=0)
+    succeeded_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
 
     build_dependencies = models.ManyToManyField(
         Build, through=ProjectBuildDependency)
 
+    class Meta:
+        unique_together = "project", "build_id"
+        # For the builds of a project by date, and the keyset pagination.
+        index_together = [["project", "requested_at"]]
+
     def __str__(self):
         return self.project.name
 
@@ -143,75 +197,197 @@ class ProjectBuild(models.Model):
         associated with the builds of the project dependencies for this
         project build.
         """
-        return Artifact.objects.filter(build__build_id=self.build_id)
+        return Artifact.objects.filter(
+            build__projectbuilddependency__projectbuild=self)
 
     def save(self, **kwargs):
         if not self.pk:
             self.build_id = generate_projectbuild_id(self)
         super(ProjectBuild, self).save(**kwargs)
 
+    def update_phase(self):
+        """
+        Updates the phase from the counters, and when no dependencies are
+        left PENDING or RUNNING, FINISHES the build with a SUCCESS status if
+        none of them FAILED.
+
+        projectbuild_finished is sent by whichever update finishes it.
+        """
+        projectbuilds = ProjectBuild.objects.filter(pk=self.pk)
+        counts = projectbuilds.values(*COUNTERS.values()).get()
+        for field, value in counts.items():
+            setattr(self, field, value)
+
+        if self.pending_count or self.running_count:
+            if self.running_count and projectbuilds.filter(
+                    phase="UNKNOWN").update(phase="STARTED"):
+                self.phase = "STARTED"
+            return
+
+        status = self.failed_count and "FAILURE" or "SUCCESS"
+        ended_at = timezone.now()
+        unfinished = projectbuilds.filter(
+            ended_at__isnull=True, pending_count=0, running_count=0)
+        if unfinished.update(
+                phase="FINISHED", status=status, ended_at=ended_at):
+            self.phase, self.status, self.ended_at = (
+                "FINISHED", status, ended_at)
+            projectbuild_finished.send(sender=ProjectBuild, projectbuild=self)
+
+
+COUNTERS = {
+    "PENDING": "pending_count",
+    "RUNNING": "running_count",
+    "SUCCEEDED": "succeeded_count",
+    "FAILED": "failed_count",
+}
+
+
+class ProjectBuildCounter(models.Model):
+    """
+    Counts the ids generated for the builds of a project each day.
+    """
+    project = models.ForeignKey(Project)
+    day = models.DateField()
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = "project", "day"
+
 
 def generate_projectbuild_id(projectbuild):
     """
     Generates a daily-unique id for a given project.
 
+    The ids come from incrementing the ProjectBuildCounter for the project
+    and day, so concurrent builds always get different ids.
+
     TODO: Should this drop the ".0" when there's no previous builds?
     """
-    # This is a possible race condition
     today = timezone.now()
-
-    day_start = today.replace(hour=0, minute=0, second=0)
-    day_end = today.replace(hour=23, minute=59, second=59)
-    filters = {"requested_at__gt": day_start,
-               "requested_at__lte": day_end,
-               "project": projectbuild.project}
-    today_count = ProjectBuild.objects.filter(**filters).count()
-    return today.strftime("%%Y%%m%%d.%d" % today_count)
+    counters = ProjectBuildCounter.objects.filter(
+        project=projectbuild.project, day=today.date())
+    with transaction.atomic():
+        if not counters.update(value=F("value") + 1):
+            try:
+                with transaction.atomic():
+                    ProjectBuildCounter.objects.create(
+                        project=projectbuild.project, day=today.date(),
+                        value=1)
+            except IntegrityError:
+                # Another build created the counter since we looked.
+                counters.update(value=F("value") + 1)
+        value = counters.values_list("value", flat=True).get()
+    return today.strftime("%%Y%%m%%d.%d" % (value - 1))
+
+
+def update_auto_tracking(build):
+    """
+    Moves the auto-tracking ProjectDependencies on to a FINISHED build of
+    their dependency, unless they're tracking a later build.
+    """
+    ProjectDependency.objects.filter(
+        dependency__job=build.job_id, auto_track=True).filter(
+        Q(current_build__isnull=True) |
+        Q(current_build__number__lt=build.number)).update(
+            current_build=build)
 
 
 @receiver(post_save, sender=Build, dispatch_uid="new_build_handler")
 def handle_new_build(sender, created, instance, **kwargs):
-    if instance.job.dependency_set.exists():
-        for dependency in instance.job.dependency_set.all():
-            for project_dependency in dependency.projectdependency_set.filter(
-                    auto_track=True):
-                project_dependency.current_build = instance
-                project_dependency.save()
+    """
+    Moves the auto-tracking ProjectDependencies on to a build of their
+    dependency when it finishes.
+    """
+    if instance.has_just_finished:
+        update_auto_tracking(instance)
 
 
 @receiver(post_save, sender=Build, dispatch_uid="projectbuild_build_handler")
-def handle_builds_for_projectbuild(sender, created, instance, **kwargs):
+def handle_builds_for_projectbuild(
+        sender, created, instance, update_fields=None, **kwargs):
+    if Build.is_console_log_update(update_fields):
+        return
     if instance.build_id:
         dependency = ProjectBuildDependency.objects.filter(
-            dependency__job=instance.job,
-            projectbuild__build_id=instance.build_id).first()
-        # TODO: This event handler should be split...
-        # This is a possible race-condition, if we have multiple dependencies
-        # being processed at the same time, then we could miss the status of
-        # one.
-        #
-        # Splitting it into a task would rule out using events tho'.
+            dependency__job=instance.job_id,
+            projectbuild__build_id=instance.build_id).select_related(
+                "projectbuild").first()
         if dependency:
-            dependency.build = instance
-            dependency.save()
-            projectbuild = dependency.projectbuild
-
-            build_statuses = ProjectBuildDependency.objects.filter(
-                projectbuild=dependency.projectbuild).values(
-                "build__status", "build__phase")
-
-            statuses = set([x["build__status"] for x in build_statuses])
-            phases = set([x["build__phase"] for x in build_statuses])
-            updated = False
-            if len(statuses) == 1:
-                projectbuild.status = list(statuses)[0]
-                updated = True
-            if len(phases) == 1:
-                projectbuild.phase = list(phases)[0]
-                if projectbuild.phase == "FINISHED":
-                    projectbuild.ended_at = timezone.now()
-                    projectbuild.save()
-                    projectbuild_finished.send(
-                        sender=ProjectBuild, projectbuild=projectbuild)
-            if updated:
-                projectbuild.save()
+            dependency.set_build(instance)
+
+
+@receiver(builds_updated, sender=Build, dispatch_uid="updated_builds_handler")
+def handle_updated_builds(sender, builds=(), **kwargs):
+    """
+    Does what handle_new_build and handle_builds_for_projectbuild do for
+    builds written in bulk, with a query for each job with FINISHED builds
+    and one for the ProjectBuildDependencies.
+    """
+    for build in get_latest_finished_builds(builds):
+        update_auto_tracking(build)
+
+    builds = dict(
+        ((build.job_id, build.build_id), build)
+        for build in builds if build.build_id)
+    if not builds:
+        return
+    dependencies = ProjectBuildDependency.objects.filter(
+        dependency__job__in=set(x[0] for x in builds),
+        projectbuild__build_id__in=set(x[1] for x in builds)).select_related(
+            "dependency", "projectbuild").order_by("pk")
+    for dependency in dependencies:
+        # Like handle_builds_for_projectbuild, only the first dependency
+        # matching each build.
+        build = builds.pop(
+            (dependency.dependency.job_id, dependency.projectbuild.build_id),
+            None)
+        if build is not None:
+            dependency.set_build(build)
+
+
+# Bumping the generations of the cached pages, see projects.cache.
+@receiver(post_save, sender=Build, dispatch_uid="build_cache_handler")
+def invalidate_build_caches(sender, instance, update_fields=None, **kwargs):
+    # The console logs aren't shown on the cached pages, and are saved on
+    # every fetch while a build is running.
+    if not Build.is_console_log_update(update_fields):
+        bump_generations(("job", instance.job_id), ("dependencies",))
+
+
+@receiver(builds_updated, sender=Build, dispatch_uid="builds_cache_handler")
+def invalidate_builds_caches(sender, job_ids, **kwargs):
+    bump_generations(("dependencies",), *[("job", x) for x in job_ids])
+
+
+@receiver(post_save, sender=Dependency, dispatch_uid="dependency_cache_save")
+@receiver(
+    post_delete, sender=Dependency, dispatch_uid="dependency_cache_delete")
+def invalidate_dependency_caches(sender, instance, **kwargs):
+    bump_generations(("job", instance.job_id), ("dependencies",))
+
+
+@receiver(post_save, sender=Project, dispatch_uid="project_cache_save")
+@receiver(post_delete, sender=Project, dispatch_uid="project_cache_delete")
+def invalidate_project_caches(sender, instance, **kwargs):
+    bump_generations(("project", instance.pk))
+
+
+@receiver(
+    post_save, sender=ProjectDependency,
+    dispatch_uid="projectdependency_cache_save")
+@receiver(
+    post_delete, sender=ProjectDependency,
+    dispatch_uid="projectdependency_cache_delete")
+@receiver(
+    post_save, sender=ProjectBuild, dispatch_uid="projectbuild_cache_save")
+@receiver(
+    post_delete, sender=ProjectBuild,
+    dispatch_uid="projectbuild_cache_delete")
+def invalidate_project_caches_for(sender, instance, **kwargs):
+    bump_generations(("project", instance.project_id))
+
+
+@receiver(projectbuild_finished, dispatch_uid="projectbuild_finished_cache")
+def invalidate_finished_projectbuild_caches(sender, projectbuild, **kwargs):
+    bump_generations(("project", projectbuild.project_id))
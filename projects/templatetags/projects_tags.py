@@ -1,21 +1,36 @@
 from django.template.base import Library
-from django.core.urlresolvers import reverse
+from django.utils.encoding import force_text
 
-from projects.models import ProjectBuild
+from projects.helpers import get_build_urls
 
 
 register = Library()
 
 
-@register.simple_tag()
-def build_url(build_id):
+def get_build_url_memo(context):
     """
-    Fetches the ProjectBuild for a given build_id, if any.
+    Returns the dictionary of build urls already resolved for this request,
+    starting from any build_urls the view resolved up front.
     """
-    try:
-        build = ProjectBuild.objects.get(build_id=build_id)
-        return reverse(
-            "project_projectbuild_detail",
-            kwargs={"project_pk": build.project.pk, "build_pk": build.pk})
-    except ProjectBuild.DoesNotExist:
-        return ""
+    request = context.get("request")
+    holder = request if request is not None else context.render_context
+    memo = getattr(holder, "_build_urls", None)
+    if memo is None:
+        memo = holder._build_urls = dict(context.get("build_urls") or {})
+    return memo
+
+
+@register.simple_tag(takes_context=True)
+def build_url(context, build_id):
+    """
+    Fetches the url of the ProjectBuild for a given build_id, if any.
+
+    Views listing builds should pass the urls for the page from
+    get_build_urls as build_urls, other build_ids are fetched one at a time
+    and remembered for the rest of the request.
+    """
+    memo = get_build_url_memo(context)
+    build_id = force_text(build_id)
+    if build_id not in memo:
+        memo.update(get_build_urls([build_id]))
+    return memo[build_id]
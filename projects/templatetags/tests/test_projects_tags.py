@@ -1,3 +1,4 @@
+from django.template import Context, Template
 from django.test import TestCase
 from django.core.urlresolvers import reverse
 
@@ -27,7 +28,7 @@ class BuildUrlTest(TestCase):
         expected_url = reverse(
             "project_projectbuild_detail",
             kwargs={"project_pk": project.pk, "build_pk": projectbuild.pk})
-        self.assertEqual(expected_url, build_url(build))
+        self.assertEqual(expected_url, build_url(Context(), build))
 
     def test_build_url_with_non_projectbuild(self):
         """
@@ -35,4 +36,18 @@ class BuildUrlTest(TestCase):
         # TODO: This should link to a Build Detail page in the jenkins app.
         """
         build = BuildFactory.create()
-        self.assertEqual("", build_url(build))
+        self.assertEqual("", build_url(Context(), build))
+
+    def test_build_url_uses_build_urls(self):
+        """
+        build_url should use the build_urls resolved by the view, and only
+        look up each other build_id once.
+        """
+        template = Template(
+            "{% load projects_tags %}"
+            "{% for x in build_ids %}{% build_url x %},{% endfor %}")
+        context = Context({
+            "build_ids": ["known", "other", "other"],
+            "build_urls": {"known": "/known/"}})
+        with self.assertNumQueries(1):
+            self.assertEqual("/known/,,,", template.render(context))
@@ -0,0 +1,211 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache, get_cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+import mock
+
+from .factories import ProjectFactory, DependencyFactory
+from jenkins.models import Build, builds_updated
+from capomastro.transactions import atomic, on_commit
+from jenkins.tests.factories import BuildFactory
+from projects.cache import (
+    bump_generations, get_cache_timeout, get_dependency_list_version,
+    get_or_set, get_project_version, get_version, is_cache_enabled)
+from projects.models import ProjectDependency
+
+
+@override_settings(PROJECTS_CACHE_ENABLED=True)
+class GenerationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_version_is_stable(self):
+        """
+        The version should be the same until the generation is bumped.
+        """
+        version = get_version(("project", 1))
+        self.assertEqual(version, get_version(("project", 1)))
+        bump_generations(("project", 1))
+        self.assertNotEqual(version, get_version(("project", 1)))
+
+    def test_bump_generations_without_generation(self):
+        """
+        Bumping a generation that isn't in the cache should start a new one.
+        """
+        bump_generations(("project", 1))
+        self.assertEqual(
+            get_version(("project", 1)), get_version(("project", 1)))
+
+    def test_get_or_set(self):
+        """
+        get_or_set should only compute the value once for each version.
+        """
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(1, get_or_set("testing", "a", compute))
+        self.assertEqual(1, get_or_set("testing", "a", compute))
+        self.assertEqual(2, get_or_set("testing", "b", compute))
+
+    def test_bump_generations_waits_for_commit(self):
+        """
+        Generations bumped in a transaction should only change once the
+        outermost transaction commits.
+        """
+        version = get_version(("project", 1))
+        with atomic():
+            with atomic():
+                bump_generations(("project", 1))
+            self.assertEqual(version, get_version(("project", 1)))
+        self.assertNotEqual(version, get_version(("project", 1)))
+
+    def test_console_log_saves_dont_bump_generations(self):
+        """
+        Saving only the console log of a build shouldn't change the version
+        of the pages showing it.
+        """
+        build = BuildFactory.create()
+        version = get_version(("job", build.job_id))
+        build.console_log_size = 10
+        build.save(update_fields=["console_log_size"])
+        self.assertEqual(version, get_version(("job", build.job_id)))
+
+        build.save()
+        self.assertNotEqual(version, get_version(("job", build.job_id)))
+
+
+@override_settings(PROJECTS_CACHE_ENABLED=True)
+class ProjectVersionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.project = ProjectFactory.create()
+        self.dependency = DependencyFactory.create()
+        ProjectDependency.objects.create(
+            project=self.project, dependency=self.dependency)
+
+    def test_new_build_changes_version(self):
+        """
+        A build for one of the project's dependencies should change the
+        project version and the dependency list version.
+        """
+        version = get_project_version(self.project)
+        list_version = get_dependency_list_version()
+        BuildFactory.create(job=self.dependency.job)
+        self.assertNotEqual(version, get_project_version(self.project))
+        self.assertNotEqual(list_version, get_dependency_list_version())
+
+    def test_unrelated_build_keeps_version(self):
+        """
+        Builds of other jobs shouldn't change the project version.
+        """
+        version = get_project_version(self.project)
+        BuildFactory.create()
+        self.assertEqual(version, get_project_version(self.project))
+
+    def test_builds_updated_changes_version(self):
+        """
+        Bulk updates to builds are signalled with builds_updated, which
+        should change the project version.
+        """
+        version = get_project_version(self.project)
+        builds_updated.send(sender=Build, job_ids=[self.dependency.job.pk])
+        self.assertNotEqual(version, get_project_version(self.project))
+
+    def test_new_dependency_changes_version(self):
+        """
+        Adding a dependency to the project should change its version.
+        """
+        version = get_project_version(self.project)
+        ProjectDependency.objects.create(
+            project=self.project, dependency=DependencyFactory.create())
+        self.assertNotEqual(version, get_project_version(self.project))
+
+
+class CacheBackendTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def get_shared_cache(self):
+        return get_cache(
+            "django.core.cache.backends.filebased.FileBasedCache",
+            LOCATION=self.location)
+
+    def test_pages_arent_cached_with_local_backend(self):
+        """
+        With a backend local to each process, changes in other processes
+        can't bump the generations, so nothing is cached.
+        """
+        self.assertFalse(is_cache_enabled())
+        self.assertEqual(0, get_cache_timeout())
+        self.assertIsNone(get_dependency_list_version())
+        values = iter([1, 2])
+        self.assertEqual(1, get_or_set("testing", None, lambda: next(values)))
+        self.assertEqual(2, get_or_set("testing", None, lambda: next(values)))
+
+    def test_bump_from_another_process(self):
+        """
+        With a shared backend, a bump from another process's cache changes
+        the version seen by this one.
+        """
+        with mock.patch("projects.cache.cache", self.get_shared_cache()):
+            self.assertTrue(is_cache_enabled())
+            version = get_version(("project", 1))
+
+        with mock.patch("projects.cache.cache", self.get_shared_cache()):
+            bump_generations(("project", 1))
+
+        with mock.patch("projects.cache.cache", self.get_shared_cache()):
+            self.assertNotEqual(version, get_version(("project", 1)))
+
+
+class OnCommitTest(TestCase):
+
+    def test_on_commit_outside_transaction(self):
+        """
+        Outside of atomic(), on_commit should run the function straight away.
+        """
+        calls = []
+        on_commit(lambda: calls.append(1))
+        self.assertEqual([1], calls)
+
+    def test_on_commit_runs_once_after_commit(self):
+        """
+        Functions should run once, after the outermost atomic() exits.
+        """
+        calls = []
+
+        def callback():
+            calls.append(1)
+
+        with atomic():
+            on_commit(callback)
+            with atomic():
+                on_commit(callback)
+            self.assertEqual([], calls)
+        self.assertEqual([1], calls)
+
+    def test_on_commit_dropped_on_rollback(self):
+        """
+        Functions shouldn't run if the transaction is rolled back.
+        """
+        calls = []
+        with self.assertRaises(ValueError):
+            with atomic():
+                on_commit(lambda: calls.append(1))
+                raise ValueError()
+        self.assertEqual([], calls)
+
+        on_commit(lambda: calls.append(2))
+        self.assertEqual([2], calls)
@@ -1,13 +1,15 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
 import mock
 
 from projects.models import (
     ProjectBuild, ProjectDependency, ProjectBuildDependency)
 from projects.helpers import (
     build_project, build_dependency, archive_projectbuild,
-    get_transport_for_projectbuild)
-from .factories import ProjectFactory, DependencyFactory
+    get_transport_for_projectbuild, get_build_urls)
+from .factories import ProjectFactory, DependencyFactory, ProjectBuildFactory
+from jenkins.models import Job
 from jenkins.tests.factories import BuildFactory, ArtifactFactory
 from archives.tests.factories import ArchiveFactory
 
@@ -86,7 +88,7 @@ class BuildProjectTest(TestCase):
             ProjectDependency.objects.create(
                 project=project, dependency=dep, auto_track=True)
 
-        build = BuildFactory.create(job=dep1.job)
+        build = BuildFactory.create(job=dep1.job, phase="FINISHED")
         # Reload object from database.
         project_dep1 = ProjectDependency.objects.get(
             project=project, dependency=dep1)
@@ -106,6 +108,41 @@ class BuildProjectTest(TestCase):
             [mock.call(dep1.job.pk, build_id=new_build.build_id),
              mock.call(dep2.job.pk, build_id=new_build.build_id)])
 
+    def test_build_project_with_build_started_while_queueing(self):
+        """
+        A build that starts before build_project returns should move the
+        counters on, so the ProjectBuild finishes when the builds do.
+        """
+        project = ProjectFactory.create()
+        dependency1 = DependencyFactory.create()
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency1)
+        dependency2 = DependencyFactory.create()
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency2)
+        builds = []
+
+        def start_build(job_pk, build_id, **kwargs):
+            builds.append(BuildFactory.create(
+                job=Job.objects.get(pk=job_pk), build_id=build_id,
+                phase="STARTED"))
+
+        with mock.patch("projects.helpers.build_job") as mock_build_job:
+            mock_build_job.delay.side_effect = start_build
+            projectbuild = build_project(project)
+
+        for build in builds:
+            build.phase, build.status = "FINISHED", "SUCCESS"
+            build.save()
+
+        projectbuild = ProjectBuild.objects.get(pk=projectbuild.pk)
+        self.assertEqual(
+            (0, 0, 2, 0),
+            (projectbuild.pending_count, projectbuild.running_count,
+             projectbuild.succeeded_count, projectbuild.failed_count))
+        self.assertEqual("FINISHED", projectbuild.phase)
+        self.assertEqual("SUCCESS", projectbuild.status)
+
     def test_build_project_assigns_user_correctly(self):
         """
         If we pass a user to build_project, the user is assigned as the user
@@ -162,6 +199,52 @@ class BuildDependencyTest(TestCase):
             dependency.job.pk, build_id="201403.2")
 
 
+class GetBuildUrlsTest(TestCase):
+
+    def test_get_build_urls(self):
+        """
+        get_build_urls should map the build_ids of ProjectBuilds to their
+        urls, and other build_ids to an empty string, in one query.
+        """
+        projectbuilds = ProjectBuildFactory.create_batch(
+            3, project=ProjectFactory.create())
+        build_ids = [x.build_id for x in projectbuilds[:2]] + ["unknown"]
+
+        with self.assertNumQueries(1):
+            build_urls = get_build_urls(build_ids)
+
+        expected = dict(
+            (x.build_id, reverse(
+                "project_projectbuild_detail",
+                kwargs={"project_pk": x.project.pk, "build_pk": x.pk}))
+            for x in projectbuilds[:2])
+        expected["unknown"] = ""
+        self.assertEqual(expected, build_urls)
+
+    def test_get_build_urls_with_shared_build_id(self):
+        """
+        Where projects share a build_id, get_build_urls should use the
+        earliest ProjectBuild.
+        """
+        projectbuild = ProjectBuildFactory.create()
+        ProjectBuildFactory.create(build_id=projectbuild.build_id)
+
+        build_urls = get_build_urls([projectbuild.build_id])
+        self.assertEqual(
+            reverse(
+                "project_projectbuild_detail",
+                kwargs={"project_pk": projectbuild.project.pk,
+                        "build_pk": projectbuild.pk}),
+            build_urls[projectbuild.build_id])
+
+    def test_get_build_urls_with_non_ascii_build_id(self):
+        """
+        The build_ids come from the Jenkins parameters, so needn't be ASCII.
+        """
+        self.assertEqual(
+            {u"caf\xe9": ""}, get_build_urls([u"caf\xe9"]))
+
+
 class ArchiveProjectBuildTest(TestCase):
 
     def test_get_transport_for_projectbuild(self):
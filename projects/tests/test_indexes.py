@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from jenkins.tests.factories import BuildFactory, JobFactory
+from jenkins.tests.helpers import QueryPlanTestCase
+from projects.models import ProjectBuild, ProjectBuildDependency
+from .factories import ProjectFactory, ProjectBuildFactory
+
+
+class QueryPlanTest(QueryPlanTestCase):
+    """
+    The queries on the hot paths, for matching builds to projectbuilds and
+    the projectbuild listings, should be answered from an index, not by
+    scanning the table.
+    """
+
+    def setUp(self):
+        self.project = ProjectFactory.create()
+        self.job = JobFactory.create()
+        for job in [self.job] + JobFactory.create_batch(4):
+            for number in range(1, 21):
+                BuildFactory.create(
+                    job=job, number=number,
+                    build_id="%s.%d" % (job.name, number))
+        ProjectBuildFactory.create_batch(20, project=self.project)
+        ProjectBuildFactory.create_batch(20)
+        self.analyze()
+
+    def test_projectbuilds_by_date(self):
+        """
+        The projectbuilds of a project are listed by date.
+        """
+        now = timezone.now()
+        self.assertNoTableScans(
+            ProjectBuild.objects.filter(
+                project=self.project,
+                requested_at__gt=now - timedelta(days=1),
+                requested_at__lte=now))
+
+    def test_projectbuild_by_build_id(self):
+        """
+        Incoming builds are matched to their projectbuild by the build_id.
+        """
+        self.assertNoTableScans(
+            ProjectBuild.objects.filter(build_id="20140101.1"))
+        self.assertNoTableScans(
+            ProjectBuildDependency.objects.filter(
+                dependency__job=self.job,
+                projectbuild__build_id="20140101.1"))
+
+    def test_projectbuild_artifacts(self):
+        """
+        The artifacts of a projectbuild are found through its dependencies.
+        """
+        projectbuild = ProjectBuild.objects.filter(project=self.project)[0]
+        self.assertNoTableScans(projectbuild.get_current_artifacts())
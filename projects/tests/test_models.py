@@ -1,3 +1,4 @@
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -8,6 +9,8 @@ from projects.models import (
     ProjectBuildDependency, projectbuild_finished)
 from .factories import (
     ProjectFactory, DependencyFactory, ProjectBuildFactory)
+from jenkins.helpers import sync_builds
+from jenkins.models import Build, builds_updated
 from jenkins.tests.factories import JobFactory, BuildFactory, ArtifactFactory
 
 
@@ -28,7 +31,8 @@ class DependencyTest(TestCase):
         build2 = BuildFactory.create(
             phase="FINISHED", status="SUCCESS", job=build1.job)
         dependency = DependencyFactory.create(job=build1.job)
-        self.assertEqual(build2, dependency.get_current_build())
+        with self.assertNumQueries(1):
+            self.assertEqual(build2, dependency.get_current_build())
 
     def test_get_current_build_with_no_builds(self):
         """
@@ -85,12 +89,72 @@ class ProjectDependencyTest(TestCase):
         project_dependency.current_build = build1
         project_dependency.save()
 
-        build2 = BuildFactory.create(job=build1.job)
+        build2 = BuildFactory.create(job=build1.job, phase="FINISHED")
         # Reload the project dependency
         project_dependency = ProjectDependency.objects.get(
             pk=project_dependency.pk)
         self.assertEqual(build2, project_dependency.current_build)
 
+    def test_auto_track_build_waits_for_finished_builds(self):
+        """
+        The current_build should only be updated when a build has FINISHED.
+        """
+        build1 = BuildFactory.create(phase="FINISHED")
+        dependency = DependencyFactory.create(job=build1.job)
+        project_dependency = ProjectDependency.objects.create(
+            project=ProjectFactory.create(), dependency=dependency,
+            current_build=build1)
+
+        build2 = BuildFactory.create(job=build1.job, phase="STARTED")
+        project_dependency = ProjectDependency.objects.get(
+            pk=project_dependency.pk)
+        self.assertEqual(build1, project_dependency.current_build)
+
+        build2.phase = "FINISHED"
+        build2.save()
+        project_dependency = ProjectDependency.objects.get(
+            pk=project_dependency.pk)
+        self.assertEqual(build2, project_dependency.current_build)
+
+    def test_auto_track_build_ignores_older_builds(self):
+        """
+        An older build finishing, e.g. when importing the history of a job,
+        shouldn't replace a later current_build.
+        """
+        build2 = BuildFactory.create(number=2, phase="FINISHED")
+        dependency = DependencyFactory.create(job=build2.job)
+        project_dependency = ProjectDependency.objects.create(
+            project=ProjectFactory.create(), dependency=dependency,
+            current_build=build2)
+
+        BuildFactory.create(job=build2.job, number=1, phase="FINISHED")
+        project_dependency = ProjectDependency.objects.get(
+            pk=project_dependency.pk)
+        self.assertEqual(build2, project_dependency.current_build)
+
+    def test_auto_track_build_is_a_single_update(self):
+        """
+        Finishing a build updates all the projects tracking it in one query,
+        and saving it again doesn't touch them.
+        """
+        dependency = DependencyFactory.create()
+        for project in ProjectFactory.create_batch(5):
+            ProjectDependency.objects.create(
+                project=project, dependency=dependency)
+        build = BuildFactory.create(job=dependency.job, phase="STARTED")
+
+        # Saving the build, updating the job and the projects, and looking
+        # for a projectbuild for the build.
+        build.phase = "FINISHED"
+        with self.assertNumQueries(4):
+            build.save()
+        self.assertEqual(
+            5, ProjectDependency.objects.filter(current_build=build).count())
+
+        build.status = "FAILURE"
+        with self.assertNumQueries(2):
+            build.save()
+
     def test_new_build_with_no_auto_track_build(self):
         """
         If we create a new build for a dependency of a Project, and the
@@ -106,7 +170,7 @@ class ProjectDependencyTest(TestCase):
         project_dependency.current_build = build1
         project_dependency.save()
 
-        BuildFactory.create(job=build1.job)
+        BuildFactory.create(job=build1.job, phase="FINISHED")
         # Reload the project dependency
         project_dependency = ProjectDependency.objects.get(
             pk=project_dependency.pk)
@@ -125,14 +189,50 @@ class ProjectTest(TestCase):
         dependency = DependencyFactory.create(job=job)
         ProjectDependency.objects.create(
             project=project, dependency=dependency)
-        build1 = BuildFactory.create(job=job)
-        build2 = BuildFactory.create(job=job)
+        build1 = BuildFactory.create(job=job, phase="FINISHED")
+        build2 = BuildFactory.create(job=job, phase="FINISHED")
 
         ArtifactFactory.create(build=build1)
         artifact2 = ArtifactFactory.create(build=build2)
 
         self.assertEqual([artifact2], list(project.get_current_artifacts()))
 
+    def test_get_current_artifacts_is_one_query(self):
+        """
+        Project.get_current_artifacts should fetch the artifacts of all the
+        current builds in one query, skipping dependencies without one.
+        """
+        project = ProjectFactory.create()
+        artifacts = []
+        for dependency in DependencyFactory.create_batch(5):
+            build = BuildFactory.create(job=dependency.job, phase="FINISHED")
+            artifacts.extend(ArtifactFactory.create_batch(2, build=build))
+            ProjectDependency.objects.create(
+                project=project, dependency=dependency, current_build=build)
+        ProjectDependency.objects.create(
+            project=project, dependency=DependencyFactory.create())
+        ArtifactFactory.create()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(artifacts),
+                set(project.get_current_artifacts().iterator()))
+
+    def test_get_current_artifacts_with_shared_build(self):
+        """
+        The artifacts of a build that's current for more than one of the
+        project's dependencies should only be returned once.
+        """
+        project = ProjectFactory.create()
+        job = JobFactory.create()
+        build = BuildFactory.create(job=job, phase="FINISHED")
+        artifact = ArtifactFactory.create(build=build)
+        for dependency in DependencyFactory.create_batch(2, job=job):
+            ProjectDependency.objects.create(
+                project=project, dependency=dependency, current_build=build)
+
+        self.assertEqual([artifact], list(project.get_current_artifacts()))
+
 
 class ProjectBuildTest(TestCase):
 
@@ -151,8 +251,35 @@ class ProjectBuildTest(TestCase):
         expected_build_id = timezone.now().strftime("%Y%m%d.1")
         self.assertEqual(expected_build_id, generate_projectbuild_id(build1))
         build2 = ProjectBuildFactory.create(project=build1.project)
-        expected_build_id = timezone.now().strftime("%Y%m%d.2")
+        expected_build_id = timezone.now().strftime("%Y%m%d.3")
         self.assertEqual(expected_build_id, generate_projectbuild_id(build2))
+        self.assertEqual(
+            timezone.now().strftime("%Y%m%d.2"), build2.build_id)
+
+    def test_generate_projectbuild_id_per_project(self):
+        """
+        Each project has its own sequence of ids, and ids are never reused
+        even if builds are deleted.
+        """
+        build1 = ProjectBuildFactory.create(project=self.project)
+        build2 = ProjectBuildFactory.create()
+        self.assertEqual(build1.build_id, build2.build_id)
+
+        build1.delete()
+        build3 = ProjectBuildFactory.create(project=self.project)
+        self.assertEqual(
+            timezone.now().strftime("%Y%m%d.1"), build3.build_id)
+
+    def test_build_id_is_unique_for_project(self):
+        """
+        Two builds of a project can't have the same build_id.
+        """
+        build = ProjectBuildFactory.create(project=self.project)
+        duplicate = ProjectBuild(
+            project=self.project, build_id=build.build_id)
+        with self.assertRaises(IntegrityError):
+            # Bypassing the generated id.
+            super(ProjectBuild, duplicate).save()
 
     def test_instantiation(self):
         """
@@ -256,3 +383,186 @@ class ProjectBuildTest(TestCase):
                 job=job, build_id=projectbuild.build_id, phase="FINISHED")
 
         self.assertEqual(projectbuild, self.projectbuild)
+
+    def create_projectbuild(self, dependencies):
+        """
+        Returns a projectbuild of a project with the number of dependencies.
+        """
+        project = ProjectFactory.create()
+        for dependency in DependencyFactory.create_batch(dependencies):
+            ProjectDependency.objects.create(
+                project=project, dependency=dependency)
+        from projects.helpers import build_project
+        return build_project(project, queue_build=False)
+
+    def get_counts(self, projectbuild):
+        return ProjectBuild.objects.values_list(
+            "pending_count", "running_count", "succeeded_count",
+            "failed_count").get(pk=projectbuild.pk)
+
+    def test_get_current_artifacts(self):
+        """
+        ProjectBuild.get_current_artifacts returns the artifacts of the
+        builds of its dependencies, including those pinned to an earlier
+        build, but not other builds with the same build_id.
+        """
+        project = ProjectFactory.create()
+        dependency1, dependency2 = DependencyFactory.create_batch(2)
+        pinned = BuildFactory.create(job=dependency2.job, phase="FINISHED")
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency1)
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency2, auto_track=False,
+            current_build=pinned)
+
+        from projects.helpers import build_project
+        projectbuild = build_project(
+            project, dependencies=[dependency1], queue_build=False)
+        build = BuildFactory.create(
+            job=dependency1.job, build_id=projectbuild.build_id)
+        artifact1 = ArtifactFactory.create(build=build)
+        artifact2 = ArtifactFactory.create(build=pinned)
+        ArtifactFactory.create(
+            build=BuildFactory.create(build_id=projectbuild.build_id))
+
+        with self.assertNumQueries(1):
+            artifacts = list(projectbuild.get_current_artifacts())
+        self.assertEqual(
+            set([artifact1, artifact2]), set(artifacts))
+
+    def test_project_build_counts_dependency_states(self):
+        """
+        The projectbuild should count its dependencies in each state as their
+        builds start and finish, and FAIL if any of them failed.
+        """
+        projectbuild = self.create_projectbuild(3)
+        self.assertEqual((3, 0, 0, 0), self.get_counts(projectbuild))
+        job1, job2, job3 = [
+            x.dependency.job
+            for x in projectbuild.projectbuilddependency_set.all()]
+
+        build1 = BuildFactory.create(
+            job=job1, build_id=projectbuild.build_id, phase="STARTED")
+        BuildFactory.create(
+            job=job2, build_id=projectbuild.build_id, phase="FINISHED",
+            status="FAILURE")
+        self.assertEqual((1, 1, 0, 1), self.get_counts(projectbuild))
+        self.assertEqual(
+            "STARTED", ProjectBuild.objects.get(pk=projectbuild.pk).phase)
+
+        build1.phase = "FINISHED"
+        build1.save()
+        BuildFactory.create(
+            job=job3, build_id=projectbuild.build_id, phase="FINISHED")
+        self.assertEqual((0, 0, 2, 1), self.get_counts(projectbuild))
+
+        projectbuild = ProjectBuild.objects.get(pk=projectbuild.pk)
+        self.assertEqual("FINISHED", projectbuild.phase)
+        self.assertEqual("FAILURE", projectbuild.status)
+        self.assertIsNotNone(projectbuild.ended_at)
+
+    def test_project_build_sends_finished_signal_once(self):
+        """
+        Saving the builds of a FINISHED projectbuild again doesn't send
+        projectbuild_finished again.
+        """
+        finished = []
+
+        @receiver(projectbuild_finished, sender=ProjectBuild)
+        def handle_signal(sender, projectbuild, **kwargs):
+            finished.append(projectbuild)
+
+        projectbuild = self.create_projectbuild(1)
+        job = projectbuild.projectbuilddependency_set.get().dependency.job
+        build = BuildFactory.create(
+            job=job, build_id=projectbuild.build_id, phase="FINISHED")
+        build.save()
+        self.assertEqual([projectbuild], finished)
+
+    def test_set_build_with_a_stale_state(self):
+        """
+        If the state of a dependency changed since it was loaded, the counters
+        are moved on from the state in the database.
+        """
+        projectbuild = self.create_projectbuild(1)
+        stale = projectbuild.projectbuilddependency_set.get()
+        BuildFactory.create(
+            job=stale.dependency.job, build_id=projectbuild.build_id,
+            phase="STARTED")
+
+        stale.set_build(BuildFactory.create(
+            job=stale.dependency.job, build_id="other", phase="FINISHED"))
+        self.assertEqual((0, 0, 1, 0), self.get_counts(projectbuild))
+
+    def test_build_save_queries_dont_depend_on_dependencies(self):
+        """
+        Updating the projectbuild for a build is a fixed number of queries,
+        however many dependencies the projectbuild has.
+        """
+        for dependencies in [2, 20]:
+            projectbuild = self.create_projectbuild(dependencies)
+            dependency = projectbuild.projectbuilddependency_set.all()[0]
+            build = BuildFactory.create(
+                job=dependency.dependency.job,
+                build_id=projectbuild.build_id, phase="STARTED")
+            build.phase = "FINISHED"
+            with self.assertNumQueries(9):
+                build.save()
+
+    def test_builds_updated_updates_projectbuild(self):
+        """
+        Builds written in bulk and sent with builds_updated should move the
+        projectbuild and the auto-tracking dependencies on, as saving them
+        would.
+        """
+        projectbuild = self.create_projectbuild(2)
+        dependency1, dependency2 = [
+            x.dependency
+            for x in projectbuild.projectbuilddependency_set.all()]
+        Build.objects.bulk_create([
+            Build(job=dependency1.job, number=1, phase="FINISHED",
+                  status="SUCCESS", build_id=projectbuild.build_id),
+            Build(job=dependency2.job, number=1, phase="STARTED",
+                  build_id=projectbuild.build_id)])
+        builds = list(Build.objects.all())
+
+        builds_updated.send(
+            sender=Build, job_ids=[dependency1.job.pk, dependency2.job.pk],
+            builds=builds)
+
+        self.assertEqual((0, 1, 1, 0), self.get_counts(projectbuild))
+        self.assertEqual(
+            "STARTED", ProjectBuild.objects.get(pk=projectbuild.pk).phase)
+        self.assertEqual(
+            Build.objects.get(job=dependency1.job),
+            ProjectDependency.objects.get(
+                dependency=dependency1).current_build)
+
+    def test_synced_builds_update_projectbuild(self):
+        """
+        Syncing a FINISHED build of a projectbuild's dependency should
+        finish the projectbuild and make the build's artifacts current, as
+        a notification would.
+        """
+        projectbuild = self.create_projectbuild(1)
+        dependency = projectbuild.projectbuilddependency_set.get()
+        job = dependency.dependency.job
+        BuildFactory.create(
+            job=job, number=1, build_id=projectbuild.build_id,
+            phase="STARTED")
+        self.assertEqual((0, 1, 0, 0), self.get_counts(projectbuild))
+
+        with transaction.atomic():
+            sync_builds(job, {1: {
+                "build_id": projectbuild.build_id, "phase": "FINISHED",
+                "status": "SUCCESS", "duration": 100,
+                "url": "http://localhost/1",
+                "artifacts": [("a.deb", "http://localhost/a.deb")]}})
+
+        self.assertEqual((0, 0, 1, 0), self.get_counts(projectbuild))
+        projectbuild = ProjectBuild.objects.get(pk=projectbuild.pk)
+        self.assertEqual("FINISHED", projectbuild.phase)
+        self.assertEqual("SUCCESS", projectbuild.status)
+        self.assertEqual(
+            ["a.deb"],
+            [x.filename for x in projectbuild.get_current_artifacts()])
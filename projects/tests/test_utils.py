@@ -3,7 +3,7 @@ from django.test import TestCase
 from .factories import ProjectFactory, DependencyFactory
 from jenkins.tests.factories import BuildFactory
 from projects.models import ProjectDependency
-from projects.utils import get_build_table_for_project
+from projects.utils import BuildTableCell, get_build_table_for_project
 
 
 class GetBuildTableForProjectTest(TestCase):
@@ -25,11 +25,11 @@ class GetBuildTableForProjectTest(TestCase):
 
         self.assertEqual([dependency], header)
         self.assertEqual([
-            [{"build": build5, "current": True}],
-            [{"build": build4, "current": False}],
-            [{"build": build3, "current": False}],
-            [{"build": build2, "current": False}],
-            [{"build": build1, "current": False}]], table)
+            [BuildTableCell(build5, True)],
+            [BuildTableCell(build4, False)],
+            [BuildTableCell(build3, False)],
+            [BuildTableCell(build2, False)],
+            [BuildTableCell(build1, False)]], table)
 
     def test_get_build_table_for_project_with_multiple_dependencies(self):
         """
@@ -56,16 +56,16 @@ class GetBuildTableForProjectTest(TestCase):
 
         self.assertEqual([dependency1, dependency2], header)
         self.assertEqual([
-            [{"build": build5, "current": True},
-             {"build": build10, "current": False}],
-            [{"build": build4, "current": False},
-             {"build": build9, "current": False}],
-            [{"build": build3, "current": False},
-             {"build": build8, "current": True}],
-            [{"build": build2, "current": False},
-             {"build": build7, "current": False}],
-            [{"build": build1, "current": False},
-             {"build": build6, "current": False}]], table)
+            [BuildTableCell(build5, True),
+             BuildTableCell(build10, False)],
+            [BuildTableCell(build4, False),
+             BuildTableCell(build9, False)],
+            [BuildTableCell(build3, False),
+             BuildTableCell(build8, True)],
+            [BuildTableCell(build2, False),
+             BuildTableCell(build7, False)],
+            [BuildTableCell(build1, False),
+             BuildTableCell(build6, False)]], table)
 
     def test_get_build_table_with_current_build_outside_recent(self):
         """
@@ -87,9 +87,50 @@ class GetBuildTableForProjectTest(TestCase):
 
         self.assertEqual([dependency], header)
         self.assertEqual([
-            [{"build": build5, "current": False}],
-            [{"build": build4, "current": False}],
-            [{"build": build3, "current": False}],
-            [{"build": build2, "current": False}],
-            [{"build": build1, "current": False}],
-            [{"build": build, "current": True}]], table)
+            [BuildTableCell(build5, False)],
+            [BuildTableCell(build4, False)],
+            [BuildTableCell(build3, False)],
+            [BuildTableCell(build2, False)],
+            [BuildTableCell(build1, False)],
+            [BuildTableCell(build, True)]], table)
+
+    def test_get_build_table_for_project_queries(self):
+        """
+        The table should take the same number of queries however many
+        dependencies the project has.
+        """
+        project = ProjectFactory.create()
+        for dependency in DependencyFactory.create_batch(10):
+            builds = BuildFactory.create_batch(7, job=dependency.job)
+            ProjectDependency.objects.create(
+                project=project, dependency=dependency, auto_track=False,
+                current_build=builds[0])
+
+        with self.assertNumQueries(2):
+            header, table = get_build_table_for_project(project)
+            [[x.build.number for x in row] for row in table]
+
+        self.assertEqual(10, len(header))
+        self.assertEqual(6, len(table))
+        self.assertTrue(all(x.current for x in table[5]))
+
+    def test_get_build_table_for_project_with_few_builds(self):
+        """
+        Dependencies without enough builds, or without a job, should get
+        empty cells.
+        """
+        project = ProjectFactory.create()
+        dependency1 = DependencyFactory.create()
+        build = BuildFactory.create(job=dependency1.job)
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency1, auto_track=False)
+        dependency2 = DependencyFactory.create(job=None)
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency2, auto_track=False)
+
+        header, table = get_build_table_for_project(project)
+
+        self.assertEqual([dependency1, dependency2], header)
+        self.assertEqual(
+            [[BuildTableCell(build, False), BuildTableCell(None, False)]] +
+            [[BuildTableCell(None, False)] * 2] * 4, table)
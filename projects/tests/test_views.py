@@ -1,17 +1,21 @@
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.test.utils import override_settings
 
 from django_webtest import WebTest
 import mock
 
 from projects.models import (
-    ProjectDependency, Project, Dependency, ProjectBuildDependency)
+    ProjectDependency, Project, Dependency, ProjectBuild,
+    ProjectBuildDependency)
 from projects.helpers import build_project
 from jenkins.models import Job
 from .factories import (
     ProjectFactory, DependencyFactory, ProjectBuildFactory)
 from jenkins.tests.factories import (
-    BuildFactory, JobFactory, JobTypeFactory, JenkinsServerFactory)
+    ArtifactFactory, BuildFactory, JobFactory, JobTypeFactory,
+    JenkinsServerFactory)
 
 # TODO Introduce subclass of WebTest that allows easy assertions that a page
 # requires various permissions...
@@ -19,10 +23,12 @@ from jenkins.tests.factories import (
 # Django-Braces mixins.
 
 
+@override_settings(PROJECTS_CACHE_ENABLED=True)
 class ProjectDetailTest(WebTest):
 
     def setUp(self):
         self.user = User.objects.create_user("testing")
+        cache.clear()
 
     def test_page_requires_authenticated_user(self):
         """
@@ -50,6 +56,50 @@ class ProjectDetailTest(WebTest):
         self.assertEqual(
             projectbuilds[:5], list(response.context["projectbuilds"]))
 
+    def test_project_detail_queries(self):
+        """
+        The page should take the same number of queries however many
+        dependencies and artifacts the project has.
+        """
+        for count in [1, 10]:
+            project = ProjectFactory.create()
+            for dependency in DependencyFactory.create_batch(count):
+                build = BuildFactory.create(
+                    job=dependency.job, phase="FINISHED")
+                ArtifactFactory.create_batch(2, build=build)
+                ProjectDependency.objects.create(
+                    project=project, dependency=dependency,
+                    current_build=build)
+            for x in range(count):
+                build_project(project, queue_build=False)
+
+            project_url = reverse(
+                "project_detail", kwargs={"pk": project.pk})
+            # Logging in takes extra queries on the first request.
+            self.app.get(project_url, user="testing")
+            cache.clear()
+            with self.assertNumQueries(7):
+                self.app.get(project_url, user="testing")
+
+    def test_project_detail_is_cached(self):
+        """
+        Once rendered, the page should be served from the cache until
+        something it shows changes.
+        """
+        project = ProjectFactory.create()
+        dependency = DependencyFactory.create()
+        ProjectDependency.objects.create(
+            project=project, dependency=dependency)
+        project_url = reverse("project_detail", kwargs={"pk": project.pk})
+        self.app.get(project_url, user="testing")
+        with self.assertNumQueries(4):
+            self.app.get(project_url, user="testing")
+
+        # A new build for a dependency could change the current build.
+        BuildFactory.create(job=dependency.job, phase="FINISHED")
+        with self.assertNumQueries(7):
+            self.app.get(project_url, user="testing")
+
 
 class ProjectCreateTest(WebTest):
 
@@ -159,6 +209,49 @@ class ProjectBuildListTest(WebTest):
             set([projectbuild]), set(response.context["projectbuilds"]))
         self.assertEqual(project, response.context["project"])
 
+    def test_projectbuild_list_view_is_paginated(self):
+        """
+        Project builds are shown most recent first, a page at a time, even
+        when builds were requested at the same time.
+        """
+        project = ProjectFactory.create()
+        projectbuilds = ProjectBuildFactory.create_batch(5, project=project)
+        ProjectBuild.objects.filter(
+            pk__in=[x.pk for x in projectbuilds[1:4]]).update(
+                requested_at=projectbuilds[0].requested_at)
+        expected = sorted(
+            ProjectBuild.objects.filter(project=project),
+            key=lambda x: (x.requested_at, x.pk), reverse=True)
+
+        url = reverse("project_projectbuild_list", kwargs={"pk": project.pk})
+        seen = []
+        params = {}
+        with mock.patch(
+                "projects.views.ProjectBuildListView.page_size", 2):
+            while True:
+                response = self.app.get(url, params, user="testing")
+                seen.extend(response.context["projectbuilds"])
+                if response.context["next_page"] is None:
+                    break
+                params = {"after": response.context["next_page"]}
+
+        self.assertEqual(expected, seen)
+
+    def test_projectbuild_list_view_as_json(self):
+        """
+        With format=json, we get the page of project builds as JSON.
+        """
+        projectbuild = ProjectBuildFactory.create()
+        url = reverse(
+            "project_projectbuild_list",
+            kwargs={"pk": projectbuild.project.pk})
+        response = self.app.get(url, {"format": "json"}, user="testing")
+
+        self.assertEqual(
+            [projectbuild.build_id],
+            [x["build_id"] for x in response.json["results"]])
+        self.assertIsNone(response.json["next"])
+
 
 class ProjectBuildDetailTest(WebTest):
 
@@ -196,6 +289,31 @@ class ProjectBuildDetailTest(WebTest):
         self.assertEqual(
             list(dependencies), list(response.context["dependencies"]))
 
+    def test_project_build_detail_view_queries(self):
+        """
+        The page should take the same number of queries however many
+        dependencies and artifacts the project build has.
+        """
+        for count in [1, 10]:
+            project = ProjectFactory.create()
+            for dependency in DependencyFactory.create_batch(count):
+                ProjectDependency.objects.create(
+                    project=project, dependency=dependency)
+            projectbuild = build_project(project, queue_build=False)
+            for dependency in project.dependencies.all()[1:]:
+                build = BuildFactory.create(
+                    job=dependency.job, build_id=projectbuild.build_id)
+                ArtifactFactory.create_batch(2, build=build)
+
+            url = reverse(
+                "project_projectbuild_detail",
+                kwargs={"project_pk": project.pk,
+                        "build_pk": projectbuild.pk})
+            # Logging in takes extra queries on the first request.
+            self.app.get(url, user="testing")
+            with self.assertNumQueries(5):
+                self.app.get(url, user="testing")
+
 
 class DependencyListTest(WebTest):
 
@@ -225,6 +343,24 @@ class DependencyListTest(WebTest):
         self.assertEqual(
             dependencies[0].job.jobtype.name, response.html.title.text)
 
+    def test_dependency_list_view_shows_current_build(self):
+        """
+        The Dependency List should show the current build of each dependency,
+        without a query per dependency.
+        """
+        dependencies = DependencyFactory.create_batch(5)
+        for dependency in dependencies:
+            BuildFactory.create(
+                job=dependency.job, number=7, phase="FINISHED")
+        url = reverse("dependency_list")
+        response = self.app.get(url, user="testing")
+
+        with self.assertNumQueries(0):
+            numbers = [
+                x.job.latest_finished_build.number
+                for x in response.context["dependencies"]]
+        self.assertEqual([7] * 5, numbers)
+
 
 class DependencyCreateTest(WebTest):
 
@@ -287,6 +423,71 @@ class DependencyDetailTest(WebTest):
         self.assertEqual(dependency, response.context["dependency"])
         self.assertEqual([project], list(response.context["projects"]))
 
+    def test_dependency_detail_builds_are_paginated(self):
+        """
+        The builds for the dependency are shown a page at a time.
+        """
+        dependency = DependencyFactory.create()
+        for number in range(1, 4):
+            BuildFactory.create(job=dependency.job, number=number)
+        BuildFactory.create()
+        url = reverse("dependency_detail", kwargs={"pk": dependency.pk})
+        with mock.patch("projects.views.DependencyDetailView.page_size", 2):
+            response = self.app.get(url, user="testing")
+            self.assertEqual(
+                [3, 2], [x.number for x in response.context["builds"]])
+            response = self.app.get(
+                url, {"after": response.context["next_page"]},
+                user="testing")
+        self.assertEqual(
+            [1], [x.number for x in response.context["builds"]])
+
+    def test_dependency_detail_as_json(self):
+        """
+        With format=json, we get the page of builds as JSON, or a 404 for
+        an unknown dependency.
+        """
+        dependency = DependencyFactory.create()
+        BuildFactory.create(job=dependency.job, number=5)
+        url = reverse("dependency_detail", kwargs={"pk": dependency.pk})
+        response = self.app.get(url, {"format": "json"}, user="testing")
+        self.assertEqual([5], [x["number"] for x in response.json["results"]])
+
+        url = reverse("dependency_detail", kwargs={"pk": dependency.pk + 1})
+        self.app.get(url, {"format": "json"}, user="testing", status=404)
+
+    def test_dependency_detail_resolves_build_urls(self):
+        """
+        The links to the projectbuilds of the builds on the page are
+        resolved together.
+        """
+        dependency = DependencyFactory.create()
+        projectbuild = ProjectBuildFactory.create()
+        BuildFactory.create(
+            job=dependency.job, build_id=projectbuild.build_id)
+        BuildFactory.create(job=dependency.job, build_id="other")
+        url = reverse("dependency_detail", kwargs={"pk": dependency.pk})
+        response = self.app.get(url, user="testing")
+
+        projectbuild_url = reverse(
+            "project_projectbuild_detail",
+            kwargs={"project_pk": projectbuild.project.pk,
+                    "build_pk": projectbuild.pk})
+        self.assertEqual(
+            {projectbuild.build_id: projectbuild_url, "other": ""},
+            response.context["build_urls"])
+        response.click(projectbuild.build_id, href=projectbuild_url)
+
+    def test_dependency_detail_with_non_ascii_build_id(self):
+        """
+        The build_ids come from the Jenkins parameters, so needn't be ASCII.
+        """
+        dependency = DependencyFactory.create()
+        BuildFactory.create(job=dependency.job, build_id=u"caf\xe9")
+        url = reverse("dependency_detail", kwargs={"pk": dependency.pk})
+        response = self.app.get(url, user="testing")
+        self.assertEqual({u"caf\xe9": ""}, response.context["build_urls"])
+
     def test_dependency_build(self):
         """
         It's possible to request a build of a dependency from the dependendency
@@ -1,13 +1,56 @@
-from jenkins.models import Build
+from collections import namedtuple
+
+from django.db import connection
+
+from jenkins.models import Build, Job
 from projects.models import ProjectDependency
 
 
-def get_recent_builds_for_dependency(dependency):
+RECENT_BUILDS = 5
+
+BuildTableCell = namedtuple("BuildTableCell", ["build", "current"])
+
+
+def get_recent_builds_for_jobs(job_ids, extra_build_ids=(),
+                               count=RECENT_BUILDS):
     """
-    Get the most recent 5 builds for a given dependency.
+    Get the most recent builds for each of the jobs, and any extra builds
+    of theirs, in a single query.
+
+    Returns a dictionary mapping the job ids to their builds, most recent
+    first, with any extra builds outwith the recent builds last.
     """
-    return list(
-        Build.objects.filter(job=dependency.job).order_by("-number")[:5])
+    recent_builds = dict((x, []) for x in job_ids)
+    job_ids = [x for x in recent_builds if x is not None]
+    extra_build_ids = [x for x in extra_build_ids if x is not None]
+    if not job_ids:
+        return recent_builds
+
+    # Each job's recent builds are those numbered from its count'th most
+    # recent, which the (job, number) index finds without reading the rest.
+    table = connection.ops.quote_name(Build._meta.db_table)
+    sql = (
+        "SELECT builds.* FROM ("
+        "SELECT id, COALESCE(("
+        "SELECT number FROM %(table)s WHERE job_id = jobs.id "
+        "ORDER BY number DESC LIMIT 1 OFFSET %%s), ("
+        "SELECT MIN(number) FROM %(table)s WHERE job_id = jobs.id)"
+        ") AS since FROM %(jobs_table)s AS jobs WHERE id IN (%(jobs)s)"
+        ") AS recent JOIN %(table)s AS builds "
+        "ON builds.job_id = recent.id AND builds.number >= recent.since" % {
+            "table": table,
+            "jobs_table": connection.ops.quote_name(Job._meta.db_table),
+            "jobs": ", ".join(["%s"] * len(job_ids))})
+    params = [count - 1] + job_ids
+    if extra_build_ids:
+        sql += " UNION SELECT * FROM %s WHERE id IN (%s)" % (
+            table, ", ".join(["%s"] * len(extra_build_ids)))
+        params += extra_build_ids
+    sql += " ORDER BY job_id, number DESC"
+
+    for build in Build.objects.raw(sql, params):
+        recent_builds[build.job_id].append(build)
+    return recent_builds
 
 
 def get_build_for_row(builds, row):
@@ -20,34 +63,30 @@ def get_build_for_row(builds, row):
 def get_build_table_for_project(project):
     """
     Returns a tuple with header row, list of rows
-    """
-    dependencies = list(ProjectDependency.objects.filter(project=project))
 
-    recent_builds = {}
-    current_builds = {}
-    for projectdependency in dependencies:
-        dependency = projectdependency.dependency
-        recent_builds[dependency] = get_recent_builds_for_dependency(
-            dependency)
-        current_builds[dependency] = projectdependency.current_build
+    Each row has a BuildTableCell for each dependency, with the build, if
+    any, and whether it's the current build for the project.
+    """
+    dependencies = list(ProjectDependency.objects.filter(
+        project=project).select_related("dependency"))
+    recent_builds = get_recent_builds_for_jobs(
+        set(x.dependency.job_id for x in dependencies),
+        [x.current_build_id for x in dependencies])
 
     # Deal with possible extra builds outwith recent builds.
-    rows_to_count = 5
-    for projectdependency in dependencies:
-        dependency = projectdependency.dependency
-        if projectdependency.current_build not in recent_builds[dependency]:
-            recent_builds[dependency].append(projectdependency.current_build)
-            rows_to_count = 6
+    rows_to_count = RECENT_BUILDS
+    for builds in recent_builds.values():
+        rows_to_count = max(rows_to_count, len(builds))
 
     header_row = [x.dependency for x in dependencies]
     build_rows = []
     for row in range(rows_to_count):
         current_row = []
         for projectdependency in dependencies:
-            dependency = projectdependency.dependency
-            current_build = get_build_for_row(recent_builds[dependency], row)
-            current_row.append(
-                {"build": current_build,
-                 "current": current_builds[dependency] == current_build})
+            build = get_build_for_row(
+                recent_builds[projectdependency.dependency.job_id], row)
+            current_row.append(BuildTableCell(
+                build, build is not None and
+                build.pk == projectdependency.current_build_id))
         build_rows.append(current_row)
     return header_row, build_rows
@@ -1,6 +1,6 @@
 from django.shortcuts import get_object_or_404
 from django.views.generic import (
-    CreateView, ListView, DetailView, FormView, UpdateView)
+    CreateView, ListView, DetailView, FormView, TemplateView, UpdateView)
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect
@@ -8,12 +8,17 @@ from django.http import HttpResponseRedirect
 from braces.views import (
     LoginRequiredMixin, PermissionRequiredMixin, FormValidMessageMixin)
 
+from capomastro.pagination import KeysetPaginationMixin
 from jenkins.models import Build
 from projects.models import (
     Project, Dependency, ProjectDependency, ProjectBuild,
     ProjectBuildDependency)
+from projects.cache import (
+    get_cache_timeout, get_dependency_list_version, get_or_set,
+    get_project_version)
 from projects.forms import ProjectForm, DependencyForm, ProjectBuildForm
-from projects.helpers import build_project, build_dependency
+from projects.helpers import (
+    build_project, build_dependency, get_build_urls)
 from projects.utils import get_build_table_for_project
 
 
@@ -82,17 +87,23 @@ class InitiateProjectBuildView(LoginRequiredMixin, FormView):
         return HttpResponseRedirect(url)
 
 
-class ProjectBuildListView(LoginRequiredMixin, ListView):
+class ProjectBuildListView(
+        LoginRequiredMixin, KeysetPaginationMixin, TemplateView):
 
-    context_object_name = "projectbuilds"
-    model = ProjectBuild
+    template_name = "projects/projectbuild_list.html"
+    page_keys = ("requested_at", "pk")
+    page_fields = (
+        "build_id", "requested_at", "ended_at", "phase", "status")
 
-    def get_queryset(self):
+    def get_page_queryset(self):
         return ProjectBuild.objects.filter(
-            project=self._get_project_from_url())
+            project=self._get_project_from_url()).select_related(
+                "requested_by")
 
     def _get_project_from_url(self):
-        return get_object_or_404(Project, pk=self.kwargs["pk"])
+        if not hasattr(self, "_project"):
+            self._project = get_object_or_404(Project, pk=self.kwargs["pk"])
+        return self._project
 
     def get_context_data(self, **kwargs):
         """
@@ -100,6 +111,7 @@ class ProjectBuildListView(LoginRequiredMixin, ListView):
         """
         context = super(
             ProjectBuildListView, self).get_context_data(**kwargs)
+        context["projectbuilds"], context["next_page"] = self.get_page()
         context["project"] = self._get_project_from_url()
         return context
 
@@ -113,13 +125,13 @@ class ProjectBuildDetailView(LoginRequiredMixin, DetailView):
         project_pk = self.kwargs["project_pk"]
         build_pk = self.kwargs["build_pk"]
         return get_object_or_404(
-            ProjectBuild, project__pk=project_pk, pk=build_pk)
-
-    def _get_project_from_url(self):
-        return get_object_or_404(Project, pk=self.kwargs["project_pk"])
+            ProjectBuild.objects.select_related("project"),
+            project__pk=project_pk, pk=build_pk)
 
     def _get_build_dependencies(self, projectbuild):
-        return ProjectBuildDependency.objects.filter(projectbuild=projectbuild)
+        return ProjectBuildDependency.objects.filter(
+            projectbuild=projectbuild).select_related(
+                "build", "dependency__job")
 
     def get_context_data(self, **kwargs):
         """
@@ -127,9 +139,11 @@ class ProjectBuildDetailView(LoginRequiredMixin, DetailView):
         """
         context = super(
             ProjectBuildDetailView, self).get_context_data(**kwargs)
-        context["project"] = self._get_project_from_url()
-        context["dependencies"] = self._get_build_dependencies(
-            context["projectbuild"])
+        projectbuild = context["projectbuild"]
+        context["project"] = projectbuild.project
+        context["dependencies"] = self._get_build_dependencies(projectbuild)
+        context["artifacts"] = projectbuild.get_current_artifacts(
+            ).select_related("build")
         return context
 
 
@@ -145,9 +159,14 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
         context = super(
             ProjectDetailView, self).get_context_data(**kwargs)
         context["dependencies"] = ProjectDependency.objects.filter(
-            project=context["project"])
+            project=context["project"]).select_related(
+                "dependency", "current_build")
+        context["artifacts"] = context["project"].get_current_artifacts(
+            ).select_related("build").iterator()
         context["projectbuilds"] = ProjectBuild.objects.filter(
-            project=context["project"])[:5]
+            project=context["project"]).select_related("requested_by")[:5]
+        context["cache_version"] = get_project_version(context["project"])
+        context["cache_timeout"] = get_cache_timeout()
         return context
 
 
@@ -168,13 +187,33 @@ class DependencyCreateView(
 class DependencyListView(LoginRequiredMixin, ListView):
 
     context_object_name = "dependencies"
-    model = Dependency
+    queryset = Dependency.objects.select_related(
+        "job__jobtype", "job__latest_finished_build")
 
+    def get_context_data(self, **kwargs):
+        """
+        Supplement the dependencies with the version for the cache.
+        """
+        context = super(DependencyListView, self).get_context_data(**kwargs)
+        context["cache_version"] = get_dependency_list_version()
+        context["cache_timeout"] = get_cache_timeout()
+        return context
 
-class DependencyDetailView(LoginRequiredMixin, DetailView):
+
+class DependencyDetailView(
+        LoginRequiredMixin, KeysetPaginationMixin, DetailView):
 
     context_object_name = "dependency"
     model = Dependency
+    page_keys = ("number",)
+    page_fields = (
+        "number", "build_id", "phase", "status", "duration", "url")
+
+    def get_page_queryset(self):
+        if not hasattr(self, "object"):
+            # The JSON pages don't go through DetailView.get.
+            self.object = self.get_object()
+        return Build.objects.filter(job__dependency=self.object)
 
     def get_context_data(self, **kwargs):
         """
@@ -182,8 +221,9 @@ class DependencyDetailView(LoginRequiredMixin, DetailView):
         """
         context = super(
             DependencyDetailView, self).get_context_data(**kwargs)
-        context["builds"] = Build.objects.filter(
-            job=context["dependency"].job)
+        context["builds"], context["next_page"] = self.get_page()
+        context["build_urls"] = get_build_urls(
+            x.build_id for x in context["builds"])
         context["projects"] = Project.objects.filter(
             dependencies=context["dependency"])
         return context
@@ -218,7 +258,11 @@ class ProjectDependenciesView(LoginRequiredMixin, DetailView):
         """
         context = super(
             ProjectDependenciesView, self).get_context_data(**kwargs)
-        header, table = get_build_table_for_project(context["project"])
+        project = context["project"]
+        header, table = get_or_set(
+            "project_dependencies:%d" % project.pk,
+            get_project_version(project),
+            lambda: get_build_table_for_project(project))
         context["builds_header"] = header
         context["builds_table"] = table
         return context